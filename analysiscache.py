@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import shutil
+import zipfile
+
+import numpy as np
+
+import pptxpackage
+
+#--------------------------------------------
+# スライド解析結果（画像、phash、テキストベクトル）の永続キャッシュ
+#
+# キャッシュディレクトリの構成
+#   decks/<デッキキー>.json     デッキのスライドキーの一覧
+#   slides/<スライドキー>/      スライド1枚分の解析結果
+#       slide.png               export 画像
+#       slide.json              phash など
+#       textvector.npy          テキストベクトル
+#
+# デッキキーは pptx ファイル全体のハッシュ、スライドキーはデッキキーに
+# スライドの XML と参照パーツ（画像などのメディア）を加えたハッシュ
+#
+# 画像を出力しないモード（text, structure）の解析結果はデッキ単位で保存する
+#   decks/<デッキキー>.json               スライドごとのタイトル（structure ではシェイプも）
+#   decks/<デッキキー>.textvectors.npy    テキストベクトルの行列
+# この場合のデッキキーにはモードの名前も含める
+#--------------------------------------------
+
+# キャッシュサイズの上限（バイト）のデフォルト
+default_max_bytes = 2 * 1024 * 1024 * 1024
+
+# 上限を超えたときに、上限のこの割合まで減らす（保存のたびにキャッシュ全体を調べずに済むように余裕を持たせる）
+evict_ratio = 0.9
+
+_imagefile = "slide.png"
+_metafile = "slide.json"
+_vectorfile = "textvector.npy"
+_textvectors_suffix = ".textvectors.npy"
+
+# 画像とテキストを解析するモード（スライド単位で保存する）
+image_mode = "image"
+
+
+# ファイル内容の sha256 を16進文字列で返す
+def file_digest(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# ディレクトリ配下のファイルサイズの合計を返す
+def _directory_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            total += os.path.getsize(os.path.join(dirpath, filename))
+    return total
+
+
+class AnalysisCache:
+    def __init__(self, cachedir, max_bytes=default_max_bytes, salt=""):
+        self.cachedir = os.path.abspath(cachedir)
+        self.max_bytes = max_bytes
+        # キーに混ぜる値（テキストベクトル化のモデル名など）
+        self.salt = salt
+        self.deckdir = os.path.join(self.cachedir, "decks")
+        self.slidedir = os.path.join(self.cachedir, "slides")
+        os.makedirs(self.deckdir, exist_ok=True)
+        os.makedirs(self.slidedir, exist_ok=True)
+        # キャッシュサイズの合計（バイト）。最初の保存で1回だけ調べ、以降は保存したファイルの分を足す
+        self._total_bytes = None
+
+    # デッキキーを返す。image 以外のモードではモードの名前もキーに含める
+    def deck_key(self, pptxpath, mode=image_mode):
+        prefix = self.salt if mode == image_mode else f"{self.salt}:{mode}:"
+        return hashlib.sha256((prefix + file_digest(pptxpath)).encode("utf-8")).hexdigest()
+
+    # スライドキーのリストをスライドの順序で返す
+    def slide_keys(self, pptxpath, deckkey):
+        keys = []
+        with zipfile.ZipFile(pptxpath) as zf:
+            for partname in pptxpackage.slide_partnames(zf):
+                digest = hashlib.sha256(deckkey.encode("utf-8"))
+                relsname = pptxpackage.rels_partname(partname)
+                for name in [partname, relsname] + sorted(pptxpackage.related_partnames(zf, partname)):
+                    if name in zf.NameToInfo:
+                        digest.update(name.encode("utf-8"))
+                        digest.update(zf.read(name))
+                keys.append(digest.hexdigest())
+        return keys
+
+    def _deck_manifest(self, deckkey):
+        return os.path.join(self.deckdir, deckkey + ".json")
+
+    def _slide_entry(self, slidekey):
+        return os.path.join(self.slidedir, slidekey)
+
+    # デッキの全スライドがキャッシュにあれば、スライドのリストを返す。なければ None
+    # 各要素は {"imagepath": キャッシュ内の画像パス, "imagehash": phash の16進文字列, "textvector": ndarray}
+    # image 以外のモードでは、保存したスライドの値（"slidetitle" など）に "textvector" を加えたもの
+    def load_deck(self, pptxpath, mode=image_mode):
+        if mode != image_mode:
+            return self._load_text_deck(pptxpath, mode)
+        manifest = self._deck_manifest(self.deck_key(pptxpath))
+        if not os.path.exists(manifest):
+            return None
+        with open(manifest, encoding="utf-8") as f:
+            slidekeys = json.load(f)["slides"]
+
+        slides = []
+        for slidekey in slidekeys:
+            entry = self._slide_entry(slidekey)
+            imagepath = os.path.join(entry, _imagefile)
+            metapath = os.path.join(entry, _metafile)
+            vectorpath = os.path.join(entry, _vectorfile)
+            if not all(os.path.exists(path) for path in (imagepath, metapath, vectorpath)):
+                return None
+            with open(metapath, encoding="utf-8") as f:
+                meta = json.load(f)
+            slides.append({
+                "imagepath": imagepath,
+                "imagehash": meta["imagehash"],
+                "textvector": np.load(vectorpath),
+            })
+
+        # 最終利用日時を更新する（LRU の判定に使う）
+        os.utime(manifest)
+        for slidekey in slidekeys:
+            os.utime(self._slide_entry(slidekey))
+        return slides
+
+    # デッキの解析結果をキャッシュに保存する
+    # slides の各要素は {"imagepath": export 画像のパス, "imagehash": ImageHash, "textvector": ndarray}
+    # image 以外のモードでは、JSON に保存できる値（"slidetitle" など）と "textvector"
+    def store_deck(self, pptxpath, slides, mode=image_mode):
+        if mode != image_mode:
+            self._store_text_deck(pptxpath, slides, mode)
+            return
+        deckkey = self.deck_key(pptxpath)
+        slidekeys = self.slide_keys(pptxpath, deckkey)
+        if len(slidekeys) != len(slides):
+            return
+
+        written = []
+        for slidekey, slide in zip(slidekeys, slides):
+            entry = self._slide_entry(slidekey)
+            os.makedirs(entry, exist_ok=True)
+            shutil.copyfile(slide["imagepath"], os.path.join(entry, _imagefile))
+            np.save(os.path.join(entry, _vectorfile), np.asarray(slide["textvector"], dtype=np.float32))
+            with open(os.path.join(entry, _metafile), "w", encoding="utf-8") as f:
+                json.dump({"imagehash": str(slide["imagehash"])}, f)
+            written += [os.path.join(entry, name) for name in (_imagefile, _vectorfile, _metafile)]
+
+        manifest = self._deck_manifest(deckkey)
+        with open(manifest, "w", encoding="utf-8") as f:
+            json.dump({"pptxfile": os.path.basename(pptxpath), "slides": slidekeys}, f, indent=4)
+        written.append(manifest)
+
+        self._add_bytes(written)
+
+    def _load_text_deck(self, pptxpath, mode):
+        manifest = self._deck_manifest(self.deck_key(pptxpath, mode))
+        vectorpath = os.path.splitext(manifest)[0] + _textvectors_suffix
+        if not os.path.exists(manifest) or not os.path.exists(vectorpath):
+            return None
+        with open(manifest, encoding="utf-8") as f:
+            records = json.load(f)["slides"]
+        textvectors = np.load(vectorpath)
+        if len(textvectors) != len(records):
+            return None
+
+        os.utime(manifest)
+        os.utime(vectorpath)
+        return [dict(record, textvector=textvector) for record, textvector in zip(records, textvectors)]
+
+    def _store_text_deck(self, pptxpath, slides, mode):
+        manifest = self._deck_manifest(self.deck_key(pptxpath, mode))
+        records = [{key: value for key, value in slide.items() if key != "textvector"} for slide in slides]
+        textvectors = np.array([slide["textvector"] for slide in slides], dtype=np.float32)
+        vectorpath = os.path.splitext(manifest)[0] + _textvectors_suffix
+        np.save(vectorpath, textvectors)
+        with open(manifest, "w", encoding="utf-8") as f:
+            json.dump({"pptxfile": os.path.basename(pptxpath), "mode": mode, "slides": records}, f, ensure_ascii=False)
+
+        self._add_bytes([manifest, vectorpath])
+
+    # 保存したファイルのサイズをキャッシュサイズの合計に足し、上限を超えたら削除する
+    # 同じキーに上書きした分も足すので合計は多めになるが、evict() で調べ直して正しい値に戻る
+    def _add_bytes(self, paths):
+        if self._total_bytes is None:
+            self.evict()
+            return
+        self._total_bytes += sum(os.path.getsize(path) for path in paths)
+        if self._total_bytes > self.max_bytes:
+            self.evict()
+
+    # キャッシュサイズが max_bytes を超えていれば、最終利用日時の古いものから max_bytes × ratio まで削除する
+    def evict(self, ratio=evict_ratio):
+        entries = []
+        for name in os.listdir(self.slidedir):
+            path = self._slide_entry(name)
+            entries.append((os.path.getmtime(path), _directory_size(path), path))
+        for name in os.listdir(self.deckdir):
+            path = os.path.join(self.deckdir, name)
+            entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes * ratio:
+                    break
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+                total -= size
+        self._total_bytes = total
@@ -0,0 +1,80 @@
+import json
+import os
+
+import numpy as np
+
+import slidecompare
+
+#--------------------------------------------
+# 解析結果（derived_analyzed.json, base_analyzed.json）の保存と読み込み
+#
+# テキストベクトルと phash は JSON には書かず、同じディレクトリの
+# バイナリファイル（numpy の .npy、メモリマップで読み込み可能）に保存する
+#   <名前>.textvectors.npy  (スライド数, 384) の float32
+#   <名前>.imagehashes.npy  (スライド数,) の uint64（64bit の phash をパックしたもの）
+# JSON の各スライドの "row" がこれらの行番号になる
+#--------------------------------------------
+
+_textvectors_suffix = ".textvectors.npy"
+_imagehashes_suffix = ".imagehashes.npy"
+
+
+# JSON ファイルのパスから、バイナリファイルのパスを返す
+def _sidecar_path(jsonpath, suffix):
+    return os.path.splitext(jsonpath)[0] + suffix
+
+
+# 解析結果を保存する
+# analyzed["textvectors"] は (スライド数, 384) の行列、
+# analyzed["imagehashes"] は pack_imagehashes() の配列（画像を比較しない場合はなくてよい）
+# 各スライドの "textvector", "imagehash" は JSON に書かない
+def save_analyzed(analyzed, jsonpath):
+    sidecar = {}
+
+    textvectors_path = _sidecar_path(jsonpath, _textvectors_suffix)
+    np.save(textvectors_path, np.asarray(analyzed["textvectors"], dtype=np.float32))
+    sidecar["textvectors"] = os.path.basename(textvectors_path)
+
+    if analyzed.get("imagehashes") is not None:
+        imagehashes_path = _sidecar_path(jsonpath, _imagehashes_suffix)
+        np.save(imagehashes_path, np.asarray(analyzed["imagehashes"], dtype=np.uint64))
+        sidecar["imagehashes"] = os.path.basename(imagehashes_path)
+
+    output = {key: value for key, value in analyzed.items() if key not in ("textvectors", "imagehashes")}
+    output["sidecar"] = sidecar
+    output["slides"] = []
+    for row, slide in enumerate(analyzed["slides"]):
+        record = {key: value for key, value in slide.items() if key not in ("textvector", "imagehash")}
+        record["row"] = row
+        output["slides"].append(record)
+
+    with open(jsonpath, "w", encoding="utf-8") as f:
+        json.dump(output, f, ensure_ascii=False, indent=4)
+
+
+# save_analyzed() で保存した解析結果を読み込む
+# analyzed["textvectors"], analyzed["imagehashes"] に行列を、
+# 各スライドの "textvector", "imagehash"(ImageHash) にその行を復元する
+# mmap が True ならバイナリファイルをメモリマップで読み込む
+def load_analyzed(jsonpath, mmap=True):
+    with open(jsonpath, encoding="utf-8") as f:
+        analyzed = json.load(f)
+
+    directory = os.path.dirname(os.path.abspath(jsonpath))
+    sidecar = analyzed.pop("sidecar")
+    mmap_mode = "r" if mmap else None
+
+    textvectors = np.load(os.path.join(directory, sidecar["textvectors"]), mmap_mode=mmap_mode)
+    analyzed["textvectors"] = textvectors
+    imagehashes = None
+    if "imagehashes" in sidecar:
+        imagehashes = np.load(os.path.join(directory, sidecar["imagehashes"]), mmap_mode=mmap_mode)
+    analyzed["imagehashes"] = imagehashes
+
+    for slide in analyzed["slides"]:
+        row = slide.pop("row")
+        slide["textvector"] = textvectors[row]
+        if imagehashes is not None:
+            slide["imagehash"] = slidecompare.unpack_imagehash(imagehashes[row])
+
+    return analyzed
@@ -0,0 +1,291 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import runpy
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+#--------------------------------------------
+# 性能のベンチマーク
+#
+# syntheticdeck.py で合成したデッキ（base と、その一部を変えた derived）を使って、
+# 主な処理の時間を計り、結果を JSON で出力する。--baseline で前回の結果（JSON）を指定すると、
+# 許容範囲 (--tolerance) を超えて遅くなった項目を REGRESSION として失敗にする
+#
+# PowerPoint は使わず、compare-pptx.py は fake レンダラーで実行する。
+# テキストのベクトル化は、デフォルトではモデルの代わりに単語のハッシュでベクトルを作る
+# (--embedder hash)。モデルの時間も含めて計る場合は --embedder model を指定する
+#
+#   python benchmarks/performance.py --slides 200 --output result.json
+#   python benchmarks/performance.py --slides 200 --baseline result.json
+#--------------------------------------------
+
+# リポジトリのルート
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repodir)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import syntheticdeck  # noqa: E402
+
+# 計測の繰り返し回数のデフォルト（最小値を採用する）
+defaultrepeat = 3
+
+# 遅くなったとみなす割合のデフォルト（0.25 なら基準より 25% 以上遅い場合）
+defaulttolerance = 0.25
+
+# これより短い差は誤差とみなす（秒）
+defaultminseconds = 0.02
+
+# 変更するスライドの割合のデフォルト（derived デッキ）
+defaultchanged = 0.1
+
+# slide_similarity の計測で比較するスライド数のデフォルト（ペア数はこの2乗）
+defaultsimilarityslides = 40
+
+# 結果の JSON の形式のバージョン
+resultversion = 1
+
+# --embedder hash で使うモデル名（ストアやキャッシュで本物のモデルのベクトルと混ざらないように）
+hashmodelname = "benchmark-hash"
+
+
+# モデルの代わりに、単語のハッシュからベクトルを作る
+class HashEncoder:
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def encode(self, texts, batch_size=64, convert_to_numpy=True, **kwargs):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.split():
+                digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+                vectors[i, int.from_bytes(digest, "little") % self.dim] += 1.0
+        return vectors
+
+
+# 関数を repeat 回実行して、(最小の経過時間（秒）, 最後の戻り値) を返す
+# setup は毎回の計測の前に呼ばれる（時間には含めない）
+def measure(function, repeat, setup=None):
+    best = None
+    result = None
+    for _ in range(max(1, repeat)):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+# スクリプトを __main__ として、標準出力を捨てて実行する
+def run_script(script, argv):
+    saved = sys.argv
+    sys.argv = [script] + argv
+    try:
+        with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+            runpy.run_path(os.path.join(repodir, script), run_name="__main__")
+    finally:
+        sys.argv = saved
+
+
+# ベンチマークを実行して、結果の辞書 {名前: {"seconds", "items", "unit", "rate"}} を返す
+# only が指定された場合は、名前にその文字列を含むものだけを実行する
+def run_benchmarks(args, workdir):
+    import calcslidesimilarity
+    import pptxanalyzer
+    import pptxxmlanalyzer
+
+    results = {}
+
+    def record(name, function, items, unit, setup=None):
+        if args.only and not any(word in name for word in args.only):
+            return None
+        seconds, result = measure(function, args.repeat, setup)
+        results[name] = {
+            "seconds": round(seconds, 6),
+            "items": items,
+            "unit": unit,
+            "rate": round(items / seconds, 3) if seconds > 0 else None,
+        }
+        print(f"{seconds:9.3f}s  {results[name]['rate'] or 0:12.1f} {unit}/s  {name}")
+        return result
+
+    # デッキの作成（時間は計らない）
+    contents = syntheticdeck.deck_contents(args.slides, args.shapes, args.words, args.template_ratio, args.images, args.seed)
+    revised = syntheticdeck.make_revision(contents, args.changed, words=args.words, seed=args.seed + 1)
+    basepath = os.path.join(workdir, "base.pptx")
+    derivedpath = os.path.join(workdir, "derived.pptx")
+    syntheticdeck.write_deck(basepath, contents, args.image_size, args.seed)
+    syntheticdeck.write_deck(derivedpath, revised, args.image_size, args.seed)
+    slides = len(contents)
+
+    # スライドの解析
+    record("pptxanalyzer.analyze_pptx", lambda: pptxanalyzer.analyze_pptx(basepath), slides, "slides")
+    record("pptxxmlanalyzer.analyze_pptx", lambda: pptxxmlanalyzer.analyze_pptx(basepath), slides, "slides")
+
+    # スライド構成の類似度
+    base_slides = pptxanalyzer.flatten_positions(pptxxmlanalyzer.analyze_pptx(basepath))["slides"]
+    derived_slides = pptxanalyzer.flatten_positions(pptxxmlanalyzer.analyze_pptx(derivedpath))["slides"]
+    count = min(args.similarity_slides, len(base_slides), len(derived_slides))
+    record(
+        "calcslidesimilarity.slide_similarity",
+        lambda: calcslidesimilarity.slide_similarity_matrix(derived_slides[:count], base_slides[:count]),
+        count * count, "pairs", setup=calcslidesimilarity.clear_text_cache)
+    record(
+        "calcslidesimilarity.find_similar_slide_pairs(lsh)",
+        lambda: calcslidesimilarity.find_similar_slide_pairs(base_slides, method="lsh"),
+        len(base_slides), "slides", setup=calcslidesimilarity.clear_text_cache)
+    record(
+        "calcslidesimilarity.find_similar_slide_pairs(exact)",
+        lambda: calcslidesimilarity.find_similar_slide_pairs(base_slides[:count], method="exact"),
+        count, "slides", setup=calcslidesimilarity.clear_text_cache)
+
+    # tvdiff-pptx2.py（スクリプト名に "-" があるので、モジュールとしては読み込めない）
+    tvdiff2 = runpy.run_path(os.path.join(repodir, "tvdiff-pptx2.py"), run_name="benchmark")
+    record(
+        "tvdiff-pptx2.compare_presentations",
+        lambda: tvdiff2["compare_presentations"](basepath, derivedpath),
+        len(contents) * len(revised), "pairs")
+
+    # compare-pptx.py（fake レンダラー）。毎回新しい出力ディレクトリに出力する
+    exportroots = []
+
+    def new_exportroot():
+        exportroots.append(os.path.join(workdir, f"export{len(exportroots)}"))
+
+    def compare(mode):
+        run_script("compare-pptx.py", [
+            "--mode", mode, "--renderer", "fake", "--sourcedir", workdir, "--exportroot", exportroots[-1],
+            "derived.pptx", "base.pptx"])
+
+    record("compare-pptx.py --mode image (fake renderer)", lambda: compare("image"), len(revised), "slides", setup=new_exportroot)
+    imageroot = exportroots[-1] if exportroots else None
+    record("compare-pptx.py --mode text", lambda: compare("text"), len(revised), "slides", setup=new_exportroot)
+    record("compare-pptx.py --mode structure", lambda: compare("structure"), len(revised), "slides", setup=new_exportroot)
+
+    # HTML レポートの出力（--mode image の結果を使う）
+    if imageroot is not None:
+        import analyzedstore
+        comparepptx = runpy.run_path(os.path.join(repodir, "compare-pptx.py"), run_name="benchmark")
+        derived_analyzed = analyzedstore.load_analyzed(os.path.join(imageroot, "derived_analyzed.json"))
+        report_args = argparse.Namespace(
+            exportroot=imageroot,
+            deriveddir=os.path.join(imageroot, "derived"),
+            basedir=os.path.join(imageroot, "base"),
+            diffdir=os.path.join(imageroot, "diff"),
+            thumb_width=comparepptx["defaultthumbwidth"],
+            thumb_format=comparepptx["defaultthumbformat"],
+            page_size=comparepptx["defaultpagesize"],
+            diff_workers=comparepptx["defaultdiffworkers"])
+
+        def output_html():
+            with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+                comparepptx["output_html"](derived_analyzed, report_args)
+
+        record("compare-pptx.output_html", output_html, len(revised), "slides")
+
+    return results
+
+
+# 結果を基準と比べて、遅くなった項目の名前のリストを返す
+def compare_baseline(result, baseline, tolerance, min_seconds):
+    if baseline.get("parameters") != result["parameters"]:
+        print("注意: 基準とデッキのパラメータが異なります")
+        print(f"  基準: {baseline.get('parameters')}")
+        print(f"  今回: {result['parameters']}")
+
+    regressions = []
+    print(f"{'基準':>10} {'今回':>10} {'比':>7}")
+    for name, current in result["results"].items():
+        reference = baseline.get("results", {}).get(name)
+        if reference is None:
+            print(f"{'-':>10} {current['seconds']:9.3f}s {'-':>7}  {name}")
+            continue
+        ratio = current["seconds"] / reference["seconds"] if reference["seconds"] > 0 else float("inf")
+        slower = current["seconds"] > reference["seconds"] * (1 + tolerance) and current["seconds"] - reference["seconds"] > min_seconds
+        if slower:
+            regressions.append(name)
+        print(f"{reference['seconds']:9.3f}s {current['seconds']:9.3f}s {ratio:6.2f}x  {name}" + ("  REGRESSION" if slower else ""))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合成デッキで主な処理の時間を計り、JSON で出力する")
+    parser.add_argument("--slides", type=int, default=syntheticdeck.defaultslides, help=f"スライド数（デフォルト: {syntheticdeck.defaultslides}）")
+    parser.add_argument("--shapes", type=int, default=syntheticdeck.defaultshapes, help=f"スライドあたりのテキストのシェイプ数（デフォルト: {syntheticdeck.defaultshapes}）")
+    parser.add_argument("--words", type=int, default=syntheticdeck.defaultwords, help=f"シェイプあたりの単語数（デフォルト: {syntheticdeck.defaultwords}）")
+    parser.add_argument("--template-ratio", type=float, default=syntheticdeck.defaulttemplateratio, help=f"同じ内容を繰り返すスライドの割合（デフォルト: {syntheticdeck.defaulttemplateratio}）")
+    parser.add_argument("--images", type=int, default=syntheticdeck.defaultimages, help=f"スライドあたりの埋め込み画像数（デフォルト: {syntheticdeck.defaultimages}）")
+    parser.add_argument("--image-size", type=int, default=syntheticdeck.defaultimagesize, help=f"埋め込み画像の一辺のピクセル数（デフォルト: {syntheticdeck.defaultimagesize}）")
+    parser.add_argument("--changed", type=float, default=defaultchanged, help=f"derived デッキで変更するスライドの割合（デフォルト: {defaultchanged}）")
+    parser.add_argument("--similarity-slides", type=int, default=defaultsimilarityslides, help=f"slide_similarity と exact の計測で使うスライド数（デフォルト: {defaultsimilarityslides}）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数の種（デフォルト: 0）")
+    parser.add_argument("--repeat", type=int, default=defaultrepeat, help=f"計測の繰り返し回数（デフォルト: {defaultrepeat}）")
+    parser.add_argument("--embedder", type=str, choices=["hash", "model"], default="hash", help="テキストのベクトル化 hash: 単語のハッシュ（モデルを読み込まない）, model: 本物のモデル（デフォルト: hash）")
+    parser.add_argument("--only", type=str, nargs="*", default=None, help="名前にこの文字列を含む項目だけを計る")
+    parser.add_argument("--output", type=str, default=None, help="結果を保存する JSON ファイル")
+    parser.add_argument("--baseline", type=str, default=None, help="比べる基準の結果（JSON ファイル）")
+    parser.add_argument("--tolerance", type=float, default=defaulttolerance, help=f"遅くなったとみなす割合（デフォルト: {defaulttolerance}）")
+    parser.add_argument("--min-seconds", type=float, default=defaultminseconds, help=f"これより短い差は誤差とみなす秒数（デフォルト: {defaultminseconds}）")
+    parser.add_argument("--workdir", type=str, default=None, help="デッキと出力を置くディレクトリ（省略時は一時ディレクトリを作って最後に消す）")
+    args = parser.parse_args()
+
+    import slideembedding
+    # 永続ストアを使うと2回目以降の計測でベクトル化が省かれるので使わない
+    os.environ.pop(slideembedding.store_env, None)
+    if args.embedder == "hash":
+        slideembedding.use_model(HashEncoder(slideembedding.embedding_dim), hashmodelname)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="compare-pptx-benchmark-")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        results = run_benchmarks(args, workdir)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "version": resultversion,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "parameters": {
+            "slides": args.slides,
+            "shapes": args.shapes,
+            "words": args.words,
+            "template_ratio": args.template_ratio,
+            "images": args.images,
+            "image_size": args.image_size,
+            "changed": args.changed,
+            "similarity_slides": args.similarity_slides,
+            "seed": args.seed,
+            "embedder": args.embedder,
+        },
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_baseline(result, baseline, args.tolerance, args.min_seconds)
+        if regressions:
+            print(f"基準より {args.tolerance:.0%} 以上遅くなった項目があります: {len(regressions)} 件")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+#--------------------------------------------
+# 起動時間のベンチマーク
+#
+# 各スクリプトの --version, --help などの時間を計り、予算（秒）を超えたら失敗にする。
+# また、スクリプトを読み込んだだけで重いモジュール（torch, sentence-transformers,
+# scikit-learn, comtypes, python-pptx）が読み込まれていないことを確認する
+#
+#   python benchmarks/startup.py [--budget 秒] [--repeat 回数]
+#--------------------------------------------
+
+# リポジトリのルート
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 起動時間の予算（秒）のデフォルト
+defaultbudget = 2.0
+
+# 計測の繰り返し回数のデフォルト（最小値を採用する）
+defaultrepeat = 3
+
+# 計測するコマンド（スクリプトと引数）
+commands = [
+    ["compare-pptx.py", "--version"],
+    ["compare-pptx.py", "--help"],
+    ["pptx-to-json.py", "--help"],
+    ["calcslidesimilarityinapptx.py"],
+    ["tvdiff-pptx.py"],
+]
+
+# 読み込んだだけのスクリプト
+scripts = [
+    "compare-pptx.py",
+    "pptx-to-json.py",
+    "calcslidesimilarityinapptx.py",
+    "tvdiff-pptx.py",
+    "tvdiff-pptx2.py",
+]
+
+# 起動時に読み込まれてはいけないモジュール
+heavymodules = ["torch", "sentence_transformers", "sklearn", "comtypes", "pptx"]
+
+# スクリプトを __main__ 以外として読み込み、読み込まれた重いモジュールを表示するコード
+_importcheck = """
+import runpy, sys
+sys.argv = [sys.argv[1]]
+runpy.run_path(sys.argv[0], run_name="startupcheck")
+print(",".join(m for m in {modules!r} if m in sys.modules))
+"""
+
+
+# コマンドを repeat 回実行して、最小の経過時間（秒）を返す
+def time_command(args, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=repodir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+# スクリプトを読み込んだだけで読み込まれた重いモジュールのリストを返す
+def heavy_imports(script):
+    code = _importcheck.format(modules=heavymodules)
+    result = subprocess.run([sys.executable, "-c", code, script], cwd=repodir, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{script} の読み込みに失敗しました\n{result.stderr}")
+    loaded = result.stdout.strip().splitlines()[-1] if result.stdout.strip() else ""
+    return [m for m in loaded.split(",") if m]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="各スクリプトの起動時間を計測し、予算を超えたら失敗にする")
+    parser.add_argument("--budget", type=float, default=defaultbudget, help=f"起動時間の予算（秒）（デフォルト: {defaultbudget}）")
+    parser.add_argument("--repeat", type=int, default=defaultrepeat, help=f"計測の繰り返し回数（デフォルト: {defaultrepeat}）")
+    args = parser.parse_args()
+
+    failed = False
+    for command in commands:
+        elapsed = time_command(command, max(1, args.repeat))
+        status = "ok" if elapsed <= args.budget else "OVER"
+        failed |= elapsed > args.budget
+        print(f"{status:4} {elapsed:6.3f}s  {' '.join(command)}")
+
+    for script in scripts:
+        loaded = heavy_imports(script)
+        status = "ok" if not loaded else "HEAVY"
+        failed |= bool(loaded)
+        print(f"{status:4} import {script}" + (f"  ({', '.join(loaded)})" if loaded else ""))
+
+    if failed:
+        print(f"起動時間の予算 {args.budget}s を超えたか、重いモジュールが起動時に読み込まれています")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import argparse
+import io
+import random
+
+#--------------------------------------------
+# ベンチマーク用の合成デッキ（pptx）を python-pptx で作る
+#
+#   slides        : スライド数
+#   shapes        : スライドあたりのテキストのシェイプ数（タイトルを除く）
+#   words         : シェイプあたりの単語数
+#   template_ratio: 同じ内容（テンプレート）を繰り返すスライドの割合（0～1.0）
+#   images        : スライドあたりの埋め込み画像数
+#   image_size    : 埋め込み画像の一辺のピクセル数
+#
+# 同じ seed なら同じ内容のデッキになる。make_revision() は既存のデッキの一部のスライドを
+# 変更・追加・削除した新しい版を作る（compare-pptx.py などの比較用）
+#
+#   python benchmarks/syntheticdeck.py out.pptx --slides 200 --shapes 6 --words 12
+#--------------------------------------------
+
+# パラメータのデフォルト
+defaultslides = 100
+defaultshapes = 5
+defaultwords = 12
+defaulttemplateratio = 0.3
+defaultimages = 1
+defaultimagesize = 64
+
+# 単語の元になる語彙
+_vocabulary = [
+    "sales", "revenue", "growth", "market", "customer", "product", "strategy", "plan",
+    "quarter", "target", "result", "cost", "margin", "team", "project", "risk",
+    "schedule", "budget", "review", "summary", "overview", "issue", "action", "status",
+    "design", "system", "service", "support", "quality", "process", "data", "report",
+]
+
+# テンプレートの数（template_ratio のスライドは、この数のテンプレートのどれかと同じ内容になる）
+_templates = 5
+
+
+# 単語数 words の文を作る
+def _sentence(rng, words):
+    return " ".join(rng.choice(_vocabulary) + (str(rng.randint(0, 999)) if rng.random() < 0.5 else "") for _ in range(words))
+
+
+# スライドの内容 (タイトル, [(テキスト, left, top, width, height)], 画像の位置のリスト) を作る
+# 位置はスライドの幅・高さに対する比率
+def _slide_content(rng, shapes, words, images):
+    title = _sentence(rng, 4)
+    boxes = []
+    for k in range(shapes):
+        boxes.append((
+            _sentence(rng, words),
+            rng.uniform(0.02, 0.5),
+            0.2 + 0.75 * k / max(1, shapes),
+            rng.uniform(0.3, 0.48),
+            0.7 / max(1, shapes),
+        ))
+    pictures = [(rng.uniform(0.55, 0.8), rng.uniform(0.2, 0.7)) for _ in range(images)]
+    return title, boxes, pictures
+
+
+# 埋め込み画像（PNG）のバイト列を作る
+def _image_bytes(rng, size):
+    from PIL import Image
+    pixels = bytes(rng.getrandbits(8) for _ in range(size * size * 3))
+    buffer = io.BytesIO()
+    Image.frombytes("RGB", (size, size), pixels).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+# スライドの内容のリストを作る
+def deck_contents(slides=defaultslides, shapes=defaultshapes, words=defaultwords, template_ratio=defaulttemplateratio, images=defaultimages, seed=0):
+    rng = random.Random(seed)
+    templates = [_slide_content(rng, shapes, words, images) for _ in range(_templates)]
+    contents = []
+    for _ in range(slides):
+        if rng.random() < template_ratio:
+            contents.append(rng.choice(templates))
+        else:
+            contents.append(_slide_content(rng, shapes, words, images))
+    return contents
+
+
+# スライドの内容のリストから pptx ファイルを作る
+def write_deck(path, contents, image_size=defaultimagesize, seed=0):
+    from pptx import Presentation
+    from pptx.util import Emu
+
+    rng = random.Random(seed)
+    image_pool = [_image_bytes(rng, image_size) for _ in range(4)]
+
+    prs = Presentation()
+    width, height = prs.slide_width, prs.slide_height
+    layout = prs.slide_layouts[5]  # タイトルのみ
+    for title, boxes, pictures in contents:
+        slide = prs.slides.add_slide(layout)
+        slide.shapes.title.text = title
+        for text, left, top, box_width, box_height in boxes:
+            textbox = slide.shapes.add_textbox(Emu(int(left * width)), Emu(int(top * height)), Emu(int(box_width * width)), Emu(int(box_height * height)))
+            textbox.text_frame.text = text
+        for k, (left, top) in enumerate(pictures):
+            # 同じ画像は pptx の中で1つのパーツにまとめられる
+            image = image_pool[(len(title) + k) % len(image_pool)]
+            slide.shapes.add_picture(io.BytesIO(image), Emu(int(left * width)), Emu(int(top * height)), Emu(int(0.15 * width)))
+    prs.save(path)
+
+
+# 新しい版の内容を作る。changed の割合のスライドのテキストを変え、added 枚を追加し、removed 枚を削除する
+def make_revision(contents, changed=0.1, added=0, removed=0, words=defaultwords, seed=1):
+    rng = random.Random(seed)
+    revised = list(contents)
+    for i in range(len(revised)):
+        if rng.random() < changed:
+            title, boxes, pictures = revised[i]
+            if boxes:
+                k = rng.randrange(len(boxes))
+                boxes = list(boxes)
+                boxes[k] = (_sentence(rng, words),) + boxes[k][1:]
+            revised[i] = (title, boxes, pictures)
+    for _ in range(min(removed, len(revised))):
+        del revised[rng.randrange(len(revised))]
+    for _ in range(added):
+        shapes = len(contents[0][1]) if contents else defaultshapes
+        images = len(contents[0][2]) if contents else defaultimages
+        revised.insert(rng.randint(0, len(revised)), _slide_content(rng, shapes, words, images))
+    return revised
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ベンチマーク用の合成デッキ（pptx）を作る")
+    parser.add_argument("output", help="出力する pptx ファイル")
+    parser.add_argument("--slides", type=int, default=defaultslides, help=f"スライド数（デフォルト: {defaultslides}）")
+    parser.add_argument("--shapes", type=int, default=defaultshapes, help=f"スライドあたりのテキストのシェイプ数（デフォルト: {defaultshapes}）")
+    parser.add_argument("--words", type=int, default=defaultwords, help=f"シェイプあたりの単語数（デフォルト: {defaultwords}）")
+    parser.add_argument("--template-ratio", type=float, default=defaulttemplateratio, help=f"同じ内容を繰り返すスライドの割合（デフォルト: {defaulttemplateratio}）")
+    parser.add_argument("--images", type=int, default=defaultimages, help=f"スライドあたりの埋め込み画像数（デフォルト: {defaultimages}）")
+    parser.add_argument("--image-size", type=int, default=defaultimagesize, help=f"埋め込み画像の一辺のピクセル数（デフォルト: {defaultimagesize}）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数の種（デフォルト: 0）")
+    args = parser.parse_args()
+
+    contents = deck_contents(args.slides, args.shapes, args.words, args.template_ratio, args.images, args.seed)
+    write_deck(args.output, contents, args.image_size, args.seed)
+    print(f"作成しました: {args.output} ({args.slides} スライド)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,12 @@
+from collections import Counter, OrderedDict
 from difflib import SequenceMatcher
 from math import sqrt
 from itertools import combinations
 
+import numpy as np
+
+import slidelsh
+
 #前提：各スライドは以下の形式で格納されていると仮定
 # 座標値はスライドのサイズに対する比率で格納されている
 slidedataformat = """
@@ -40,6 +45,13 @@ shape_threshold = 0.75
 # テキストの完全一致を要求する場合は True にする
 text_strictmatch = False    
 
+# 種類・テキスト・位置が同じ shape を1つにまとめてから比較する場合は True にする
+# （結果は変わらない。テンプレートの繰り返しが多いスライドで速くなる）
+shape_dedup = False
+
+# テキスト類似度のメモの上限件数
+text_cache_size = 100000
+
 """
 類似度計算の設定を変更する関数
 :param layout_weight: レイアウトの重み
@@ -47,14 +59,99 @@ text_strictmatch = False
 :param slide_threshold: スライドの類似度の閾値
 :param shape_threshold: シェイプの類似度の閾値
 :param text_completematch: テキストの完全一致を要求する場合は True にする
+:param dedup: 同じ shape を1つにまとめてから比較する場合は True にする
 """
-def set_similarity_settings(layout=0.2, text=0.8, slide=0.8, shape=0.75, text_strict=False):
-    global layout_weight, text_weight, slide_threshold, shape_threshold, text_strictmatch
+def set_similarity_settings(layout=0.2, text=0.8, slide=0.8, shape=0.75, text_strict=False, dedup=False):
+    global layout_weight, text_weight, slide_threshold, shape_threshold, text_strictmatch, shape_dedup
     layout_weight = layout
     text_weight = text
     slide_threshold = slide
     shape_threshold = shape
     text_strictmatch = text_strict
+    shape_dedup = dedup
+
+
+"""
+現在の類似度計算の設定を set_similarity_settings() の引数の形式で返す
+（別プロセスに同じ設定を渡すときに使う）
+"""
+def get_similarity_settings():
+    return {
+        "layout": layout_weight,
+        "text": text_weight,
+        "slide": slide_threshold,
+        "shape": shape_threshold,
+        "text_strict": text_strictmatch,
+        "dedup": shape_dedup,
+    }
+
+
+#--------------------------------------------
+# テキスト類似度のメモ
+# テキストを整数の id に置き換え、(id1, id2) → 類似度 を上限付きで記憶する
+# （SequenceMatcher.ratio() は引数の順序で値が変わりうるので、順序付きのペアで記憶する）
+#--------------------------------------------
+_text_ids = {}
+_ratio_cache = OrderedDict()
+_text_cache_hits = 0
+_text_cache_misses = 0
+
+
+# id の表に texts の新しいテキストを加える余地がなければ、メモごと作り直す
+def _reserve_text_ids(texts):
+    added = sum(1 for text in set(texts) if text not in _text_ids)
+    if added and len(_text_ids) + added > text_cache_size * 2:
+        _text_ids.clear()
+        _ratio_cache.clear()
+
+
+def _text_id(text):
+    text_id = _text_ids.get(text)
+    if text_id is None:
+        text_id = len(_text_ids)
+        _text_ids[text] = text_id
+    return text_id
+
+
+# テキストの id を返す
+def intern_text(text):
+    _reserve_text_ids((text,))
+    return _text_id(text)
+
+
+# テキストの組の id を返す
+# 作り直すのは2つとも id にする前だけにする（間で作り直すと、先に返した id が別のテキストの id になるため）
+def intern_text_pair(t1, t2):
+    _reserve_text_ids((t1, t2))
+    return _text_id(t1), _text_id(t2)
+
+
+# テキスト類似度のメモの統計を返す
+def text_cache_stats():
+    lookups = _text_cache_hits + _text_cache_misses
+    return {
+        "hits": _text_cache_hits,
+        "misses": _text_cache_misses,
+        "hitrate": _text_cache_hits / lookups if lookups else 0.0,
+        "entries": len(_ratio_cache),
+        "texts": len(_text_ids),
+    }
+
+
+# 別プロセスで数えたヒット数・ミス数を加算する
+def add_text_cache_stats(hits, misses):
+    global _text_cache_hits, _text_cache_misses
+    _text_cache_hits += hits
+    _text_cache_misses += misses
+
+
+# テキスト類似度のメモと統計を消去する
+def clear_text_cache():
+    global _text_cache_hits, _text_cache_misses
+    _text_ids.clear()
+    _ratio_cache.clear()
+    _text_cache_hits = 0
+    _text_cache_misses = 0
 
 
 # レイアウトの類似性を計算
@@ -66,10 +163,25 @@ def layout_similarity(s1, s2):
     return 1 - min(dist, 1.0)  # normalize to [0,1]
 
 # テキストの類似性を比較、completematch=True の場合は完全一致を要求
+# 同じテキストの組み合わせはメモした値を返す
 def text_similarity(t1, t2, strictmatch=False):
+    global _text_cache_hits, _text_cache_misses
     if strictmatch:
         return 1.0 if t1 == t2 else 0.0
-    return SequenceMatcher(None, t1, t2).ratio()
+
+    key = intern_text_pair(t1, t2)
+    ratio = _ratio_cache.get(key)
+    if ratio is not None:
+        _text_cache_hits += 1
+        _ratio_cache.move_to_end(key)
+        return ratio
+
+    _text_cache_misses += 1
+    ratio = SequenceMatcher(None, t1, t2).ratio()
+    _ratio_cache[key] = ratio
+    if len(_ratio_cache) > text_cache_size:
+        _ratio_cache.popitem(last=False)
+    return ratio
 
 # シェイプのレイアウトとテキストの類似度を計算して返す
 # alpha はレイアウトの重み、beta はテキストの重み
@@ -88,29 +200,140 @@ def shape_similarity(shape1, shape2, alpha=0.7, beta=0.3):
     #     print(f"text2: {text2}")
     return alpha * layout_sim + beta * text_sim
 
+# shapes の全組み合わせのレイアウト類似度を行列で計算する
+# 値は layout_similarity() と同じ順序で演算するので、ビット単位で一致する
+def layout_similarity_matrix(shapes1, shapes2):
+    v1 = np.array([[s["left"], s["top"], s["width"], s["height"]] for s in shapes1], dtype=np.float64).reshape(-1, 4)
+    v2 = np.array([[s["left"], s["top"], s["width"], s["height"]] for s in shapes2], dtype=np.float64).reshape(-1, 4)
+    diff = v1[:, None, :] - v2[None, :, :]
+    squared = diff * diff
+    dist = np.sqrt(((squared[..., 0] + squared[..., 1]) + squared[..., 2]) + squared[..., 3])
+    return 1 - np.minimum(dist, 1.0)
+
+# 種類・テキスト・位置が同じ shape を1つにまとめ、(まとめた shape のリスト, それぞれの数) を返す
+def _collapse_shapes(shapes):
+    unique = {}
+    for shape in shapes:
+        key = (shape["type"], shape.get("text", ""), shape["left"], shape["top"], shape["width"], shape["height"])
+        if key in unique:
+            unique[key][1] += 1
+        else:
+            unique[key] = [shape, 1]
+    return [shape for shape, _ in unique.values()], [count for _, count in unique.values()]
+
+# SequenceMatcher.ratio() の上限（real_quick_ratio() と同じ値）。文字列の長さだけで決まる
+def text_similarity_length_bound(t1, t2):
+    length = len(t1) + len(t2)
+    return 2.0 * min(len(t1), len(t2)) / length if length else 1.0
+
+# SequenceMatcher.ratio() の上限（quick_ratio() と同じ値）。文字の出現数から求める
+def text_similarity_count_bound(counts1, counts2, length):
+    matches = sum((counts1 & counts2).values())
+    return 2.0 * matches / length if length else 1.0
+
 # slide1 と slide2 の類似度を計算し、shape_threshold以上でマッチするshapeの比率をカウントする
 # 戻り値は shape_threshold 以上 1.0 以下の値、有効数字2桁
+#
+# 各 shape の最大類似度が shape_threshold 以上かどうかだけが分かればよいので、
+# レイアウト類似度を行列で一括計算し、テキストが完全一致しても閾値に届かない組み合わせや
+# テキスト類似度の上限で閾値に届かない組み合わせは SequenceMatcher を実行せずに除外する。
+# 閾値に届く shape が見つかった時点でその shape の探索を打ち切る。
+# 結果は shape_similarity() で総当たりした場合と同じになる
 def slide_similarity(slide1, slide2, shape_threshold=0.75):
     shapes1 = slide1["shapes"]
     shapes2 = slide2["shapes"]
     if not shapes1 or not shapes2:
         return 0.0
 
-    matched = 0
     total = max(len(shapes1), len(shapes2))
+    alpha = layout_weight
+    beta = text_weight
 
-    for s1 in shapes1:
-        best = max((shape_similarity(s1, s2, alpha=layout_weight, beta=text_weight) for s2 in shapes2), default=0.0)
-        if best >= shape_threshold:
-            matched += 1
+    # 類似度は 0.0 以上なので、閾値が 0 以下ならすべてマッチする
+    if shape_threshold <= 0.0 and alpha >= 0 and beta >= 0:
+        return round(len(shapes1) / total, 2)
+
+    # 重みが負の場合は上限による除外ができないので総当たりする
+    if alpha < 0 or beta < 0:
+        matched = 0
+        for s1 in shapes1:
+            best = max((shape_similarity(s1, s2, alpha=alpha, beta=beta) for s2 in shapes2), default=0.0)
+            if best >= shape_threshold:
+                matched += 1
+        return round(matched / total, 2)
+
+    # 同じ shape は比較結果も同じなので、shapes1 は数を覚えて1つにまとめ、shapes2 は1つにまとめる
+    multiplicity = [1] * len(shapes1)
+    if shape_dedup:
+        shapes1, multiplicity = _collapse_shapes(shapes1)
+        shapes2, _ = _collapse_shapes(shapes2)
+
+    layout = layout_similarity_matrix(shapes1, shapes2)
+    same_type = np.array([s1["type"] for s1 in shapes1])[:, None] == np.array([s2["type"] for s2 in shapes2])[None, :]
+    texts1 = [s1.get("text", "") for s1 in shapes1]
+    texts2 = [s2.get("text", "") for s2 in shapes2]
+
+    if text_strictmatch:
+        # テキストの類似度は 1.0 か 0.0 なので、全組み合わせを行列で計算できる
+        text_ids = {}
+        ids1 = np.array([text_ids.setdefault(t, len(text_ids)) for t in texts1])
+        ids2 = np.array([text_ids.setdefault(t, len(text_ids)) for t in texts2])
+        text_sim = np.where(ids1[:, None] == ids2[None, :], 1.0, 0.0)
+        score = alpha * layout + beta * text_sim
+        matched = int(np.dot(multiplicity, (same_type & (score >= shape_threshold)).any(axis=1)))
+        return round(matched / total,2)
+
+    # テキストが完全一致した場合の類似度（上限）が閾値に届く組み合わせだけを調べる
+    candidate = same_type & (alpha * layout + beta * 1.0 >= shape_threshold)
+    counts2 = [None] * len(shapes2)
+
+    matched = 0
+    for i in np.flatnonzero(candidate.any(axis=1)):
+        # レイアウトが近いものから調べる
+        js = np.flatnonzero(candidate[i])
+        js = js[np.argsort(-layout[i, js], kind="stable")]
+        text1 = texts1[i]
+        counts1 = None
+        for j in js:
+            base = alpha * float(layout[i, j])
+            text2 = texts2[j]
+            if base + beta * text_similarity_length_bound(text1, text2) < shape_threshold:
+                continue
+            if counts1 is None:
+                counts1 = Counter(text1)
+            if counts2[j] is None:
+                counts2[j] = Counter(text2)
+            if base + beta * text_similarity_count_bound(counts1, counts2[j], len(text1) + len(text2)) < shape_threshold:
+                continue
+            if base + beta * text_similarity(text1, text2) >= shape_threshold:
+                matched += multiplicity[i]
+                break
 
     return round(matched / total,2)
 
 
-# slides のリストを総当たりで比較し類似度がthreshold以上のペアのリストを返す
-def find_similar_slide_pairs(slides, slide_threshold=slide_threshold, shape_threshold=shape_threshold):
+# slides1 × slides2 のスライド類似度行列（リストのリスト）を返す
+def slide_similarity_matrix(slides1, slides2, shape_threshold=0.75):
+    return [[slide_similarity(slide1, slide2, shape_threshold) for slide2 in slides2] for slide1 in slides1]
+
+
+# slides のリストから類似度がthreshold以上のペアのリストを返す
+# method="exact" なら総当たりで比較する
+# method="lsh" なら MinHash/LSH で候補に絞ったペアだけを比較する（近似、検証には exact を使う）
+# bands, rows は LSH の帯の数と1帯の行数。bands を増やし rows を減らすと取りこぼしが減るが遅くなる
+def find_similar_slide_pairs(slides, slide_threshold=slide_threshold, shape_threshold=shape_threshold,
+                             method="lsh", bands=slidelsh.default_bands, rows=slidelsh.default_rows):
+    if method == "exact":
+        pairs = combinations(range(len(slides)), 2)
+    elif method == "lsh":
+        signatures = slidelsh.minhash_signatures(slides, num_perm=bands * rows)
+        pairs = set(slidelsh.candidate_pairs(signatures, bands, rows))
+        pairs = sorted(pairs | slidelsh.textless_candidate_pairs(slides, slide_threshold))
+    else:
+        raise ValueError(f"未知の method です: {method}")
+
     similar_pairs = []
-    for i, j in combinations(range(len(slides)), 2):
+    for i, j in pairs:
         score = slide_similarity(slides[i], slides[j], shape_threshold)
         if score >= slide_threshold:
             similar_pairs.append((i, j, score))
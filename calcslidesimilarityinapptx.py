@@ -1,36 +1,26 @@
-from pptx import Presentation
-from sentence_transformers import SentenceTransformer
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 import sys
 
-# モデルの準備
-model = SentenceTransformer('all-MiniLM-L6-v2')
+import pptxxmlanalyzer
+import slidecompare
+import slideembedding
 
 # PowerPointファイルからスライドごとのテキストを抽出
+# （pptxxmlanalyzer でスライドの XML を直接読む）
 def extract_slide_texts(pptx_path):
-    prs = Presentation(pptx_path)
     slide_texts = []
-    
-    for slide in prs.slides:
-        slide_text = ""
-        for shape in slide.shapes:
-            if not shape.has_text_frame:
-                continue
-            text = shape.text.strip()
-            if text:
-                slide_text += text + " "  # すべてのテキストを1つの文字列として結合
-        slide_texts.append(slide_text.strip())
-    
+    for slide in pptxxmlanalyzer.analyze_pptx(pptx_path)["slides"]:
+        # すべてのテキストを1つの文字列として結合
+        slide_texts.append(" ".join(shape["text"] for shape in slide["shapes"] if shape["type"] == "text"))
+
     return slide_texts
 
 # スライド間の類似度を計算
-def calculate_similarity(slides_texts):
-    # スライドのテキストをベクトル化
-    slide_vectors = model.encode(slides_texts)
+def calculate_similarity(slides_texts, batch_size=slideembedding.default_batch_size):
+    # スライドのテキストをまとめてベクトル化
+    slide_vectors = slideembedding.encode_texts(slides_texts, batch_size=batch_size)
 
     # コサイン類似度を計算
-    similarity_matrix = cosine_similarity(slide_vectors)
+    similarity_matrix = slidecompare.cosine_matrix(slide_vectors, slide_vectors)
     return similarity_matrix
 
 # スライド類似度を表示
@@ -41,6 +31,9 @@ def display_similarity_matrix(similarity_matrix):
 
 # 使用例
 if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"usage: python {sys.argv[0]} <pptxfile>")
+        sys.exit(1)
     pptx_path = sys.argv[1]  # コマンドライン引数からPowerPointファイルのパスを取得
     
     # PowerPointファイルからスライドごとのテキストを抽出
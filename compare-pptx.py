@@ -1,10 +1,10 @@
 import argparse
 import os
 from datetime import datetime
-import imagehash
 from itertools import combinations
-import numpy as np
+import shutil
 import sys
+from html import escape as html_escape
 
 VERSION = "0.6.1"
 commandstr = sys.argv[0]
@@ -15,23 +15,32 @@ elif commandstr.startswith(".\\"):
     commandstr = commandstr[2:]
 programstr = f"PowerPoint比較解析ツール {commandstr} {VERSION}"
 
-print(programstr)
-if sys.argv[1] == "--version":
-    sys.exit(0)
-
-# 重いライブラリをインポートする前に、PowerPoint 起動の注意と操作禁止の確認を求めておく
-user_input = input("PowerPointを2回起動して画像を出力します。その間、キー操作を行わないでください。\nInvoking PowerPoint app 2 times. Please do not perform any actions during this time. (y/n): ")
-if user_input.lower() != 'y':
-    print("処理を中止します。")
-    sys.exit(1)
+# 差分画像出力のワーカープロセスとして読み込まれた場合は、表示しない
+if __name__ == "__main__":
+    print(programstr)
+    if len(sys.argv) > 1 and sys.argv[1] == "--version":
+        sys.exit(0)
 
-print("please wait for a while...")
+# --version の表示を速くするため、numpy などはバージョン表示の後で読み込む
+# PowerPoint (comtypes) とテキスト解析モデル (sentence-transformers, torch) は使う時に読み込まれる
+import imagehash
+import numpy as np
 
-# 操作禁止の確認が終わったところで、重いライブラリをインポート
-from sklearn.metrics.pairwise import cosine_similarity
-import comtypes.client
-from PIL import Image, ImageChops
-from sentence_transformers import SentenceTransformer
+import slideembedding
+import slidecompare
+import analysiscache
+import slidepipeline
+import diffimage
+import sliderenderer
+import pptxanalyzer
+import pptxxmlanalyzer
+import calcslidesimilarity
+import analyzedstore
+import slideindex
+import slidealign
+import slidefingerprint
+import instrument
+import htmlreport
 
 #-------------------------------------------------------------------------
 # 動作パラメータ定数
@@ -50,14 +59,32 @@ defaulttextmatch = 5  # 完全一致とみなす閾値
 defaulttexthigh = 10  # 類似とみなす閾値
 defaulttextlow = 20  # 類似かもしれない閾値
 defaultoutput = "analyzed"  # 出力ファイル名（拡張子なし）
-
-
-#-------------------------------------------------------------------------
-# グローバル変数
-#-------------------------------------------------------------------------
-
-#テキスト解析モデル
-model = SentenceTransformer('all-MiniLM-L6-v2') 
+defaultembedbatch = slideembedding.default_batch_size  # テキストベクトル化のバッチサイズ
+defaultworkers = slidepipeline.default_workers  # phash 計算のワーカースレッド数
+defaultdiffworkers = diffimage.default_workers  # 差分画像出力のワーカープロセス数
+defaultimagecachemb = diffimage.default_cache_bytes // (1024 * 1024)  # デコード済み画像キャッシュの上限（MB）
+defaultpngcompress = diffimage.default_compress_level  # 差分画像の PNG 圧縮レベル（0～9）
+defaultdiffthreshold = diffimage.default_threshold  # 変化したとみなすピクセルの差（0～255）
+defaultdiffscale = diffimage.default_region_scale  # 変化した領域を求めるときの縮小率
+defaultmode = "image"  # 比較モード
+defaulttopk = 10  # --corpus の場合に derived スライドごとに報告する類似スライドの数
+defaultsearch = "auto"  # 類似スライドの探し方
+# --search auto で索引を使う比較ペア数。索引は実行ごとに作るので、作る時間（base 5万枚で約 0.7秒）を
+# 取り戻せるだけのペア数が必要。測定した損益分岐点は約 7千万ペア
+# （base 5万枚: derived 50枚 scan 0.14秒 / index 0.84秒、1000枚 1.0秒 / 1.2秒、3000枚 3.3秒 / 1.6秒）
+autoindexpairs = 70_000_000
+defaultnprobe = slideindex.default_nprobe  # テキストベクトルの索引で調べるクラスタ数
+defaultrenderer = sliderenderer.PowerPointRenderer.name  # スライド画像のレンダラー
+defaultcachedir = None  # 解析結果キャッシュのディレクトリ（None ならキャッシュしない）
+defaultcachesize = analysiscache.default_max_bytes // (1024 * 1024)  # 解析結果キャッシュの上限サイズ（MB）
+defaultembedstore = None  # テキストベクトルの永続ストアのパス（None なら --cache-dir に置くか、使わない）
+defaultembedstorename = "embeddings.sqlite"  # --cache-dir に置く場合のテキストベクトルの永続ストアのファイル名
+defaultprofiletrace = "trace.json"  # --profile でファイル名を省略した場合のトレースのファイル名（出力ルートディレクトリに出力）
+defaultband = slidealign.default_band  # --align で比較する帯の幅（対角線から前後何枚まで）
+defaultthumbdir = "thumbs"  # レポートに表示するサムネイルのディレクトリ（出力ルートディレクトリの下）
+defaultthumbwidth = htmlreport.default_thumb_width  # サムネイルの幅（0 ならサムネイルを作らない）
+defaultthumbformat = htmlreport.default_thumb_format  # サムネイルの形式
+defaultpagesize = htmlreport.default_page_size  # レポートの1ページのスライド数
 
 
 #-------------------------------------------------------------------------
@@ -90,7 +117,7 @@ def parse_args():
 
     # 必須引数（位置引数）
     parser.add_argument("derivedfile", help="比較対象のpptxファイル（新しい方）")
-    parser.add_argument("basefile", help="比較元のpptxファイル（元ファイル）")
+    parser.add_argument("basefile", nargs="?", default=None, help="比較元のpptxファイル（元ファイル）。--corpus の場合は省略する")
 
     # オプション引数
     parser.add_argument("--sourcedir", type=str, default=f"{defaultsourcedir}", help="ファイル探索の基点ディレクトリ")
@@ -108,9 +135,47 @@ def parse_args():
     parser.add_argument("--texthigh", type=float, default=f"{defaulttexthigh}", help="テキストを類似とみなす閾値（デフォルト: 10）")
     parser.add_argument("--textlow", type=float, default=f"{defaulttextlow}", help="テキストを類似かもしれないとみなす閾値（デフォルト: 20）")
     parser.add_argument("--output", type=str, default=f"{defaultoutput}", help="解析結果のファイル名（拡張子なし）")
+    parser.add_argument("--mode", type=str, choices=["image", "text", "structure"], default=defaultmode, help="比較モード image: 画像とテキスト, text: テキストのみ（画像を出力しない）, structure: テキストとシェイプの配置（画像を出力しない）（デフォルト: image）")
+    parser.add_argument("--corpus", action="store_true", help="basefile の代わりに --sourcedir 以下のすべての pptx ファイルと比較する")
+    parser.add_argument("--topk", type=int, default=defaulttopk, help=f"--corpus の場合に derived スライドごとに報告する類似スライドの数（デフォルト: {defaulttopk}）")
+    parser.add_argument("--search", type=str, choices=["auto", "scan", "index", "verify"], default=defaultsearch, help="類似スライドの探し方 scan: 全ペアを比較, index: 索引で候補を絞る, verify: 両方を実行して照合する, auto: ペア数が多い場合だけ索引を使う（デフォルト: auto）")
+    parser.add_argument("--nprobe", type=int, default=defaultnprobe, help=f"テキストベクトルの索引で調べるクラスタ数（デフォルト: {defaultnprobe}）")
+    parser.add_argument("--renderer", type=str, choices=sorted(sliderenderer.renderers), default=defaultrenderer, help=f"スライド画像のレンダラー（デフォルト: {defaultrenderer}）")
+    parser.add_argument("--workers", type=int, default=defaultworkers, help=f"phash 計算のワーカースレッド数（デフォルト: {defaultworkers}）")
+    parser.add_argument("--diff-workers", type=int, default=defaultdiffworkers, help=f"差分画像・サムネイル出力のワーカープロセス数（デフォルト: {defaultdiffworkers}）")
+    parser.add_argument("--image-cache-mb", type=int, default=defaultimagecachemb, help=f"デコード済み画像キャッシュの上限 MB（デフォルト: {defaultimagecachemb}）")
+    parser.add_argument("--png-compress", type=int, choices=range(0, 10), default=defaultpngcompress, help=f"差分画像の PNG 圧縮レベル 0～9（デフォルト: {defaultpngcompress}）")
+    parser.add_argument("--diff-threshold", type=int, default=defaultdiffthreshold, help=f"変化したとみなすピクセルの差 0～255（デフォルト: {defaultdiffthreshold}）")
+    parser.add_argument("--diff-scale", type=int, default=defaultdiffscale, help=f"変化した領域を求めるときの縮小率、1 なら縮小しない（デフォルト: {defaultdiffscale}）")
+    parser.add_argument("--cache-dir", type=str, default=defaultcachedir, help="解析結果キャッシュのディレクトリ（省略時はキャッシュしない）")
+    parser.add_argument("--cache-size", type=int, default=defaultcachesize, help=f"解析結果キャッシュの上限サイズ MB（デフォルト: {defaultcachesize}）")
+    parser.add_argument("--embed-batch", type=int, default=defaultembedbatch, help=f"テキストベクトル化のバッチサイズ（デフォルト: {defaultembedbatch}）")
+    parser.add_argument("--profile", type=str, nargs="?", const="", default=None, metavar="TRACEFILE", help=f"段階ごとの時間を計り、Chrome のトレース (JSON) と集計表を出力する（ファイル名を省略した場合は出力ルートディレクトリの {defaultprofiletrace}）")
+    parser.add_argument("--profile-stage", type=str, default=None, help="--profile で、この名前の段階を cProfile でも計測する（例: render, phash, encode, grade, diff, html）")
+    parser.add_argument("--no-fingerprint", action="store_true", help="描画の前にスライドの指紋（XML とレイアウト・マスター・画像の内容）を比較せず、すべてのスライドを描画する")
+    parser.add_argument("--align", action="store_true", help="スライドの順序を考慮して対応付け、各スライドを unchanged/modified/moved/added/removed に分類する（対角線の周りの帯の中のペアだけを比較する）")
+    parser.add_argument("--band", type=int, default=defaultband, help=f"--align で比較する帯の幅、対角線から前後何枚まで（デフォルト: {defaultband}）")
+    parser.add_argument("--thumb-width", type=int, default=defaultthumbwidth, help=f"レポートに表示するサムネイルの幅（ピクセル）、0 ならサムネイルを作らずに元の画像を表示する（デフォルト: {defaultthumbwidth}）")
+    parser.add_argument("--thumb-format", type=str, choices=sorted(htmlreport.thumb_formats), default=defaultthumbformat, help=f"サムネイルの形式（デフォルト: {defaultthumbformat}）")
+    parser.add_argument("--page-size", type=int, default=defaultpagesize, help=f"レポートの1ページのスライド数（デフォルト: {defaultpagesize}）")
+    parser.add_argument("--embed-store", type=str, default=defaultembedstore, help=f"テキストベクトルの永続ストア (SQLite) のパス（省略時は環境変数 {slideembedding.store_env} か --cache-dir の {defaultembedstorename}、どちらもなければ使わない）")
 
     args = parser.parse_args()
 
+    if args.corpus:
+        if args.mode == "structure":
+            parser.error("--corpus は --mode structure と同時に指定できません")
+        if args.align:
+            parser.error("--corpus は --align と同時に指定できません")
+    elif args.basefile is None:
+        parser.error("basefile を指定してください（または --corpus を指定してください）")
+
+    # --embed-store を省略した場合は、環境変数のパスか、解析結果キャッシュのディレクトリに置く
+    if args.embed_store is None:
+        args.embed_store = os.environ.get(slideembedding.store_env)
+    if args.embed_store is None and args.cache_dir:
+        args.embed_store = os.path.join(args.cache_dir, defaultembedstorename)
+
     # args.exportroot に #DT# が含まれている場合は、現在の日時に置き換える
     if "#DT#" in args.exportroot:
         now = datetime.now()
@@ -118,7 +183,7 @@ def parse_args():
 
     # ==== 入力確認 ====
     print(f"新pptxファイル       : {args.derivedfile}")
-    print(f"旧pptxファイル       : {args.basefile}")
+    print(f"旧pptxファイル       : {args.basefile if not args.corpus else '(--sourcedir 以下のすべて)'}")
     print(f"pptx探索パス         : {args.sourcedir}")
     print(f"解析結果出力ルート   : {args.exportroot}")
     print(f"新ファイル解析出力先 : {args.deriveddir}")
@@ -130,6 +195,21 @@ def parse_args():
     print(f"高い類似閾値(テキスト)   : {args.texthigh}")
     print(f"低い類似閾値(テキスト)   : {args.textlow}")
     print(f"比較結果出力ファイル名   : {args.output}.json")
+    print(f"ベクトル化バッチサイズ   : {args.embed_batch}")
+    print(f"比較モード               : {args.mode}")
+    print(f"類似スライドの探し方     : {args.search if not args.align else f'align (帯の幅 {args.band})'}")
+    print(f"レンダラー               : {args.renderer}")
+    print(f"描画前の指紋の比較       : {'しない' if args.no_fingerprint else 'する'}")
+    print(f"phash ワーカー数         : {args.workers}")
+    print(f"差分画像ワーカー数       : {args.diff_workers}")
+    print(f"サムネイル               : {f'{args.thumb_width}px ({args.thumb_format})' if args.thumb_width > 0 else '(なし)'}")
+    print(f"レポートのページサイズ   : {args.page_size}")
+    print(f"画像キャッシュ上限(MB)   : {args.image_cache_mb}")
+    print(f"PNG 圧縮レベル           : {args.png_compress}")
+    print(f"差分の閾値・縮小率       : {args.diff_threshold}, 1/{args.diff_scale}")
+    print(f"解析結果キャッシュ       : {args.cache_dir if args.cache_dir else '(なし)'}")
+    print(f"テキストベクトルストア   : {args.embed_store if args.embed_store else '(なし)'}")
+    print(f"プロファイル             : {'(なし)' if args.profile is None else (args.profile or defaultprofiletrace)}" + (f" (cProfile: {args.profile_stage})" if args.profile is not None and args.profile_stage else ""))
 
     return args
 
@@ -170,8 +250,10 @@ def create_directory(args):
 
 #-------------------------------------------------------------------------
 # 出力ディレクトリにpptxファイルのスライド画像をexportし、hash値を計算して保存する
+# reused は描画せずに解析結果をコピーするスライドの {スライド番号: 解析結果} で、
+# 解析結果はキャッシュと同じ形式 {"imagepath", "imagehash", "textvector"}。slide_count はスライド数
 #-------------------------------------------------------------------------
-def export_pptx_images(pptxpath, exportdir, exportfilename):
+def export_pptx_images(pptxpath, exportdir, exportfilename, renderer, embed_batch=defaultembedbatch, workers=defaultworkers, reused=None, slide_count=0):
     print(f"PowerPointファイルを開きます: {pptxpath}")
     print(f"出力先ディレクトリ: {exportdir}")
     # pptxpath をディレクトリとファイル名に分離
@@ -186,113 +268,416 @@ def export_pptx_images(pptxpath, exportdir, exportfilename):
         "slides": []
     }
 
-    ppt = comtypes.client.CreateObject("PowerPoint.Application")
-    ppt.Visible = True
+    # export と並行して phash の計算とテキストのベクトル化を行う
+    pipeline = slidepipeline.SlideAnalysisPipeline(workers=workers, embed_batch=embed_batch)
+
+    slide_indices = None
+    if reused:
+        slide_indices = [i for i in range(slide_count) if i not in reused]
+
+    # 各スライドを PNG で出力
+    rendered = []
+    try:
+        with instrument.span("render", file=pptxfile) as span:
+            for i, imagepath, slide_text in renderer.render(pptxpath, exportdir, exportfilename, slide_indices):
+                pipeline.submit(len(rendered), imagepath, slide_text)
+                rendered.append(i)
+                analyzed["slides"].append({
+                    "slideimage": os.path.basename(imagepath),
+                })
+            span.set(slides=len(rendered))
+    except BaseException:
+        # export に失敗したら、パイプラインのワーカースレッドを終了させてから例外を伝える
+        pipeline.abort()
+        raise
+
+    # textvectors は (スライド数, 384) の float32 行列。行の並びは analyzed["slides"] と一致する
+    with instrument.span("pipeline.finish", slides=len(rendered)):
+        hashes, textvectors = pipeline.finish()
+    analyzed["textvectors"] = textvectors
+    for slide, hash, textvector in zip(analyzed["slides"], hashes, textvectors):
+        slide["imagehash"] = hash
+        slide["textvector"] = textvector
+
+    if reused:
+        # 描画しなかったスライドは、同じ指紋のスライドの画像と解析結果をコピーする
+        slides = dict(zip(rendered, analyzed["slides"]))
+        for i, cached in reused.items():
+            imagefile = sliderenderer.image_filename(exportfilename, i)
+            shutil.copyfile(cached["imagepath"], os.path.join(exportdir, imagefile))
+            slides[i] = {
+                "slideimage": imagefile,
+                "imagehash": cached["imagehash"],
+                "textvector": cached["textvector"],
+                "fingerprintmatch": True,
+            }
+        analyzed["slides"] = [slides[i] for i in sorted(slides)]
+        analyzed["textvectors"] = np.array([slide["textvector"] for slide in analyzed["slides"]], dtype=np.float32).reshape(-1, slideembedding.embedding_dim)
 
-    presentation = ppt.Presentations.Open(pptxpath)
+    return analyzed
 
-    # スライドの数を取得
-    slide_count = len(presentation.Slides)
 
-    for i in range(slide_count):
-        slide = presentation.Slides[i + 1]  # スライドは1から始まるので、i+1で取得
+#-------------------------------------------------------------------------
+# pptxファイルを解析する。キャッシュにあれば PowerPoint を起動せずにキャッシュから復元する
+# reference（解析済みの base デッキ）を指定した場合は、描画の前にスライドの指紋を比較し、
+# 同じ指紋のスライドは描画せずに reference の画像と解析結果をコピーする
+#-------------------------------------------------------------------------
+def analyze_deck(pptxpath, exportdir, exportfilename, args, renderer, cache=None, reference=None):
+    if cache is not None:
+        cached_slides = cache.load_deck(pptxpath)
+        if cached_slides is not None:
+            print(f"キャッシュから解析結果を復元します: {pptxpath}")
+            with instrument.span("cache.restore", file=os.path.basename(pptxpath), slides=len(cached_slides)):
+                return restore_cached_deck(pptxpath, exportdir, exportfilename, cached_slides)
+
+    reused = None
+    slide_count = 0
+    if reference is not None:
+        with instrument.span("fingerprint", file=os.path.basename(pptxpath)) as span:
+            fingerprints = slidefingerprint.deck_fingerprints(pptxpath)
+            span.set(slides=len(fingerprints))
+        slide_count = len(fingerprints)
+        reused = {}
+        for i, bi in slidefingerprint.identical_pairs(fingerprints, reference["fingerprints"]).items():
+            base_slide = reference["slides"][bi]
+            reused[i] = {
+                "imagepath": os.path.join(reference["exportdir"], base_slide["slideimage"]),
+                "imagehash": base_slide["imagehash"],
+                "textvector": base_slide["textvector"],
+            }
+        print(f"指紋が同じため描画を省略するスライド: {len(reused)} 枚 / {slide_count} 枚")
+
+    analyzed = export_pptx_images(pptxpath, exportdir, exportfilename, renderer, args.embed_batch, args.workers, reused, slide_count)
+    if reused is not None:
+        analyzed["fingerprintmatches"] = len(reused)
+
+    if cache is not None:
+        cache.store_deck(pptxpath, [{
+            "imagepath": os.path.join(exportdir, slide["slideimage"]),
+            "imagehash": slide["imagehash"],
+            "textvector": slide["textvector"],
+        } for slide in analyzed["slides"]])
 
-        slide_text = ""
-        # スライド内のすべてのシェイプのテキストを結合してベクター化
-        for shape in slide.Shapes:
-            if shape.HasTextFrame:  # テキストフレームがある場合
-                text_frame = shape.TextFrame
-                if text_frame.HasText:  # テキストが存在する場合
-                    slide_text += text_frame.TextRange.Text + " "
+    return analyzed
 
-        textvector = model.encode(slide_text)
 
-        # 各スライドを PNG で出力
-        imagefile = f"{exportfilename}_{i}.png"
-        imagepath = os.path.join(exportdir, imagefile)
-        slide.Export(imagepath, "PNG")
-        with Image.open(imagepath) as img:
-            hash = imagehash.phash(img)
+#-------------------------------------------------------------------------
+# キャッシュの解析結果を export_pptx_images() と同じ形式に復元する
+# 画像は出力ディレクトリにコピーする
+#-------------------------------------------------------------------------
+def restore_cached_deck(pptxpath, exportdir, exportfilename, cached_slides):
+    pptdir, pptxfile = os.path.split(pptxpath)
+
+    analyzed = {
+        "sourcedir": os.path.abspath(pptdir),
+        "pptxfile": pptxfile,
+        "exportdir": exportdir,
+        "slides": []
+    }
+
+    for i, cached in enumerate(cached_slides):
+        imagefile = sliderenderer.image_filename(exportfilename, i)
+        shutil.copyfile(cached["imagepath"], os.path.join(exportdir, imagefile))
         analyzed["slides"].append({
             "slideimage": imagefile,
-            "imagehash": hash,
-            "textvector": textvector,
+            "imagehash": imagehash.hex_to_hash(cached["imagehash"]),
+            "textvector": cached["textvector"],
         })
 
-
-    presentation.Close()
-    #ppt.Quit()
+    analyzed["textvectors"] = np.array([cached["textvector"] for cached in cached_slides], dtype=np.float32).reshape(-1, slideembedding.embedding_dim)
 
     return analyzed
 
 
-def output_html(derived_analyzed, args):
-    # 入力ファイル
-    output_htmlfile = "comparison_report.html"
-    output_htmlpath = os.path.join(args.exportroot, output_htmlfile)
-    derived_imagedir = os.path.join(args.exportroot,args.deriveddir)
-    base_imagedir = os.path.join(args.exportroot,args.basedir)
-
-    slides = derived_analyzed["slides"]
-
-    html = [
-        "<!DOCTYPE html>",
-        "<html lang='ja'>",
-        "<head>",
-        "<meta charset='UTF-8'>",
-        "<title>スライド比較レポート</title>",
-        "<style>",
-        "body { font-family: sans-serif; }",
-        "table { border-collapse: collapse; width: 100%; margin-bottom: 40px; }",
-        "th, td { border: 1px solid #ccc; padding: 10px; text-align: center; vertical-align: top; }",
-        "th { background-color: #f0f0f0; }",
-        "img.thumb { width: 240px; height: auto; cursor: zoom-in; border: 2px solid #aaa; }",
-        "img.thumb:hover { border-color: #2196f3; }",
-        "details summary { cursor: pointer; font-weight: bold; margin: 10px 0; }",
-        "</style>",
-        "</head>",
-        "<body>",
-        f"<h1>📊 スライド比較レポート：{os.path.basename(derived_analyzed['pptxfile'])}</h1>"
-    ]
-
-    for di,slide in enumerate(slides):
-        derived_image = slide["slideimage"]
-        derived_path = os.path.join(args.deriveddir, derived_image).replace("\\", "/")
-
-        graded = {"match": [], "high": [], "low": []}
-        for sim in slide.get("similars", []):
-            graded[sim["grade"]].append(sim)
+#-------------------------------------------------------------------------
+# 画像を出力せずに、pptxファイルのテキスト（とシェイプの配置）を解析する
+# （pptxxmlanalyzer でスライドの XML を直接読む）
+# with_shapes が True なら calcslidesimilarity で比較できる形式の shapes も返す
+# cache を指定した場合は、モード（text, structure）ごとに解析結果をキャッシュする
+#-------------------------------------------------------------------------
+def analyze_deck_text(pptxpath, args, with_shapes=False, cache=None):
+    pptdir, pptxfile = os.path.split(pptxpath)
 
-        html.append(f"<details open><summary>🖼️ {derived_image}</summary>")
-        html.append("<table>")
-        html.append("<tr><th>Original</th><th>Match</th><th>High</th><th>Low</th></tr>")
-        html.append("<tr>")
+    analyzed = {
+        "sourcedir": os.path.abspath(pptdir),
+        "pptxfile": pptxfile,
+        "exportdir": None,
+        "slides": []
+    }
 
-        # Original cell
-        html.append(f"<td><a href='{derived_path}' target='_blank'><img src='{derived_path}' class='thumb'></a><br>{derived_image}</td>")
+    mode = "structure" if with_shapes else "text"
+    if cache is not None:
+        cached_slides = cache.load_deck(pptxpath, mode)
+        if cached_slides is not None:
+            print(f"キャッシュから解析結果を復元します: {pptxpath}")
+            with instrument.span("cache.restore", file=pptxfile, slides=len(cached_slides)):
+                analyzed["slides"] = cached_slides
+                analyzed["textvectors"] = np.array([slide["textvector"] for slide in cached_slides], dtype=np.float32).reshape(-1, slideembedding.embedding_dim)
+            return analyzed
+
+    print(f"pptxファイルを解析します: {pptxpath}")
+
+    with instrument.span("parse", file=pptxfile) as span:
+        parsed = pptxanalyzer.flatten_positions(pptxxmlanalyzer.analyze_pptx(pptxpath))
+        span.set(slides=len(parsed["slides"]))
+    for slide in parsed["slides"]:
+        record = {
+            "slideimage": None,
+            "slidetitle": slide["slidetitle"],
+        }
+        if with_shapes:
+            record["shapes"] = slide["shapes"]
+        analyzed["slides"].append(record)
+
+    textvectors = slideembedding.encode_texts([pptxanalyzer.slide_text(slide) for slide in parsed["slides"]], batch_size=args.embed_batch)
+    analyzed["textvectors"] = textvectors
+    for slide, textvector in zip(analyzed["slides"], textvectors):
+        slide["textvector"] = textvector
+
+    if cache is not None:
+        cache.store_deck(pptxpath, analyzed["slides"], mode)
 
-        # Grade cells
-        for grade in ["match", "high", "low"]:
-            cell = ""
-            for sim in graded[grade]:
-                sim_path = os.path.join(args.basedir, sim["slideimage"]).replace("\\", "/")
-                label = f"NewSlide: {sim['slideimage']}<br>ImageScore: {sim['imagescore']} pt<br>TextScore: {sim['textscore']} pt<br>OldPptx: {sim['pptxfile']}"
-                cell += f"<a href='{sim_path}' target='_blank'><img src='{sim_path}' class='thumb'></a><br>{label}<br><br>"
-                diff_path = os.path.join(args.diffdir, f"diff_{di}_{sim['slideindex']}.png")
-                difflabel = f"ImageDifference"
-                cell += f"<a href='{diff_path}' target='_blank'><img src='{diff_path}' class='thumb'></a><br>{difflabel}<br><br>"
+    return analyzed
 
-            html.append(f"<td>{cell if cell else '-'}</td>")
 
-        html.append("</tr></table>")
-        html.append("</details>")
+#-------------------------------------------------------------------------
+# sourcedir 以下の pptx ファイルのパスを列挙する（excludepath は除く）
+#-------------------------------------------------------------------------
+def find_corpus_files(sourcedir, excludepath):
+    pptxpaths = []
+    for dirpath, dirnames, filenames in os.walk(sourcedir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            # "~$" で始まるのは PowerPoint が開いている間のロックファイル
+            if not filename.lower().endswith(".pptx") or filename.startswith("~$"):
+                continue
+            pptxpath = os.path.abspath(os.path.join(dirpath, filename))
+            if os.path.normcase(pptxpath) != os.path.normcase(excludepath):
+                pptxpaths.append(pptxpath)
+    return pptxpaths
 
-    html.append("</body></html>")
 
-    with open(output_htmlpath, "w", encoding="utf-8") as f:
-        f.write("\n".join(html))
+#-------------------------------------------------------------------------
+# sourcedir 以下のすべての pptx ファイルを解析し、1つの解析結果にまとめる
+# 各スライドには元の pptxfile（sourcedir からの相対パス）と slideindex を記録する
+# 画像は basedir の下にファイルごとの番号のディレクトリを作って出力する
+#-------------------------------------------------------------------------
+def analyze_corpus(args, derivedpptxpath, renderer=None, cache=None):
+    sourcedir = os.path.abspath(args.sourcedir)
+    pptxpaths = find_corpus_files(sourcedir, derivedpptxpath)
+    print(f"比較元のpptxファイル数: {len(pptxpaths)}")
+
+    corpus = {
+        "sourcedir": sourcedir,
+        "pptxfile": None,
+        "exportdir": args.basedir,
+        "decks": [],
+        "slides": []
+    }
+    textvectors = []
+
+    for k, pptxpath in enumerate(pptxpaths):
+        relpath = os.path.relpath(pptxpath, sourcedir)
+        deckdir = f"{k:04d}"
+        try:
+            if args.mode == "image":
+                exportdir = os.path.join(args.basedir, deckdir)
+                os.makedirs(exportdir, exist_ok=True)
+                analyzed = analyze_deck(pptxpath, exportdir, args.baseexportname, args, renderer, cache)
+            else:
+                analyzed = analyze_deck_text(pptxpath, args, cache=cache)
+        except Exception as e:
+            # 1ファイルの失敗で全体を止めない
+            print(f"解析できないため除外します: {relpath}: {e}")
+            continue
+
+        corpus["decks"].append(relpath)
+        for i, slide in enumerate(analyzed["slides"]):
+            if slide["slideimage"]:
+                slide["slideimage"] = f"{deckdir}/{slide['slideimage']}"
+            slide["pptxfile"] = relpath
+            slide["slideindex"] = i
+            corpus["slides"].append(slide)
+        textvectors.append(analyzed["textvectors"])
+
+    if textvectors:
+        corpus["textvectors"] = np.concatenate(textvectors, axis=0)
+    else:
+        corpus["textvectors"] = slideembedding.encode_texts([])
+
+    return corpus
+
+
+# スライドの見出し（画像がない場合に画像の代わりに表示する）
+def slide_caption(slide, index):
+    title = slide.get("slidetitle") or ""
+    return html_escape(f"Slide {index}: {title}")
+
+
+# レポートの CSS
+report_style = "\n".join([
+    "body { font-family: sans-serif; }",
+    "table { border-collapse: collapse; width: 100%; margin-bottom: 40px; }",
+    "th, td { border: 1px solid #ccc; padding: 10px; text-align: center; vertical-align: top; }",
+    "th { background-color: #f0f0f0; }",
+    "img.thumb { width: 240px; height: auto; cursor: zoom-in; border: 2px solid #aaa; }",
+    "img.thumb:hover { border-color: #2196f3; }",
+    "details summary { cursor: pointer; font-weight: bold; margin: 10px 0; }",
+    "nav { margin: 10px 0; }",
+    "span.overlay { position: relative; display: inline-block; line-height: 0; }",
+    "span.region { position: absolute; border: 2px solid #f44336; background-color: rgba(244, 67, 54, 0.15); box-sizing: border-box; pointer-events: none; }",
+    "img.diffcrop { max-width: 240px; max-height: 180px; border: 2px solid #aaa; background-color: #000; }",
+])
+
+
+# 差分画像のパスを返す。変化がなく差分画像がない場合は None
+def diff_image_path(args, di, sim):
+    diffimage_name = sim.get("diffimage", f"diff_{di}_{sim['slideindex']}.png")
+    if diffimage_name is None:
+        return None
+    return os.path.join(args.diffdir, diffimage_name)
+
+
+# 画像のセルの HTML を返す。サムネイルがあればそれを表示し、元の画像にリンクする
+# sim に変化した領域（diffregions）があれば、画像の上に枠で表示する
+def image_html(imagepath, thumbs, args, css_class="thumb", sim=None):
+    href = htmlreport.link(imagepath, args.exportroot)
+    if imagepath not in thumbs:
+        img = f"<img src='{href}' class='{css_class}' loading='lazy' decoding='async'>"
+    else:
+        thumbpath, width, height = thumbs[imagepath]
+        src = htmlreport.link(thumbpath, args.exportroot)
+        img = f"<img src='{src}' class='{css_class}' loading='lazy' decoding='async' width='{width}' height='{height}'>"
+    if sim is not None and sim.get("diffregions"):
+        # 領域は画像の大きさに対する割合で置くので、サムネイルの大きさによらない
+        width, height = sim["diffsize"]
+        boxes = "".join(
+            f"<span class='region' style='left:{100 * left / width:.2f}%;top:{100 * top / height:.2f}%;"
+            f"width:{100 * (right - left) / width:.2f}%;height:{100 * (bottom - top) / height:.2f}%'></span>"
+            for left, top, right, bottom in sim["diffregions"])
+        img = f"<span class='overlay'>{img}{boxes}</span>"
+    return f"<a href='{href}' target='_blank'>{img}</a>"
+
+
+# 差分のセルの HTML を返す
+def diff_html(args, di, sim, thumbs):
+    diff_path = diff_image_path(args, di, sim)
+    if "diffregions" not in sim:
+        # 変化した領域を記録していない（画像全体の差分画像の）結果
+        return f"{image_html(diff_path, thumbs, args)}<br>ImageDifference"
+    if diff_path is None:
+        return "ImageDifference: 閾値を超える変化なし"
+    return f"{image_html(diff_path, thumbs, args, 'diffcrop')}<br>ImageDifference: {len(sim['diffregions'])} 箇所"
+
+
+# derived スライド1枚の行の HTML を返す
+def slide_row_html(slide, di, thumbs, args):
+    derived_image = slide["slideimage"]
+
+    graded = {"match": [], "high": [], "low": []}
+    for sim in slide.get("similars", []):
+        graded[sim["grade"]].append(sim)
+
+    status = f" [{slide['status']}]" if "status" in slide else ""
+    html = [f"<details open id='slide{di}'><summary>🖼️ {derived_image if derived_image else slide_caption(slide, di)}{status}</summary>"]
+    html.append("<table>")
+    html.append("<tr><th>Original</th><th>Match</th><th>High</th><th>Low</th></tr>")
+    html.append("<tr>")
+
+    # Original cell
+    if derived_image:
+        html.append(f"<td>{image_html(os.path.join(args.deriveddir, derived_image), thumbs, args)}<br>{derived_image}</td>")
+    else:
+        html.append(f"<td>{slide_caption(slide, di)}</td>")
+
+    # Grade cells
+    for grade in ["match", "high", "low"]:
+        cell = ""
+        for sim in graded[grade]:
+            if not sim["slideimage"]:
+                # 画像を出力しないモード
+                label = f"{slide_caption(sim, sim['slideindex'])}<br>TextScore: {sim['textscore']} pt"
+                if "structurescore" in sim:
+                    label += f"<br>StructureScore: {sim['structurescore']}"
+                cell += f"{label}<br>OldPptx: {sim['pptxfile']}<br><br>"
+                continue
+            label = f"NewSlide: {sim['slideimage']}<br>ImageScore: {sim['imagescore']} pt<br>TextScore: {sim['textscore']} pt<br>OldPptx: {sim['pptxfile']}"
+            cell += f"{image_html(os.path.join(args.basedir, sim['slideimage']), thumbs, args, sim=sim)}<br>{label}<br><br>"
+            cell += f"{diff_html(args, di, sim, thumbs)}<br><br>"
+
+        html.append(f"<td>{cell if cell else '-'}</td>")
+
+    html.append("</tr></table>")
+    html.append("</details>")
+    return "\n".join(html)
+
+
+# レポートに表示する画像のパスを列挙する
+def report_images(slides, args):
+    for di, slide in enumerate(slides):
+        if slide["slideimage"]:
+            yield os.path.join(args.deriveddir, slide["slideimage"])
+        for sim in slide.get("similars", []):
+            if sim["slideimage"]:
+                yield os.path.join(args.basedir, sim["slideimage"])
+                diff_path = diff_image_path(args, di, sim)
+                if diff_path is not None:
+                    yield diff_path
+
+
+# NDJSON に書く derived スライド1枚の結果
+def slide_record(slide, di):
+    record = {"kind": "derived", "slideindex": di, "slideimage": slide["slideimage"]}
+    if slide.get("slidetitle") is not None:
+        record["slidetitle"] = slide["slidetitle"]
+    for key in ("status", "alignedbase", "fingerprintmatch"):
+        if key in slide:
+            record[key] = slide[key]
+    record["similars"] = slide.get("similars", [])
+    return record
+
+
+# removed_slides は --align の場合に削除された base スライドのリスト
+# レポートは args.page_size 枚ごとのページに分け、索引のページ comparison_report.html からリンクする
+def output_html(derived_analyzed, args, removed_slides=None):
+    slides = derived_analyzed["slides"]
 
-    print(f"✅ 比較結果出力完了(HTML): {output_htmlpath}")
+    # 表示用のサムネイルを並列に作る
+    thumbs = {}
+    if args.thumb_width > 0:
+        thumb_format = htmlreport.resolve_thumb_format(args.thumb_format)
+        with instrument.span("thumbnail") as span:
+            thumbs = htmlreport.write_thumbnails(
+                report_images(slides, args),
+                os.path.join(args.exportroot, defaultthumbdir),
+                args.exportroot,
+                width=args.thumb_width,
+                thumb_format=thumb_format,
+                workers=args.diff_workers)
+            span.set(images=len(thumbs))
+
+    title = f"📊 スライド比較レポート：{os.path.basename(derived_analyzed['pptxfile'])}"
+    with htmlreport.ReportWriter(args.exportroot, title, report_style, args.page_size) as writer:
+        for di, slide in enumerate(slides):
+            label = slide["slideimage"] if slide["slideimage"] else slide_caption(slide, di)
+            tags = [sim["grade"] for sim in slide.get("similars", [])]
+            if "status" in slide:
+                tags.append(slide["status"])
+            writer.add(label, slide_row_html(slide, di, thumbs, args), slide_record(slide, di), tags, f"slide{di}")
+
+        if removed_slides:
+            # --align で対応するスライドがなかった base スライド（索引のページに表示する）
+            html = [f"<details open><summary>🗑️ removed: {len(removed_slides)}</summary>"]
+            html.append("<table><tr><th>OldSlide</th></tr>")
+            for bi, slide in removed_slides:
+                html.append(f"<tr><td>{slide['slideimage'] if slide.get('slideimage') else slide_caption(slide, bi)}</td></tr>")
+                writer.add_record({"kind": "removed", "slideindex": slide.get("slideindex", bi), "slideimage": slide.get("slideimage"), "status": "removed"})
+            html.append("</table>")
+            html.append("</details>\n")
+            writer.set_index_extra("\n".join(html))
+
+    print(f"✅ 比較結果出力完了(HTML): {writer.index_path}")
+    print(f"✅ 比較結果出力完了(NDJSON): {writer.results_path}")
 
 
 # 引数で指定されるテキスト閾値を 0～1.0 の範囲に変換する
@@ -317,110 +702,272 @@ def invertSimilarityThreshold(value):
         return int((1.0 - value) * 100.0)
 
 
+#-------------------------------------------------------------------------
+# derived と base の類似スライドのペアを探す
+# --search が scan なら全ペアを行列で比較し、index なら索引で候補を絞ってから比較する
+# auto なら比較するペア数が多い場合だけ索引を使う。verify なら両方を実行して結果を照合する
+# structure（スライド構成の類似度行列）を使う場合は常に全ペアを比較する
+#-------------------------------------------------------------------------
+def find_similar_pairs(derived_hashes, derived_vectors, base_hashes, base_vectors, hash_thresholds, text_thresholds, args, structure=None):
+    search = args.search
+    if structure is not None:
+        search = "scan"
+    elif search == "auto":
+        search = "index" if len(derived_vectors) * len(base_vectors) >= autoindexpairs else "scan"
+
+    if search != "index":
+        scanned = slidecompare.compare_slides(derived_hashes, derived_vectors, base_hashes, base_vectors, hash_thresholds, text_thresholds, structure, calcslidesimilarity.slide_threshold)
+        if search != "verify":
+            return scanned
+
+    index = slideindex.SlideIndex(base_hashes, base_vectors)
+    candidates = index.candidates(derived_hashes, derived_vectors, hash_thresholds[-1], text_thresholds[-1], args.nprobe)
+    indexed = slidecompare.compare_candidates(derived_hashes, derived_vectors, base_hashes, base_vectors, candidates, hash_thresholds, text_thresholds)
+    if search == "index":
+        return indexed
+
+    # 索引の結果を全ペア比較の結果と照合する
+    expected = {(di, bi, grade) for di, bi, grade, *_ in scanned}
+    found = {(di, bi, grade) for di, bi, grade, *_ in indexed}
+    print(f"索引の照合: 全ペア比較 {len(expected)} 件, 索引 {len(found)} 件, 索引で見つからなかったもの {len(expected - found)} 件, 不一致 {len(found - expected)} 件")
+    return scanned
+
+
+#-------------------------------------------------------------------------
+# --align の場合は、スライドの順序を考慮して derived と base を対応付ける（slidealign.py）
+# 対角線の周りの帯の中のペアと、帯の中で対応が付かなかったスライド同士のペアだけを比較する
+# structure モードでも、スライド構成の類似度は比較するペアの分だけ計算する
+# (比較したペアのうち等級に該当するもの, align_slides() の結果, derived スライドごとの (分類, base スライド番号)) を返す
+#-------------------------------------------------------------------------
+def align_similar_pairs(derived_analyzed, base_analyzed, derived_hashes, base_hashes, hash_thresholds, text_thresholds, args):
+    derived_slides = derived_analyzed["slides"]
+    base_slides = base_analyzed["slides"]
+    graded = {}
+
+    def score(rows, cols):
+        structure = None
+        if args.mode == "structure":
+            structure = np.array([
+                calcslidesimilarity.slide_similarity(derived_slides[di], base_slides[bi], calcslidesimilarity.shape_threshold)
+                for di, bi in zip(rows, cols)], dtype=np.float32)
+        pairs = slidecompare.compare_pairs(
+            derived_hashes, derived_analyzed["textvectors"], base_hashes, base_analyzed["textvectors"],
+            rows, cols, hash_thresholds, text_thresholds, structure, calcslidesimilarity.slide_threshold)
+        # 等級が高いほど重みを大きくする（等級に該当しないペアは重み 0 で対応付けない）
+        weights = {}
+        for pair in pairs:
+            graded[(pair[0], pair[1])] = pair
+            weights[(pair[0], pair[1])] = len(slidecompare.grades) - slidecompare.grades.index(pair[2])
+        return np.array([weights.get((int(di), int(bi)), 0) for di, bi in zip(rows, cols)], dtype=np.float64)
+
+    alignment = slidealign.align_slides(len(derived_slides), len(base_slides), score, args.band)
+    statuses = slidealign.classify(len(derived_slides), alignment, lambda di, bi: graded[(di, bi)][2] == "match")
+    print(f"順序を考慮した対応付け: 比較したペア {alignment['scored']} 件 / 全ペア {len(derived_slides) * len(base_slides)} 件")
+    return [graded[key] for key in sorted(graded)], alignment, statuses
+
+
+#-------------------------------------------------------------------------
+# PowerPoint を使う場合は、起動の注意と操作禁止の確認を求める
+#-------------------------------------------------------------------------
+def confirm_renderer(args):
+    if args.mode != "image" or args.renderer != sliderenderer.PowerPointRenderer.name:
+        return
+
+    user_input = input("PowerPointを起動して画像を出力します。その間、キー操作を行わないでください。\nInvoking PowerPoint app. Please do not perform any actions during this time. (y/n): ")
+    if user_input.lower() != 'y':
+        print("処理を中止します。")
+        sys.exit(1)
+
+    print("please wait for a while...")
+
+
 def main():
     args = parse_args()
+    confirm_renderer(args)
+    if args.profile is not None:
+        instrument.enable(args.profile_stage)
 
     # ディレクトリの作成
     print("出力ディレクトリを作成します")
     args = create_directory(args)
 
     # ファイルの絶対パスを取得 args.sourcepath + args.basefile
-    basepptxpath = os.path.abspath(os.path.join(args.sourcedir, args.basefile))
     derivedpptxpath = os.path.abspath(os.path.join(args.sourcedir, args.derivedfile))
     print(f"新ファイルの絶対パス: {derivedpptxpath}")
-    print(f"旧ファイルの絶対パス: {basepptxpath}")
-
-    derived_analyzed = export_pptx_images(derivedpptxpath, args.deriveddir, args.derivedexportname)
-    base_analyzed = export_pptx_images(basepptxpath, args.basedir, args.baseexportname)
-
-    # derived_analyzed["slides"] と base_analyzed["slides"] のハッシュ値を比較する
-    for di , derived_slide in enumerate(derived_analyzed["slides"]):
+    if not args.corpus:
+        basepptxpath = os.path.abspath(os.path.join(args.sourcedir, args.basefile))
+        print(f"旧ファイルの絶対パス: {basepptxpath}")
+
+    if args.embed_store:
+        slideembedding.use_store(args.embed_store)
+
+    cache = None
+    if args.cache_dir:
+        # 画像と phash はレンダラーごとに異なるので、image モードではレンダラーの名前もキーに含める
+        salt = f"{slideembedding.model_name}:{args.renderer}" if args.mode == "image" else slideembedding.model_name
+        cache = analysiscache.AnalysisCache(args.cache_dir, args.cache_size * 1024 * 1024, salt=salt)
+
+    if args.mode == "image":
+        # レンダラー（PowerPoint）はすべてのデッキで使い回す
+        with sliderenderer.create_renderer(args.renderer) as renderer:
+            if args.corpus:
+                derived_analyzed = analyze_deck(derivedpptxpath, args.deriveddir, args.derivedexportname, args, renderer, cache)
+                base_analyzed = analyze_corpus(args, derivedpptxpath, renderer, cache)
+            else:
+                # base を先に解析し、derived のスライドのうち base と指紋が同じものは描画しない
+                base_analyzed = analyze_deck(basepptxpath, args.basedir, args.baseexportname, args, renderer, cache)
+                reference = None
+                if not args.no_fingerprint:
+                    with instrument.span("fingerprint", file=os.path.basename(basepptxpath), slides=len(base_analyzed["slides"])):
+                        reference = dict(base_analyzed, fingerprints=slidefingerprint.deck_fingerprints(basepptxpath))
+                derived_analyzed = analyze_deck(derivedpptxpath, args.deriveddir, args.derivedexportname, args, renderer, cache, reference)
+    else:
+        with_shapes = args.mode == "structure"
+        derived_analyzed = analyze_deck_text(derivedpptxpath, args, with_shapes, cache)
+        if args.corpus:
+            base_analyzed = analyze_corpus(args, derivedpptxpath, cache=cache)
+        else:
+            base_analyzed = analyze_deck_text(basepptxpath, args, with_shapes, cache)
+    instrument.count("slides", len(derived_analyzed["slides"]) + len(base_analyzed["slides"]))
+
+    # derived_analyzed["slides"] と base_analyzed["slides"] のハッシュ値とテキストベクトルを
+    # 行列で一括比較する
+    hash_thresholds = (args.match, args.high, args.low)
+    text_thresholds = (
+        convertSimilarityThreshold(args.textmatch),
+        convertSimilarityThreshold(args.texthigh),
+        convertSimilarityThreshold(args.textlow),
+    )
+    derived_hashes = None
+    base_hashes = None
+    structure = None
+    if args.mode == "image":
+        derived_hashes = slidecompare.pack_imagehashes([slide["imagehash"] for slide in derived_analyzed["slides"]])
+        base_hashes = slidecompare.pack_imagehashes([slide["imagehash"] for slide in base_analyzed["slides"]])
+    elif args.mode == "structure" and not args.align:
+        # シェイプの配置とテキストによるスライド類似度
+        with instrument.span("structure", pairs=len(derived_analyzed["slides"]) * len(base_analyzed["slides"])):
+            structure = np.array(calcslidesimilarity.slide_similarity_matrix(
+                derived_analyzed["slides"], base_analyzed["slides"], calcslidesimilarity.shape_threshold), dtype=np.float32).reshape(len(derived_analyzed["slides"]), len(base_analyzed["slides"]))
+    statuses = None
+    with instrument.span("grade") as span:
+        if args.align:
+            pairs, alignment, statuses = align_similar_pairs(
+                derived_analyzed, base_analyzed, derived_hashes, base_hashes, hash_thresholds, text_thresholds, args)
+            compared = alignment["scored"]
+        else:
+            pairs = find_similar_pairs(
+                derived_hashes,
+                derived_analyzed["textvectors"],
+                base_hashes,
+                base_analyzed["textvectors"],
+                hash_thresholds,
+                text_thresholds,
+                args,
+                structure)
+            compared = len(derived_analyzed["slides"]) * len(base_analyzed["slides"])
+        span.set(pairs=compared, similars=len(pairs))
+    instrument.count("pairs", compared)
+    if args.corpus:
+        # derived スライドごとに、全デッキの中から類似度の高いものだけを報告する
+        pairs = slidecompare.select_top_pairs(pairs, args.topk)
+
+    for derived_slide in derived_analyzed["slides"]:
         derived_slide["similars"] = []
-        # スライド画像のファイル名を取得
-        derived_hash = derived_slide["imagehash"]
-        derived_vector = derived_slide["textvector"]
-        # print(f"derived textvector {derived_vector}")
+
+    if statuses is not None:
+        # 各スライドの分類と、順序どおりに対応した（または移動元の）base スライドを記録する
+        for derived_slide, (status, bi) in zip(derived_analyzed["slides"], statuses):
+            derived_slide["status"] = status
+            derived_slide["alignedbase"] = None if bi is None else base_analyzed["slides"][bi].get("slideindex", bi)
+        removed = set(alignment["removed"])
         for bi, base_slide in enumerate(base_analyzed["slides"]):
-            base_hash = base_slide["imagehash"]
-            base_vector = base_slide["textvector"]
-            # print(f"base textvector {base_vector}")
-
-            similarity = cosine_similarity(derived_vector.reshape(1,-1), base_vector.reshape(1,-1))
-            #print( f"similarity {similarity}")
-            vector_similarity = similarity[0][0]
-
-            hash_diff = abs(derived_hash - base_hash)
-
-            grade = "different"
-
-            # ハッシュ値を比較
-            if hash_diff <= args.match or vector_similarity >= convertSimilarityThreshold(args.textmatch):
-                grade = "match"
-                print(f"(完全)一致: derived:{di} base:{bi}")
-            elif hash_diff <= args.high or vector_similarity >= convertSimilarityThreshold(args.texthigh):
-                grade = "high"
-                print(f"高い類似性: derived:{di} base:{bi}")
-            elif hash_diff <= args.low or vector_similarity >= convertSimilarityThreshold(args.textlow):
-                grade = "low"
-                print(f"低い類似性: derived:{di} base:{bi}")
-            else:
-                grade = "different"
-                #print(f"相違: derived:{di} base:{bi}")
-
-            if grade != "different":
-                derived_slide["similars"].append({
-                    "slideimage": base_slide["slideimage"],
-                    "grade": grade,
-                    "imagescore": hash_diff,
-                    "textscore":  str(invertSimilarityThreshold(vector_similarity)),
-                    "pptxfile": base_analyzed["pptxfile"],
-                    "slideindex": bi,
-                })
-                # ここで差分画像を作る
-                # 元画像は derived_analyzed["slides"][di]["slideimage"]
-                # 旧画像は base_analyzed["slides"][bi]["slideimage"]
-                # 画像のパスを取得
-                derived_image_path = os.path.join(args.deriveddir, derived_slide["slideimage"])
-                base_image_path = os.path.join(args.basedir, base_slide["slideimage"])
-
-                img1 = Image.open(derived_image_path).convert('RGB')
-                img2 = Image.open(base_image_path).convert('RGB')
-
-                # 差分画像を作る
-                diff = ImageChops.difference(img1, img2)
-                # diff_di_bi.png というファイル名で差分画像を保存する
-                diff_filename = f"diff_{di}_{bi}.png"
-                diff_path = os.path.join(args.diffdir, diff_filename)
-
-                diff.save(diff_path)
-                #diff.show()                
-
-    # derived_analyzed の imagehash を文字列に変換
-    for slide in derived_analyzed["slides"]:
-        slide["imagehash"] = str(slide["imagehash"])
-        slide["textvector"] = np.array_str(slide["textvector"])
-
-    # base_analyzed の imagehash を文字列に変換
-    for slide in base_analyzed["slides"]:
-        slide["imagehash"] = str(slide["imagehash"])
-        slide["textvector"] = np.array_str(slide["textvector"])
-
-    # ★ ★ ★ textvector もここで文字列に変換する方がいいかもしれない ★ ★ ★ 
-
-    # derived_analyzed を JSON形式で保存
-    jsonfile = os.path.join(args.exportroot, "derived_" + args.output + ".json")
-    with open(jsonfile, "w", encoding="utf-8") as f:
-        import json
-        json.dump(derived_analyzed, f, ensure_ascii=False, indent=4)
-
-    # base_analyzed を JSON形式で保存
-    jsonfile = os.path.join(args.exportroot, "base_" + args.output + ".json")
-    with open(jsonfile, "w", encoding="utf-8") as f:
-        import json
-        json.dump(base_analyzed, f, ensure_ascii=False, indent=4)
+            base_slide["status"] = "removed" if bi in removed else "kept"
+        counts = {status: 0 for status in slidealign.statuses}
+        for status, _ in statuses:
+            counts[status] += 1
+        counts["removed"] = len(removed)
+        print("対応付けの結果: " + ", ".join(f"{status} {count}" for status, count in counts.items()))
+
+    gradelabels = {"match": "(完全)一致", "high": "高い類似性", "low": "低い類似性"}
+    diff_tasks = []
+    diff_similars = []
+    for di, bi, grade, hash_diff, vector_similarity, structure_similarity in pairs:
+        derived_slide = derived_analyzed["slides"][di]
+        base_slide = base_analyzed["slides"][bi]
+        print(f"{gradelabels[grade]}: derived:{di} base:{bi}")
+
+        similar = {
+            "slideimage": base_slide["slideimage"],
+            "grade": grade,
+            "imagescore": hash_diff,
+            "textscore":  str(invertSimilarityThreshold(vector_similarity)),
+            "pptxfile": base_slide.get("pptxfile", base_analyzed["pptxfile"]),
+            "slideindex": base_slide.get("slideindex", bi),
+        }
+        if args.mode == "image":
+            # 差分画像のファイル名は（--corpus ではデッキをまたいだ）通し番号で付ける
+            similar["diffimage"] = f"diff_{di}_{bi}.png"
+        if args.mode != "image":
+            similar["slidetitle"] = base_slide["slidetitle"]
+        if structure_similarity is not None:
+            similar["structurescore"] = round(structure_similarity, 2)
+        derived_slide["similars"].append(similar)
+
+        if args.mode != "image":
+            continue
+        # 差分は後でまとめて並列に求める
+        # 元画像は derived_analyzed["slides"][di]["slideimage"]
+        # 旧画像は base_analyzed["slides"][bi]["slideimage"]
+        # 変化した部分を切り出した差分画像を diff_di_bi.png というファイル名で保存する
+        diff_tasks.append((
+            os.path.join(args.deriveddir, derived_slide["slideimage"]),
+            os.path.join(args.basedir, base_slide["slideimage"]),
+            os.path.join(args.diffdir, similar["diffimage"]),
+        ))
+        diff_similars.append(similar)
+
+    if diff_tasks:
+        print(f"差分画像を作成します: {len(diff_tasks)} 枚")
+        with instrument.span("diff", pairs=len(diff_tasks)):
+            diffs = diffimage.write_diff_images(
+                diff_tasks,
+                workers=args.diff_workers,
+                cache_bytes=args.image_cache_mb * 1024 * 1024,
+                compress_level=args.png_compress,
+                threshold=args.diff_threshold,
+                region_scale=args.diff_scale)
+        # 変化した領域をレポートと JSON に記録する。変化がなければ差分画像はない
+        unchanged = 0
+        for (_, _, diff_path), similar in zip(diff_tasks, diff_similars):
+            diff = diffs[diff_path]
+            similar["diffsize"] = diff["size"]
+            similar["diffregions"] = diff["regions"]
+            similar["diffcrop"] = diff["crop"]
+            if diff["crop"] is None:
+                similar["diffimage"] = None
+                unchanged += 1
+        print(f"変化のないペア（差分画像なし）: {unchanged} / {len(diff_tasks)}")
+
+    # derived_analyzed, base_analyzed を保存する
+    # テキストベクトルと imagehash は JSON と同じ名前のバイナリファイル (.npy) に保存する
+    derived_analyzed["imagehashes"] = derived_hashes
+    base_analyzed["imagehashes"] = base_hashes
+    with instrument.span("save"):
+        jsonfile = os.path.join(args.exportroot, "derived_" + args.output + ".json")
+        analyzedstore.save_analyzed(derived_analyzed, jsonfile)
+        jsonfile = os.path.join(args.exportroot, "base_" + args.output + ".json")
+        analyzedstore.save_analyzed(base_analyzed, jsonfile)
 
     # HTML出力
-    output_html(derived_analyzed, args)
+    removed_slides = None
+    if statuses is not None:
+        removed_slides = [(bi, base_analyzed["slides"][bi]) for bi in alignment["removed"]]
+    with instrument.span("html", slides=len(derived_analyzed["slides"])):
+        output_html(derived_analyzed, args, removed_slides)
+
+    if args.profile is not None:
+        instrument.finish(args.profile or os.path.join(args.exportroot, defaultprofiletrace))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,185 @@
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageChops
+
+#--------------------------------------------
+# スライド画像の差分（変化した領域と、その部分の差分画像）をプロセスプールで並列に出力する
+#
+# 差分画像は derived スライドごとにまとめて1タスクとし、
+# 各ワーカープロセスはデコード済み画像の LRU キャッシュを持つ。
+# これにより、derived 画像はタスクごとに1回、base 画像はワーカーごとに
+# キャッシュから外れない限り1回だけデコードされる
+#
+# 画像全体の差分画像はほとんどが黒なので保存しない。代わりに
+#   - ピクセルの差（RGB の最大値）が threshold を超える部分を、1/scale に縮小した上で
+#     近くのものをまとめ、それぞれの変化したピクセルを囲む矩形（変化した領域）のリスト
+#   - すべての領域を囲む矩形で切り出した差分画像（threshold を超える変化がなければ出力しない）
+# を求める。矩形は derived 画像のピクセル座標の [left, top, right, bottom]
+#--------------------------------------------
+
+# デコード済み画像キャッシュの上限（バイト）のデフォルト
+default_cache_bytes = 512 * 1024 * 1024
+
+# PNG の圧縮レベル（0～9）のデフォルト。PIL のデフォルトと同じ
+default_compress_level = 6
+
+# 差分画像出力のワーカープロセス数のデフォルト
+default_workers = os.cpu_count() or 1
+
+# 変化したとみなすピクセルの差（0～255）のデフォルト。アンチエイリアスなどの小さな差は無視する
+default_threshold = 24
+
+# 変化した領域を求めるときの縮小率のデフォルト（1 なら縮小しない）
+default_region_scale = 4
+
+# この距離（ピクセル）より近い変化は1つの領域にまとめる（文字の並びなどが1つの領域になる）
+region_gap = 32
+
+# 変化した領域の数の上限。超えた場合は、すべての領域を囲む1つの矩形にする
+max_regions = 32
+
+
+# デコード済み（RGB 変換済み）画像の LRU キャッシュ
+# 画像1枚のサイズは 幅 × 高さ × 3 バイトとして数える
+class DecodedImageCache:
+    def __init__(self, max_bytes=default_cache_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._images = OrderedDict()
+
+    def get(self, path):
+        img = self._images.get(path)
+        if img is not None:
+            self._images.move_to_end(path)
+            return img
+
+        with Image.open(path) as opened:
+            img = opened.convert('RGB')
+        size = img.width * img.height * 3
+        self._images[path] = img
+        self.total_bytes += size
+
+        # 上限を超えたら古いものから捨てる（今回読んだ画像は残す）
+        while self.total_bytes > self.max_bytes and len(self._images) > 1:
+            _, evicted = self._images.popitem(last=False)
+            self.total_bytes -= evicted.width * evicted.height * 3
+        return img
+
+
+# ワーカープロセス内の状態
+_cache = None
+_compress_level = default_compress_level
+_threshold = default_threshold
+_region_scale = default_region_scale
+
+# ピクセルの差を 変化あり(255)/なし(0) にする変換表
+_mask_table = None
+
+
+def _init_worker(cache_bytes, compress_level, threshold=default_threshold, region_scale=default_region_scale):
+    global _cache, _compress_level, _threshold, _region_scale, _mask_table
+    _cache = DecodedImageCache(cache_bytes)
+    _compress_level = compress_level
+    _threshold = threshold
+    _region_scale = max(1, int(region_scale))
+    _mask_table = [255 if v > threshold else 0 for v in range(256)]
+
+
+# 差分画像 diff（ImageChops.difference の結果）から、変化した領域の矩形のリストを返す
+def changed_regions(diff, threshold=default_threshold, region_scale=default_region_scale):
+    if diff.getbbox() is None:
+        return []
+    table = _mask_table if threshold == _threshold and _mask_table is not None else [255 if v > threshold else 0 for v in range(256)]
+    r, g, b = diff.split()
+    mask = ImageChops.lighter(ImageChops.lighter(r, g), b).point(table)
+    if mask.getbbox() is None:
+        return []
+
+    # 縮小しても変化した部分が消えないように、縮小後は 0 でなければ変化ありとする
+    # 縮小後の画像が 0×0 にならないように、縮小率は画像の幅・高さまでにする
+    scale = max(1, min(int(region_scale), diff.width, diff.height))
+    if scale > 1:
+        mask = mask.reduce(scale)
+    # scipy は必須パッケージ（README の Install required packages）。起動を速くするため使う時に読み込む
+    from scipy import ndimage
+
+    # 変化した部分を region_gap の半分ずつ広げて、近くの変化を1つの領域にまとめる
+    # 広げたマスクは領域の番号付けだけに使い、矩形は広げる前の変化した部分から求める
+    changed = np.asarray(mask) > 0
+    grow = max(1, round(region_gap / scale / 2))
+    labels, count = ndimage.label(ndimage.maximum_filter(changed, size=2 * grow + 1))
+    regions = []
+    for found in ndimage.find_objects(labels * changed):
+        if found is None:
+            continue
+        rows, cols = found
+        regions.append([
+            min(diff.width, cols.start * scale),
+            min(diff.height, rows.start * scale),
+            min(diff.width, cols.stop * scale),
+            min(diff.height, rows.stop * scale),
+        ])
+    if len(regions) > max_regions:
+        regions = [union_box(regions)]
+    regions.sort(key=lambda box: (box[1], box[0]))
+    return regions
+
+
+# 矩形のリストをすべて囲む矩形を返す
+def union_box(regions):
+    return [
+        min(box[0] for box in regions),
+        min(box[1] for box in regions),
+        max(box[2] for box in regions),
+        max(box[3] for box in regions),
+    ]
+
+
+# derived 画像1枚と、それに類似する base 画像の差分をまとめて出力する
+# targets は (base 画像のパス, 差分画像のパス) のリスト
+# 差分画像のパスごとに {"size": [base 画像の幅, 高さ], "regions": [矩形, ...], "crop": 切り出した矩形} を返す
+# 変化がなければ差分画像は出力せず、"crop" は None になる
+def _write_diffs_for_derived(derived_path, targets):
+    img1 = _cache.get(derived_path)
+    results = []
+    for base_path, diff_path in targets:
+        img2 = _cache.get(base_path)
+        diff = ImageChops.difference(img1, img2)
+        regions = changed_regions(diff, _threshold, _region_scale)
+        crop = union_box(regions) if regions else None
+        if crop is not None:
+            diff.crop(tuple(crop)).save(diff_path, compress_level=_compress_level)
+        elif os.path.exists(diff_path):
+            # 同じ出力先に以前の差分画像が残っている場合
+            os.remove(diff_path)
+        results.append((diff_path, {"size": [img2.width, img2.height], "regions": regions, "crop": crop}))
+    return results
+
+
+# 差分を出力し、{差分画像のパス: 結果} を返す（結果は _write_diffs_for_derived() を参照）
+# tasks は (derived 画像のパス, base 画像のパス, 差分画像のパス) のリスト
+# workers が 1 以下ならプロセスプールを使わずに出力する
+def write_diff_images(tasks, workers=default_workers, cache_bytes=default_cache_bytes, compress_level=default_compress_level, threshold=default_threshold, region_scale=default_region_scale):
+    grouped = OrderedDict()
+    for derived_path, base_path, diff_path in tasks:
+        grouped.setdefault(derived_path, []).append((base_path, diff_path))
+    if not grouped:
+        return {}
+
+    results = {}
+    workers = min(max(1, int(workers)), len(grouped))
+    if workers == 1:
+        _init_worker(cache_bytes, compress_level, threshold, region_scale)
+        for derived_path, targets in grouped.items():
+            results.update(_write_diffs_for_derived(derived_path, targets))
+        return results
+
+    # キャッシュの上限はワーカー全体で cache_bytes になるように分ける
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cache_bytes // workers, compress_level, threshold, region_scale)) as executor:
+        futures = [executor.submit(_write_diffs_for_derived, derived_path, targets) for derived_path, targets in grouped.items()]
+        for future in futures:
+            results.update(future.result())
+        return results
@@ -0,0 +1,190 @@
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+#--------------------------------------------
+# テキストベクトル（文埋め込み）の永続ストア (SQLite)
+#
+# キーは モデル名 + 正規化したテキストの sha256。
+# 同じテキストは実行をまたいでも、デッキやスクリプトが違っても1回だけベクトル化する。
+#
+# テキストの正規化は前後の空白の除去と、連続する空白（改行、タブを含む）を
+# 1つの空白にまとめることだけ。モデルのトークナイザーは空白で区切るので、
+# 正規化の前後でベクトルは変わらない
+#
+# 件数が上限を超えたら、最後に使われた時刻が古いものから消す
+#
+#   python embeddingstore.py stats <ストアのパス>
+#   python embeddingstore.py evict <ストアのパス> --max-entries 件数
+#   python embeddingstore.py clear <ストアのパス>
+#--------------------------------------------
+
+# 保存する件数の上限のデフォルト（all-MiniLM-L6-v2 なら1件 約1.5KB）
+default_max_entries = 500_000
+
+# 上限を超えたときに、上限のこの割合まで減らす（毎回消さずに済むように余裕を持たせる）
+evict_ratio = 0.9
+
+# SQLite の1文で使う変数の数の上限（古い SQLite の上限 999 に合わせる）
+_max_variables = 900
+
+_whitespace = re.compile(r"\s+")
+
+
+# テキストを正規化する
+def normalize_text(text):
+    return _whitespace.sub(" ", text).strip()
+
+
+# テキストのキー（正規化したテキストの sha256）
+def text_key(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).digest()
+
+
+class EmbeddingStore:
+    def __init__(self, path, max_entries=default_max_entries):
+        self.path = os.path.abspath(path)
+        self.max_entries = max_entries
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # slidepipeline のワーカースレッドからも使うので、ロックで排他する
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, key BLOB NOT NULL, dim INTEGER NOT NULL, vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL, PRIMARY KEY (model, key))")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS counters ("
+            " model TEXT PRIMARY KEY, hits INTEGER NOT NULL DEFAULT 0, misses INTEGER NOT NULL DEFAULT 0)")
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # キーのリストについて、保存されているベクトルを {キー: ベクトル} で返す
+    # 見つかったものは最後に使われた時刻を更新し、ヒット数・ミス数を数える
+    def get_many(self, model, keys):
+        unique = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            for start in range(0, len(unique), _max_variables):
+                chunk = unique[start:start + _max_variables]
+                rows = self._conn.execute(
+                    f"SELECT key, dim, vector FROM embeddings WHERE model = ? AND key IN ({','.join('?' * len(chunk))})",
+                    [model] + chunk)
+                for key, dim, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32, count=dim)
+
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND key = ?",
+                [(now, model, key) for key in found])
+            self._count(model, len(found), len(unique) - len(found))
+            self._conn.commit()
+        return found
+
+    # キーとベクトルの組を保存する（1回のトランザクションでまとめて書く）
+    def put_many(self, model, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, key, dim, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                [(model, key, vector.shape[0], vector.tobytes(), now) for key, vector in zip(keys, vectors)])
+            self._conn.commit()
+        self.evict()
+
+    def _count(self, model, hits, misses):
+        self._conn.execute("INSERT OR IGNORE INTO counters (model) VALUES (?)", (model,))
+        self._conn.execute("UPDATE counters SET hits = hits + ?, misses = misses + ? WHERE model = ?", (hits, misses, model))
+
+    # 件数が max_entries を超えていたら、最後に使われた時刻が古いものから max_entries × ratio 件まで消す
+    # 消した件数を返す
+    def evict(self, max_entries=None, ratio=evict_ratio):
+        if max_entries is None:
+            max_entries = self.max_entries
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count <= max_entries:
+                return 0
+            remove = count - int(max_entries * ratio)
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                (remove,))
+            self._conn.commit()
+        return remove
+
+    # すべて消す（ヒット数・ミス数も消す）
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.execute("DELETE FROM counters")
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+
+    # モデルごとの件数、ヒット数、ミス数、ヒット率をリストで返す
+    def stats(self):
+        with self._lock:
+            entries = dict(self._conn.execute("SELECT model, COUNT(*) FROM embeddings GROUP BY model"))
+            counters = {model: (hits, misses) for model, hits, misses in self._conn.execute("SELECT model, hits, misses FROM counters")}
+        result = []
+        for model in sorted(set(entries) | set(counters)):
+            hits, misses = counters.get(model, (0, 0))
+            lookups = hits + misses
+            result.append({
+                "model": model,
+                "entries": entries.get(model, 0),
+                "hits": hits,
+                "misses": misses,
+                "hitrate": hits / lookups if lookups else 0.0,
+            })
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="テキストベクトルの永続ストアの管理")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    stats_parser = subparsers.add_parser("stats", help="件数とヒット率を表示する")
+    stats_parser.add_argument("path", help="ストアのパス")
+    evict_parser = subparsers.add_parser("evict", help="古いものから消して件数を減らす")
+    evict_parser.add_argument("path", help="ストアのパス")
+    evict_parser.add_argument("--max-entries", type=int, default=default_max_entries, help=f"残す件数の上限（デフォルト: {default_max_entries}）")
+    clear_parser = subparsers.add_parser("clear", help="すべて消す")
+    clear_parser.add_argument("path", help="ストアのパス")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        parser.error(f"ストアがありません: {args.path}")
+
+    with EmbeddingStore(args.path) as store:
+        if args.command == "stats":
+            print(f"ストア: {store.path} ({os.path.getsize(store.path) / (1024 * 1024):.1f} MB)")
+            for row in store.stats():
+                print(f"{row['model']}: {row['entries']} 件, ヒット {row['hits']}, ミス {row['misses']}, ヒット率 {row['hitrate']:.1%}")
+        elif args.command == "evict":
+            print(f"{store.evict(args.max_entries, ratio=1.0)} 件を消しました")
+        elif args.command == "clear":
+            store.clear()
+            print("すべて消しました")
+
+
+if __name__ == "__main__":
+    main()
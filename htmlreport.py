@@ -0,0 +1,233 @@
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from html import escape as html_escape
+
+from PIL import Image, features
+
+#--------------------------------------------
+# 比較レポート (HTML) の出力
+#
+# スライド数や類似ペアが多くてもブラウザで開けるように
+#   - 表示用には縮小したサムネイル (JPEG / WebP) を使い、元の画像にはリンクする
+#   - 画像は loading='lazy' で、表示される直前に読み込む
+#   - レポートは page_size 行ごとのページに分け、索引のページ（comparison_report.html）からリンクする
+#   - 行は作った順にファイルに書き出し、全体をメモリに持たない
+#   - 機械で読むための結果を NDJSON（1行1スライドの JSON）でも出力する
+#
+#   thumbs = write_thumbnails(imagepaths, thumbdir, exportroot)   # サムネイルを並列に作る
+#   with ReportWriter(exportroot, title, style) as writer:
+#       writer.add(label, rowhtml, record, tags, anchor)           # 1行（1スライド）を書く
+#       writer.add_record(record)                                  # NDJSON だけに書く
+#       writer.set_index_extra(html)                               # 索引のページの末尾に追加する
+#--------------------------------------------
+
+# サムネイルの幅（ピクセル）のデフォルト。0 ならサムネイルを作らず、元の画像を表示する
+default_thumb_width = 320
+
+# サムネイルの形式と拡張子
+thumb_formats = {"jpeg": ".jpg", "webp": ".webp"}
+default_thumb_format = "jpeg"
+
+# サムネイルの画質（JPEG, WebP の quality）
+default_thumb_quality = 80
+
+# 1ページの行（スライド）数のデフォルト
+default_page_size = 50
+
+# サムネイル作成のワーカープロセス数のデフォルト
+default_workers = os.cpu_count() or 1
+
+# 索引のページと結果のファイル名
+index_filename = "comparison_report.html"
+results_filename = "comparison_results.ndjson"
+
+# ワーカープロセスに渡すサムネイルの数
+_thumb_chunksize = 16
+
+
+# Pillow が WebP を書けない場合は JPEG にする
+def resolve_thumb_format(thumb_format):
+    if thumb_format == "webp" and not features.check("webp"):
+        print("Pillow が WebP に対応していないため、サムネイルは JPEG で作ります")
+        return "jpeg"
+    return thumb_format
+
+
+# exportroot からの相対パスで、HTML に書くリンクを返す
+# （出力ルートディレクトリごと移動・共有してもリンクが切れないように）
+def link(path, exportroot):
+    try:
+        path = os.path.relpath(path, exportroot)
+    except ValueError:
+        # Windows でドライブが異なる場合
+        path = os.path.abspath(path)
+    return path.replace("\\", "/")
+
+
+# 画像のサムネイルのパスを返す。thumbdir の下に、exportroot からの相対パスと同じ構成で置く
+def thumbnail_path(imagepath, thumbdir, exportroot, thumb_format=default_thumb_format):
+    relpath = os.path.relpath(os.path.abspath(imagepath), os.path.abspath(exportroot))
+    if relpath.startswith(".."):
+        # 出力ルートディレクトリの外の画像は、パスの区切りを "_" にしたファイル名にする
+        relpath = os.path.abspath(imagepath).replace(":", "").replace("\\", "_").replace("/", "_")
+    return os.path.join(thumbdir, os.path.splitext(relpath)[0] + thumb_formats[thumb_format])
+
+
+# サムネイルを1枚作り、(サムネイルのパス, 幅, 高さ) を返す
+# 元の画像より新しいサムネイルがある場合は作り直さない
+def _write_thumbnail(imagepath, thumbpath, width, thumb_format, quality):
+    if os.path.exists(thumbpath) and os.path.getmtime(thumbpath) >= os.path.getmtime(imagepath):
+        with Image.open(thumbpath) as thumb:
+            return thumbpath, thumb.width, thumb.height
+
+    with Image.open(imagepath) as img:
+        img.draft("RGB", (width, width))  # JPEG なら縮小しながらデコードする
+        img = img.convert("RGB")
+    img.thumbnail((width, max(1, width * img.height // max(1, img.width))))
+    os.makedirs(os.path.dirname(thumbpath), exist_ok=True)
+    img.save(thumbpath, "WEBP" if thumb_format == "webp" else "JPEG", quality=quality)
+    return thumbpath, img.width, img.height
+
+
+def _write_thumbnail_task(task):
+    return _write_thumbnail(*task)
+
+
+# 画像のサムネイルを作り、{画像のパス: (サムネイルのパス, 幅, 高さ)} を返す
+# 存在しない画像は除く。workers が 1 以下ならプロセスプールを使わずに作る
+def write_thumbnails(imagepaths, thumbdir, exportroot, width=default_thumb_width, thumb_format=default_thumb_format, quality=default_thumb_quality, workers=default_workers):
+    tasks = []
+    seen = set()
+    for imagepath in imagepaths:
+        if imagepath in seen or not os.path.exists(imagepath):
+            continue
+        seen.add(imagepath)
+        tasks.append((imagepath, thumbnail_path(imagepath, thumbdir, exportroot, thumb_format), width, thumb_format, quality))
+    if not tasks:
+        return {}
+
+    workers = min(max(1, int(workers)), (len(tasks) + _thumb_chunksize - 1) // _thumb_chunksize)
+    if workers == 1:
+        results = map(_write_thumbnail_task, tasks)
+        return {task[0]: result for task, result in zip(tasks, results)}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_write_thumbnail_task, tasks, chunksize=_thumb_chunksize)
+        return {task[0]: result for task, result in zip(tasks, results)}
+
+
+#--------------------------------------------
+# ページに分けたレポートと NDJSON を書く
+#--------------------------------------------
+class ReportWriter:
+    def __init__(self, exportroot, title, style="", page_size=default_page_size):
+        self.exportroot = exportroot
+        self.title = title
+        self.style = style
+        self.page_size = max(1, int(page_size))
+        self.index_path = os.path.join(exportroot, index_filename)
+        self.results_path = os.path.join(exportroot, results_filename)
+        self._pages = []  # ページごとの {"file", "first", "last", "rows", "tags"}
+        self._page = None
+        self._index_extra = ""
+        self._results = None
+
+    def __enter__(self):
+        self._results = open(self.results_path, "w", encoding="utf-8")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # ページのファイル名（1から）
+    def page_filename(self, number):
+        return f"{os.path.splitext(index_filename)[0]}_{number:03d}.html"
+
+    def _head(self, title):
+        return (
+            "<!DOCTYPE html>\n<html lang='ja'>\n<head>\n<meta charset='UTF-8'>\n"
+            f"<title>{html_escape(title)}</title>\n<style>\n{self.style}\n</style>\n</head>\n<body>\n"
+        )
+
+    def _navigation(self, number, has_next):
+        items = [f"<a href='{index_filename}'>索引</a>"]
+        if number > 1:
+            items.append(f"<a href='{self.page_filename(number - 1)}'>← 前のページ</a>")
+        items.append(f"ページ {number}")
+        if has_next:
+            items.append(f"<a href='{self.page_filename(number + 1)}'>次のページ →</a>")
+        return "<nav>" + " | ".join(items) + "</nav>\n"
+
+    def _open_page(self):
+        number = len(self._pages) + 1
+        page = {"file": self.page_filename(number), "first": None, "last": None, "rows": 0, "tags": Counter()}
+        self._pages.append(page)
+        self._page = open(os.path.join(self.exportroot, page["file"]), "w", encoding="utf-8")
+        self._page.write(self._head(f"{self.title} ({number})"))
+        # 次のページがあるかはまだ分からないので、ページの先頭には前のページと索引へのリンクだけを書く
+        self._page.write(self._navigation(number, False))
+        self._page.write(f"<h1>{self.title}</h1>\n")
+
+    def _close_page(self, has_next):
+        if self._page is None:
+            return
+        self._page.write(self._navigation(len(self._pages), has_next))
+        self._page.write("</body></html>\n")
+        self._page.close()
+        self._page = None
+
+    # 1行（1スライド）を書く
+    # label は索引に表示する見出し、rowhtml は行の HTML、record は NDJSON に書く値、
+    # tags は索引にページごとの件数を表示する分類（"match", "modified" など）、
+    # anchor は索引からリンクする行の id
+    def add(self, label, rowhtml, record, tags=(), anchor=None):
+        if self._page is not None and self._pages[-1]["rows"] >= self.page_size:
+            self._close_page(True)
+        if self._page is None:
+            self._open_page()
+        page = self._pages[-1]
+        entry = f"<a href='{page['file']}#{anchor}'>{label}</a>" if anchor else label
+        if page["first"] is None:
+            page["first"] = entry
+        page["last"] = entry
+        page["rows"] += 1
+        page["tags"].update(tags)
+        self._page.write(rowhtml)
+        self._page.write("\n")
+        self.add_record(dict(record, page=len(self._pages)))
+
+    # NDJSON に1行書く
+    def add_record(self, record):
+        self._results.write(json.dumps(record, ensure_ascii=False))
+        self._results.write("\n")
+
+    # 索引のページの末尾に追加する HTML
+    def set_index_extra(self, html):
+        self._index_extra = html
+
+    # 最後のページを閉じ、索引のページを書く
+    def close(self):
+        if self._results is None:
+            return
+        self._close_page(False)
+        self._results.close()
+        self._results = None
+
+        total = Counter()
+        for page in self._pages:
+            total.update(page["tags"])
+        with open(self.index_path, "w", encoding="utf-8") as f:
+            f.write(self._head(self.title))
+            f.write(f"<h1>{self.title}</h1>\n")
+            f.write(f"<p>スライド: {sum(page['rows'] for page in self._pages)} / ページ: {len(self._pages)}"
+                    + "".join(f" / {html_escape(tag)}: {count}" for tag, count in sorted(total.items()))
+                    + f" / <a href='{results_filename}'>{results_filename}</a></p>\n")
+            f.write("<table>\n<tr><th>ページ</th><th>最初</th><th>最後</th><th>スライド数</th><th>分類</th></tr>\n")
+            for number, page in enumerate(self._pages, start=1):
+                tags = ", ".join(f"{html_escape(tag)}: {count}" for tag, count in sorted(page["tags"].items()))
+                f.write(f"<tr><td><a href='{page['file']}'>{number}</a></td><td>{page['first']}</td><td>{page['last']}</td>"
+                        f"<td>{page['rows']}</td><td>{tags if tags else '-'}</td></tr>\n")
+            f.write("</table>\n")
+            f.write(self._index_extra)
+            f.write("</body></html>\n")
@@ -0,0 +1,285 @@
+import json
+import os
+import sys
+import threading
+import time
+
+#--------------------------------------------
+# 処理の段階ごとの時間の計測（スパンとカウンター）
+#
+#   instrument.enable()                               # 計測を始める（--profile の場合）
+#   with instrument.span("render", slides=n) as s:    # 段階の時間を計る（入れ子にできる）
+#       ...
+#       s.set(pairs=m)                                # 終わるまでに分かった件数を追加する
+#   instrument.count("pairs", n)                      # 件数を数える
+#   instrument.finish("trace.json")                   # トレースを書き、集計表を表示する
+#
+# enable() するまでは何も記録しない（span() は何もしない）ので、計測しない場合の負荷はほとんどない
+#
+# トレースは Chrome の trace event 形式の JSON（chrome://tracing や https://ui.perfetto.dev で開ける）。
+# 集計表は段階ごとの合計時間と、span() に渡した slides, pairs の件数から計算した slides/s, pairs/s、
+# 全体の経過時間と最大メモリ使用量（ピーク RSS）
+#
+# profile_stage を指定した場合は、その名前の段階を cProfile でも計測し、
+# トレースと同じ名前の .prof ファイルに保存して、時間のかかった関数を表示する
+#--------------------------------------------
+
+# 件数として集計する span() の引数
+rate_keys = ("slides", "pairs")
+
+# cProfile の結果を表示する関数の数
+profile_top = 20
+
+_lock = threading.Lock()
+_enabled = False
+_origin = 0.0
+_events = []
+_stages = {}
+_counters = {}
+_profile_stage = None
+_profiler = None
+_profile_depth = 0
+
+
+# 計測を始める。profile_stage はcProfile で計測する段階の名前
+def enable(profile_stage=None):
+    global _enabled, _origin, _profile_stage, _profiler
+    _events.clear()
+    _stages.clear()
+    _counters.clear()
+    _origin = time.perf_counter()
+    _profile_stage = profile_stage
+    _profiler = None
+    if profile_stage:
+        import cProfile
+        _profiler = cProfile.Profile()
+    _enabled = True
+
+
+def enabled():
+    return _enabled
+
+
+class _Span:
+    __slots__ = ("name", "args", "start", "profiling")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    # 終わるまでに分かった値（件数など）を追加する
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        global _profile_depth
+        self.profiling = False
+        if _profiler is not None and self.name == _profile_stage:
+            with _lock:
+                # 入れ子や複数のスレッドで同時に計測する場合は、最初の1つだけ enable する
+                self.profiling = True
+                _profile_depth += 1
+                if _profile_depth == 1:
+                    try:
+                        _profiler.enable()
+                    except ValueError:
+                        # 別のプロファイラーが動いている（他のスレッドなど）
+                        pass
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _profile_depth
+        end = time.perf_counter()
+        if self.profiling:
+            with _lock:
+                _profile_depth -= 1
+                if _profile_depth == 0:
+                    _profiler.disable()
+        _record(self.name, self.start, end, self.args)
+        return False
+
+
+class _NullSpan:
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+# 段階の時間を計るコンテキストマネージャーを返す
+# args は トレースに記録する値。slides, pairs は集計表の slides/s, pairs/s の計算に使う
+def span(name, **args):
+    if not _enabled:
+        return _null_span
+    return _Span(name, args)
+
+
+# カウンターに n を加える
+def count(name, n=1):
+    if not _enabled:
+        return
+    with _lock:
+        value = _counters.get(name, 0) + n
+        _counters[name] = value
+        _events.append({
+            "name": name, "ph": "C", "ts": _microseconds(time.perf_counter()),
+            "pid": os.getpid(), "tid": threading.get_ident(), "args": {name: value},
+        })
+
+
+def _microseconds(t):
+    return round((t - _origin) * 1_000_000, 1)
+
+
+def _record(name, start, end, args):
+    event = {
+        "name": name, "ph": "X", "ts": _microseconds(start), "dur": round((end - start) * 1_000_000, 1),
+        "pid": os.getpid(), "tid": threading.get_ident(),
+    }
+    if args:
+        event["args"] = {key: value if isinstance(value, (int, float, str, bool)) or value is None else str(value) for key, value in args.items()}
+    with _lock:
+        _events.append(event)
+        stage = _stages.setdefault(name, {"calls": 0, "seconds": 0.0, "first": start})
+        stage["calls"] += 1
+        stage["seconds"] += end - start
+        for key in rate_keys:
+            if isinstance(args.get(key), (int, float)):
+                stage[key] = stage.get(key, 0) + args[key]
+
+
+# 最大メモリ使用量（バイト）を (このプロセス, 子プロセスの最大) で返す。取得できない場合は None
+def peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return _windows_peak_rss(), None
+    # Linux は KB 単位、macOS はバイト単位
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+
+
+def _windows_peak_rss():
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize
+    except (AttributeError, OSError):
+        return None
+
+
+# 集計結果を辞書で返す
+def summary():
+    with _lock:
+        stages = {name: dict(stage) for name, stage in _stages.items()}
+        counters = dict(_counters)
+    wall = time.perf_counter() - _origin
+    self_rss, children_rss = peak_rss()
+    for stage in stages.values():
+        stage.pop("first", None)
+        for key in rate_keys:
+            if key in stage:
+                stage[f"{key}_per_second"] = stage[key] / stage["seconds"] if stage["seconds"] > 0 else None
+    return {
+        "wall_seconds": wall,
+        "stages": stages,
+        "counters": counters,
+        "slides_per_second": counters["slides"] / wall if "slides" in counters and wall > 0 else None,
+        "pairs_per_second": counters["pairs"] / wall if "pairs" in counters and wall > 0 else None,
+        "peak_rss_bytes": self_rss,
+        "peak_rss_children_bytes": children_rss,
+    }
+
+
+def _format_rate(value):
+    return f"{value:12.1f}" if value is not None else f"{'-':>12}"
+
+
+def _format_bytes(value):
+    return f"{value / (1024 * 1024):.1f} MB" if value else "-"
+
+
+# 集計表を表示する
+def print_summary(result=None):
+    result = result or summary()
+    wall = result["wall_seconds"]
+    print(f"{'段階':<28}{'回数':>8}{'時間(s)':>10}{'割合':>8}{'slides/s':>12}{'pairs/s':>12}")
+    # 始まった順に表示する
+    order = sorted(_stages, key=lambda name: _stages[name]["first"])
+    for name in order:
+        stage = result["stages"][name]
+        share = stage["seconds"] / wall if wall > 0 else 0.0
+        print(f"{name:<28}{stage['calls']:>8}{stage['seconds']:>10.3f}{share:>8.1%}"
+              f"{_format_rate(stage.get('slides_per_second'))}{_format_rate(stage.get('pairs_per_second'))}")
+    print(f"{'全体':<28}{'':>8}{wall:>10.3f}{'':>8}{_format_rate(result['slides_per_second'])}{_format_rate(result['pairs_per_second'])}")
+    if result["counters"]:
+        print("カウンター: " + ", ".join(f"{name}={value}" for name, value in result["counters"].items()))
+    print(f"最大メモリ使用量: {_format_bytes(result['peak_rss_bytes'])}"
+          + (f"（子プロセスの最大 {_format_bytes(result['peak_rss_children_bytes'])}）" if result["peak_rss_children_bytes"] else ""))
+
+
+# Chrome の trace event 形式でトレースを書く
+def write_trace(path, result=None):
+    result = result or summary()
+    with _lock:
+        events = list(_events)
+    thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+    metadata = [{
+        "name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+        "args": {"name": thread_names.get(tid, str(tid))},
+    } for tid in sorted({event["tid"] for event in events})]
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms", "otherData": {"summary": result}}, f, ensure_ascii=False)
+
+
+# cProfile の結果を保存し、時間のかかった関数を表示する
+def write_profile(path):
+    if _profiler is None:
+        return
+    import pstats
+    _profiler.dump_stats(path)
+    print(f"cProfile の結果 ({_profile_stage}): {path}")
+    pstats.Stats(_profiler).sort_stats("cumulative").print_stats(profile_top)
+
+
+# 計測を終えて、トレースを書き、集計表を表示する（cProfile の結果も保存する）
+def finish(trace_path):
+    global _enabled
+    if not _enabled:
+        return
+    result = summary()
+    _enabled = False
+    write_trace(trace_path, result)
+    print(f"トレースを出力しました: {trace_path}")
+    print_summary(result)
+    write_profile(os.path.splitext(trace_path)[0] + ".prof")
@@ -1,8 +1,13 @@
+import os
 import json
-from pptx import Presentation
 import argparse
 
 import calcslidesimilarity
+import slidepairscoring
+import pptxanalyzer
+import pptxxmlanalyzer
+import instrument
+from pptxanalyzer import write_slides, position_ratio_to_upstair
 
 # pptx のスライドの幅と高さを取得するための変数
 slide_width = 0
@@ -61,6 +66,18 @@ def parse_commandargs():
     parser.add_argument('--exportdir', '-e', type=str, default='', help='export directory for index file')
     parser.add_argument('--exportfile', '-o', type=str, default=None, help='export file name for index file')
     parser.add_argument('--sourcedir', '-s', type=str, default='', help='source directory for source file')
+    # 解析結果の出力形式（--exportfile 指定時、<exportfile>_1.json, <exportfile>_2.json のように書き出す）
+    parser.add_argument('--format', type=str, choices=['json', 'ndjson'], default='json', help='format of the analyzed slides written with --exportfile (default: json)')
+    # pptx の読み方（xml: スライドの XML を直接読む（速い）, python-pptx: python-pptx で読む）
+    parser.add_argument('--reader', type=str, choices=['xml', 'python-pptx'], default='xml', help='how to read pptx files (default: xml)')
+    # ----------------------------------------------
+    # スライド類似度の並列計算のプロセス数
+    parser.add_argument('--jobs', '-j', type=int, default=slidepairscoring.default_jobs, help=f'number of processes to score slide pairs (default: {slidepairscoring.default_jobs})')
+    # 同じ shape（種類・テキスト・位置が同じ）を1つにまとめてから比較する
+    parser.add_argument('--dedup', action='store_true', help='collapse identical shapes before scoring (same result, faster on repetitive slides)')
+    # 段階ごとの時間の計測（Chrome のトレースと集計表を出力する）
+    parser.add_argument('--profile', type=str, nargs='?', const='trace.json', default=None, metavar='TRACEFILE', help='write a Chrome trace of the stages and print a summary (default file: trace.json)')
+    parser.add_argument('--profile-stage', type=str, default=None, help='also run cProfile on this stage with --profile (load, score)')
 
 
     # 引数を解析
@@ -71,145 +88,23 @@ def parse_commandargs():
 
 
 #---------------------------------------------
-# shape の座標値を辞書形式で取得する
-#---------------------------------------------
-def shape_position_dict(shape):
-    return {
-        "left": shape.left.pt,
-        "top": shape.top.pt,
-        "width": shape.width.pt,
-        "height": shape.height.pt
-    }
-
-#---------------------------------------------
-#座標値をスライドの大きさとの相対比率に変換する
-#---------------------------------------------
-def normalize_position(shape, slide_width_pt, slide_height_pt):
-    return {
-        "left": round(shape.left.pt / slide_width_pt, 4),
-        "top": round(shape.top.pt / slide_height_pt, 4),
-        "width": round(shape.width.pt / slide_width_pt, 4),
-        "height": round(shape.height.pt / slide_height_pt, 4),
-    }
-
-#---------------------------------------------
-# shape["position_ratio"] 以下の座標値を上の階層に移動して
-# position_ratio と position_pt を削除する
+# pptx ファイルを1スライドずつ解析して、スライドのリストを返す
+# outpath を指定した場合は、解析したスライドから順にファイルに書き出す
 #---------------------------------------------
-def position_ratio_to_upstair(shape):
-    # shape.left.pt, shape.top.pt, shape.width.pt, shape.height.pt
-    # から left, top, width, height を計算する
-    shape["left"] = shape["position_ratio"]["left"]
-    shape["top"] = shape["position_ratio"]["top"]
-    shape["width"] = shape["position_ratio"]["width"]
-    shape["height"] = shape["position_ratio"]["height"]
-
-    # shapeから ["position_ratio"],["position_pt"] を削除
-    del shape["position_ratio"]
-    del shape["position_pt"]
-
-    return shape
+def load_slides(pptxfile, outpath=None, format='json', reader='xml', jobs=1):
+    if reader == 'xml':
+        title, slides = pptxxmlanalyzer.stream_pptx(pptxfile, workers=jobs)
+    else:
+        title, slides = pptxanalyzer.stream_pptx(pptxfile)
+    if outpath:
+        slides = write_slides(title, slides, outpath, format)
+    result = []
+    for slide in slides:
+        for shape in slide["shapes"]:
+            position_ratio_to_upstair(shape)
+        result.append(slide)
+    return result
 
-#---------------------------------------------
-# pptx ファイルを解析して、スライドの情報を取得する
-# 解析結果を辞書形式で返す
-#---------------------------------------------
-def analyze_pptx(filepath):
-    prs = Presentation(filepath)
-
-    slide_width = prs.slide_width.pt
-    slide_height = prs.slide_height.pt
-
-
-    # 表紙タイトル（slide 0）
-    document_title = ""
-    if prs.slides:
-        first_slide = prs.slides[0]
-        max_font_size = 0
-        for shape in first_slide.shapes:
-            if not hasattr(shape, "text") or not shape.text.strip():
-                continue
-            # テキストがある shape を対象
-            try:
-                for paragraph in shape.text_frame.paragraphs:
-                    for run in paragraph.runs:
-                        font_size = run.font.size.pt if run.font.size else 0
-                        if font_size > max_font_size:
-                            max_font_size = font_size
-                            document_title = run.text.strip()
-            except AttributeError:
-                continue  # shape に text_frame がない場合もある
-
-    analyzed = {
-        "DocumentTitle": document_title,
-        "slides": []
-    }
-
-    for idx, slide in enumerate(prs.slides):
-        slide_title = ""
-        for shape in slide.shapes:
-            if shape.is_placeholder and shape.placeholder_format.type == 1:
-                slide_title = shape.text.strip()
-                break
-
-        shapes = []
-        for shape in slide.shapes:
-            # pos = shape_position_dict(shape)
-
-            pos_pt = shape_position_dict(shape)
-            pos_ratio = normalize_position(shape, slide_width, slide_height)
-
-
-            # テキスト
-            if hasattr(shape, "text") and shape.text.strip():
-                shapes.append({
-                    "type": "text",
-                    "text": shape.text.strip(),
-                    "position_pt": pos_pt,
-                    "position_ratio": pos_ratio
-                })
-
-            # 画像
-            elif shape.shape_type == 13 and shape.image is not None:
-                image_bytes = shape.image.blob
-                ext = shape.image.ext
-                image_name = shape.image.filename  # e.g. image1.png
-                shapes.append({
-                    "type": "image",
-                    "image_format": ext,
-                    "filename": image_name,
-                    "image_bytes": len(image_bytes),
-                    "position_pt": pos_pt,
-                    "position_ratio": pos_ratio
-                })
-
-            # 表
-            elif shape.has_table:
-                table_data = []
-                table = shape.table
-                for row in table.rows:
-                    table_data.append([cell.text.strip() for cell in row.cells])
-                shapes.append({
-                    "type": "table",
-                    "rows": table_data,
-                    "position_pt": pos_pt,
-                    "position_ratio": pos_ratio
-                })
-
-        # ノート
-        notes_text = ""
-        if slide.has_notes_slide and hasattr(slide.notes_slide, "notes_text_frame"):
-            frame = slide.notes_slide.notes_text_frame
-            if frame is not None:
-                notes_text = frame.text.strip()
-
-        analyzed["slides"].append({
-            "slidetitle": slide_title,
-            "shapes": shapes,
-            "notes": notes_text
-        })
-
-    return analyzed
 
 # 使用例
 if __name__ == "__main__":
@@ -225,21 +120,28 @@ if __name__ == "__main__":
     logfile = args.logfile
     loglevel = args.loglevel
 
-    pptxmap1 = analyze_pptx(pptxfile1)
-    # print(json.dumps(pptxmap1, ensure_ascii=False, indent=2))
+    if args.profile is not None:
+        instrument.enable(args.profile_stage)
 
-    #pptxmap1["slides"][x]["shapes"] を position_ratio_to_upstair で変換して更新する
-    slides1 = pptxmap1["slides"]
-    for slide in slides1:
-        for shape in slide["shapes"]:
-            shape = position_ratio_to_upstair(shape)
+    if args.dedup:
+        settings = calcslidesimilarity.get_similarity_settings()
+        settings["dedup"] = True
+        calcslidesimilarity.set_similarity_settings(**settings)
 
-    pptxmap2 = analyze_pptx(pptxfile2)
-    # print(json.dumps(pptxmap2, ensure_ascii=False, indent=2))
-    slides2 = pptxmap2["slides"]
-    for slide in slides2:
-        for shape in slide["shapes"]:
-            shape = position_ratio_to_upstair(shape)
+    # 解析結果の書き出し先
+    outpath1 = outpath2 = None
+    if exportfile:
+        outpath1 = os.path.join(exportdir, f"{exportfile}_1.{args.format}")
+        outpath2 = os.path.join(exportdir, f"{exportfile}_2.{args.format}")
+
+    # 各 shape の座標値は position_ratio_to_upstair で相対比率に変換する
+    with instrument.span("load", file=os.path.basename(pptxfile1)) as span:
+        slides1 = load_slides(pptxfile1, outpath1, args.format, args.reader, args.jobs)
+        span.set(slides=len(slides1))
+    with instrument.span("load", file=os.path.basename(pptxfile2)) as span:
+        slides2 = load_slides(pptxfile2, outpath2, args.format, args.reader, args.jobs)
+        span.set(slides=len(slides2))
+    instrument.count("slides", len(slides1) + len(slides2))
 
 
     # pptx1 のスライドの類似データを格納するリスト
@@ -252,15 +154,22 @@ if __name__ == "__main__":
     for  slide2idx in range( 1 , len(slides2)):
         sm2item[f"{slide2idx}"] = {}
 
-    for  slide1idx in range( 1 , len(slides1)):
-        slide1 = pptxmap1["slides"][slide1idx]
-        for slide2idx in range(1, len(slides2)):
-            slide2 = pptxmap2["slides"][slide2idx]
-            # スライドの類似度を計算
-            similarity = calcslidesimilarity.slide_similarity(slide1, slide2, shape_threshold)
-            if( similarity >= slidesimilarity_threshold):
-                sm1item[f"{slide1idx}"][f"{slide2idx}"]=similarity
-                sm2item[f"{slide2idx}"][f"{slide1idx}"]=similarity
+    # スライドの類似度を計算（--jobs のプロセス数で並列に計算する）
+    pairs = max(0, len(slides1) - 1) * max(0, len(slides2) - 1)
+    with instrument.span("score", pairs=pairs):
+        scored = slidepairscoring.score_pairs(
+            slides1, slides2,
+            range(1, len(slides1)), range(1, len(slides2)),
+            shape_threshold, slidesimilarity_threshold,
+            jobs=args.jobs)
+    instrument.count("pairs", pairs)
+    for slide1idx, slide2idx, similarity in scored:
+        sm1item[f"{slide1idx}"][f"{slide2idx}"]=similarity
+        sm2item[f"{slide2idx}"][f"{slide1idx}"]=similarity
+
+    if loglevel.lower() == 'debug':
+        stats = calcslidesimilarity.text_cache_stats()
+        print(f"text similarity cache: hits={stats['hits']} misses={stats['misses']} hitrate={stats['hitrate']:.2%}")
 
     # 類似度が高い順にソートする
     for slide1idx in range( 1 , len(slides1)):
@@ -279,8 +188,8 @@ if __name__ == "__main__":
                 # print(f"{sm1item[str(slide1idx)][z]}")
                 slide2idx = int(sm1item[str(slide1idx)][z][0])
                 print('-' * 20)
-                print(f"{slide1idx} {slides1[slide1idx]["slidetitle"]}")
-                print(f"{slide2idx} {slides2[slide2idx]["slidetitle"]}")
+                print(f"{slide1idx} {slides1[slide1idx]['slidetitle']}")
+                print(f"{slide2idx} {slides2[slide2idx]['slidetitle']}")
 
     print('\n')
 
@@ -294,8 +203,8 @@ if __name__ == "__main__":
                 slide2idx = int(sm1item[str(slide1idx)][z][0])
                 print('-' * 20)
                 print(f"一致度 {sm1item[f'{slide1idx}'][z][1]}")
-                print(f"{slide1idx} {slides1[slide1idx]["slidetitle"]}")
-                print(f"{slide2idx} {slides2[slide2idx]["slidetitle"]}")
+                print(f"{slide1idx} {slides1[slide1idx]['slidetitle']}")
+                print(f"{slide2idx} {slides2[slide2idx]['slidetitle']}")
 
     print(f"==========  一致度 0.6 =< ～ < 0.8 のスライドを表示します ==========")
     for slide1idx in range( 1 , len(slides1)):
@@ -307,15 +216,17 @@ if __name__ == "__main__":
                 slide2idx = int(sm1item[str(slide1idx)][z][0])
                 print('-' * 20)
                 print(f"一致度 {sm1item[f'{slide1idx}'][z][1]}")
-                print(f"{slide1idx} {slides1[slide1idx]["slidetitle"]}")
-                print(f"{slide2idx} {slides2[slide2idx]["slidetitle"]}")
+                print(f"{slide1idx} {slides1[slide1idx]['slidetitle']}")
+                print(f"{slide2idx} {slides2[slide2idx]['slidetitle']}")
 
     print(f"==========  類似スライド不検出のスライドを表示します ==========")
     for slide1idx in range( 1 , len(slides1)):
         # sm1item[f"{slide1idx}"] が空のものを出力する
         if len(sm1item[f"{slide1idx}"]) == 0:
-            print(f"{slide1idx} {slides1[slide1idx]["slidetitle"]}")
+            print(f"{slide1idx} {slides1[slide1idx]['slidetitle']}")
 
 #    print(json.dumps(sm1item, ensure_ascii=False, indent=2))
 #    print(json.dumps(sm2item, ensure_ascii=False, indent=2))
 
+    if args.profile is not None:
+        instrument.finish(args.profile)
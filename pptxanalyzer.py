@@ -0,0 +1,242 @@
+import json
+import shutil
+import tempfile
+import zipfile
+
+import pptxpackage
+
+#---------------------------------------------
+# python-pptx で pptx ファイルを解析する共通処理
+# （pptx-to-json.py, compare-pptx.py から使う）
+#---------------------------------------------
+
+
+#---------------------------------------------
+# shape の座標値を辞書形式で取得する
+#---------------------------------------------
+def shape_position_dict(shape):
+    return {
+        "left": shape.left.pt,
+        "top": shape.top.pt,
+        "width": shape.width.pt,
+        "height": shape.height.pt
+    }
+
+#---------------------------------------------
+#座標値をスライドの大きさとの相対比率に変換する
+#---------------------------------------------
+def normalize_position(shape, slide_width_pt, slide_height_pt):
+    return {
+        "left": round(shape.left.pt / slide_width_pt, 4),
+        "top": round(shape.top.pt / slide_height_pt, 4),
+        "width": round(shape.width.pt / slide_width_pt, 4),
+        "height": round(shape.height.pt / slide_height_pt, 4),
+    }
+
+#---------------------------------------------
+# shape["position_ratio"] 以下の座標値を上の階層に移動して
+# position_ratio と position_pt を削除する
+#---------------------------------------------
+def position_ratio_to_upstair(shape):
+    # shape.left.pt, shape.top.pt, shape.width.pt, shape.height.pt
+    # から left, top, width, height を計算する
+    shape["left"] = shape["position_ratio"]["left"]
+    shape["top"] = shape["position_ratio"]["top"]
+    shape["width"] = shape["position_ratio"]["width"]
+    shape["height"] = shape["position_ratio"]["height"]
+
+    # shapeから ["position_ratio"],["position_pt"] を削除
+    del shape["position_ratio"]
+    del shape["position_pt"]
+
+    return shape
+
+#---------------------------------------------
+# 画像などのバイナリを読み込まずに pptx ファイルを開く
+# python-pptx は開くときにすべてのパートを読み込むので、
+# ppt/media/, ppt/embeddings/ のパートを空にした複製（一時ファイル）を開く
+# (Presentation, {パート名: 元のサイズ（バイト数）}) を返す
+#---------------------------------------------
+_binary_part_dirs = ("ppt/media/", "ppt/embeddings/")
+
+def open_presentation(filepath):
+    # python-pptx は読み込みに時間がかかるので、使う時に読み込む
+    from pptx import Presentation
+
+    part_sizes = {}
+    with zipfile.ZipFile(filepath) as src, tempfile.TemporaryFile() as tmp:
+        with zipfile.ZipFile(tmp, "w", zipfile.ZIP_STORED) as dst:
+            for info in src.infolist():
+                part_sizes["/" + info.filename] = info.file_size
+                if info.filename.startswith(_binary_part_dirs):
+                    dst.writestr(info.filename, b"")
+                    continue
+                with src.open(info) as reader, dst.open(info.filename, "w") as writer:
+                    shutil.copyfileobj(reader, writer)
+        tmp.seek(0)
+        prs = Presentation(tmp)
+    return prs, part_sizes
+
+#---------------------------------------------
+# 表紙（slide 0）のタイトルとして、最も大きいフォントのテキストを返す
+#---------------------------------------------
+def document_title(prs):
+    title = ""
+    if prs.slides:
+        first_slide = prs.slides[0]
+        max_font_size = 0
+        for shape in first_slide.shapes:
+            if not hasattr(shape, "text") or not shape.text.strip():
+                continue
+            # テキストがある shape を対象
+            try:
+                for paragraph in shape.text_frame.paragraphs:
+                    for run in paragraph.runs:
+                        font_size = run.font.size.pt if run.font.size else 0
+                        if font_size > max_font_size:
+                            max_font_size = font_size
+                            title = run.text.strip()
+            except AttributeError:
+                continue  # shape に text_frame がない場合もある
+    return title
+
+#---------------------------------------------
+# スライド1枚を解析して、辞書形式で返す
+# 画像のサイズはパートの元のサイズ (part_sizes) から取得する
+#---------------------------------------------
+def analyze_slide(slide, slide_width, slide_height, part_sizes):
+    slide_title = ""
+    for shape in slide.shapes:
+        if shape.is_placeholder and shape.placeholder_format.type == 1:
+            slide_title = shape.text.strip()
+            break
+
+    shapes = []
+    for shape in slide.shapes:
+        # pos = shape_position_dict(shape)
+
+        pos_pt = shape_position_dict(shape)
+        pos_ratio = normalize_position(shape, slide_width, slide_height)
+
+
+        # テキスト
+        if hasattr(shape, "text") and shape.text.strip():
+            shapes.append({
+                "type": "text",
+                "text": shape.text.strip(),
+                "position_pt": pos_pt,
+                "position_ratio": pos_ratio
+            })
+
+        # 画像（リンクだけの画像は除く）
+        elif shape.shape_type == 13 and shape._element.blip_rId is not None:
+            partname = slide.part.related_part(shape._element.blip_rId).partname
+            shapes.append({
+                "type": "image",
+                "image_format": pptxpackage.image_format(partname),
+                "filename": f"image.{partname.ext}",  # python-pptx の Image.filename と同じ
+                "image_bytes": part_sizes.get(partname, 0),
+                "position_pt": pos_pt,
+                "position_ratio": pos_ratio
+            })
+
+        # 表
+        elif shape.has_table:
+            table_data = []
+            table = shape.table
+            for row in table.rows:
+                table_data.append([cell.text.strip() for cell in row.cells])
+            shapes.append({
+                "type": "table",
+                "rows": table_data,
+                "position_pt": pos_pt,
+                "position_ratio": pos_ratio
+            })
+
+    # ノート
+    notes_text = ""
+    if slide.has_notes_slide and hasattr(slide.notes_slide, "notes_text_frame"):
+        frame = slide.notes_slide.notes_text_frame
+        if frame is not None:
+            notes_text = frame.text.strip()
+
+    return {
+        "slidetitle": slide_title,
+        "shapes": shapes,
+        "notes": notes_text
+    }
+
+#---------------------------------------------
+# pptx ファイルを1スライドずつ解析する
+# (表紙タイトル, スライドの辞書を1つずつ返すジェネレーター) を返す
+# 画像のバイナリは読み込まないので、大きな画像が多くてもメモリを使わない
+#---------------------------------------------
+def stream_pptx(filepath):
+    prs, part_sizes = open_presentation(filepath)
+    slide_width = prs.slide_width.pt
+    slide_height = prs.slide_height.pt
+
+    def slides():
+        for slide in prs.slides:
+            yield analyze_slide(slide, slide_width, slide_height, part_sizes)
+
+    return document_title(prs), slides()
+
+#---------------------------------------------
+# pptx ファイルを解析して、スライドの情報を取得する
+# 解析結果を辞書形式で返す
+#---------------------------------------------
+def analyze_pptx(filepath):
+    title, slides = stream_pptx(filepath)
+    return {
+        "DocumentTitle": title,
+        "slides": list(slides)
+    }
+
+#---------------------------------------------
+# 解析結果を1スライドずつファイルに書き出す
+#   json  : analyze_pptx() と同じ形式（{"DocumentTitle": ..., "slides": [...]}）
+#   ndjson: 1行目が {"DocumentTitle": ...}、2行目以降が1行1スライド
+# 書き出したスライドをそのまま返すジェネレーター（使わない場合は最後まで回すこと）
+#---------------------------------------------
+def write_slides(title, slides, outpath, format="json"):
+    with open(outpath, "w", encoding="utf-8") as f:
+        if format == "ndjson":
+            f.write(json.dumps({"DocumentTitle": title}, ensure_ascii=False) + "\n")
+            for slide in slides:
+                f.write(json.dumps(slide, ensure_ascii=False) + "\n")
+                yield slide
+            return
+
+        f.write('{"DocumentTitle": ' + json.dumps(title, ensure_ascii=False) + ', "slides": [')
+        for index, slide in enumerate(slides):
+            if index:
+                f.write(",")
+            f.write("\n" + json.dumps(slide, ensure_ascii=False))
+            yield slide
+        f.write("\n]}\n")
+
+#---------------------------------------------
+# pptx ファイルを解析して、1スライドずつファイルに書き出す
+# メモリに持つのは解析中のスライドだけ
+#---------------------------------------------
+def export_pptx(filepath, outpath, format="json"):
+    title, slides = stream_pptx(filepath)
+    for _ in write_slides(title, slides, outpath, format):
+        pass
+
+#---------------------------------------------
+# analyze_pptx() の各 shape の座標値を相対比率だけにして
+# calcslidesimilarity で比較できる形式にする
+#---------------------------------------------
+def flatten_positions(analyzed):
+    for slide in analyzed["slides"]:
+        for shape in slide["shapes"]:
+            position_ratio_to_upstair(shape)
+    return analyzed
+
+#---------------------------------------------
+# analyze_pptx() のスライドのテキストを結合して返す
+#---------------------------------------------
+def slide_text(slide):
+    return "".join(shape["text"] + " " for shape in slide["shapes"] if shape["type"] == "text")
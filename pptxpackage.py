@@ -0,0 +1,73 @@
+import posixpath
+import xml.etree.ElementTree as ET
+
+#--------------------------------------------
+# pptx (zip) パッケージのパーツを直接読むための共通処理
+#--------------------------------------------
+
+# 名前空間
+ns = {
+    "p": "http://schemas.openxmlformats.org/presentationml/2006/main",
+    "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    "rel": "http://schemas.openxmlformats.org/package/2006/relationships",
+}
+
+presentation_partname = "ppt/presentation.xml"
+
+
+# パーツ名に対応する .rels のパーツ名を返す
+# 例: ppt/slides/slide1.xml → ppt/slides/_rels/slide1.xml.rels
+def rels_partname(partname):
+    directory, filename = posixpath.split(partname)
+    return posixpath.join(directory, "_rels", filename + ".rels")
+
+
+# パーツのリレーションを {rId: (参照先パーツ名, 種類)} の辞書で返す
+# 外部リンク（TargetMode="External"）は含めない
+def read_rels(zf, partname):
+    relsname = rels_partname(partname)
+    if relsname not in zf.NameToInfo:
+        return {}
+
+    rels = {}
+    directory = posixpath.dirname(partname)
+    root = ET.fromstring(zf.read(relsname))
+    for rel in root.findall("rel:Relationship", ns):
+        if rel.get("TargetMode") == "External":
+            continue
+        target = rel.get("Target")
+        if target.startswith("/"):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join(directory, target))
+        reltype = rel.get("Type").rsplit("/", 1)[-1]
+        rels[rel.get("Id")] = (target, reltype)
+    return rels
+
+
+# スライドのパーツ名をプレゼンテーション内の順序で返す
+def slide_partnames(zf):
+    rels = read_rels(zf, presentation_partname)
+    root = ET.fromstring(zf.read(presentation_partname))
+    partnames = []
+    for sldid in root.findall("p:sldIdLst/p:sldId", ns):
+        rid = sldid.get(f"{{{ns['r']}}}id")
+        partnames.append(rels[rid][0])
+    return partnames
+
+
+# パーツが直接参照しているパーツ名のリストを返す（zip 内に存在するもののみ）
+def related_partnames(zf, partname):
+    return [target for target, _ in read_rels(zf, partname).values() if target in zf.NameToInfo]
+
+
+# python-pptx の Image.ext と同じ表記にする
+_image_ext_aliases = {"jpeg": "jpg", "jpe": "jpg", "tif": "tiff"}
+
+
+# 画像パーツ名から画像の形式（拡張子）を返す
+# 例: ppt/media/image1.jpeg → jpg
+def image_format(partname):
+    ext = posixpath.splitext(partname)[1][1:].lower()
+    return _image_ext_aliases.get(ext, ext)
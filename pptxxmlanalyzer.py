@@ -0,0 +1,404 @@
+import os
+import posixpath
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from lxml import etree
+
+import pptxpackage
+
+#---------------------------------------------
+# python-pptx を使わずに、pptx (zip) のスライドの XML を直接読んで解析する
+# （pptxanalyzer.analyze_pptx() と同じ形式の結果を返す）
+#
+# python-pptx はすべての要素のプロキシオブジェクトを作るので大きなファイルでは遅い。
+# ここでは ppt/slides/slideN.xml を lxml の iterparse で読み、
+# spTree 直下の shape を読み終えるたびに処理して捨てる。
+# スライドのパーツは互いに独立なので、プロセスプールで並列に解析できる
+#
+# python-pptx と同じ結果にするための注意
+#   ・グループ内の shape は対象にしない（slide.shapes はグループの中を列挙しない）
+#   ・プレースホルダーの位置が省略されている場合は、レイアウト、マスターの
+#     プレースホルダーの位置を引き継ぐ
+#---------------------------------------------
+
+# スライドがこの枚数未満なら並列にしない（プロセス起動のコストの方が大きい）
+min_parallel_slides = 200
+
+# 並列解析のワーカープロセス数のデフォルト
+default_workers = os.cpu_count() or 1
+
+_p = pptxpackage.ns["p"]
+_a = pptxpackage.ns["a"]
+
+# slide.shapes が列挙する shape の要素
+_shape_tags = [f"{{{_p}}}{tag}" for tag in ("sp", "grpSp", "graphicFrame", "cxnSp", "pic", "contentPart")]
+_sptree_tag = f"{{{_p}}}spTree"
+_table_uri = "http://schemas.openxmlformats.org/drawingml/2006/table"
+
+# 1pt = 12700 EMU
+_emu_per_pt = 12700.0
+
+# レイアウトのプレースホルダーが位置を引き継ぐマスターのプレースホルダーの種類
+_master_placeholder_types = {
+    "ctrTitle": "title",
+    "title": "title",
+    "dt": "dt",
+    "ftr": "ftr",
+    "sldNum": "sldNum",
+}
+
+
+#---------------------------------------------
+# 要素の XPath 評価（名前空間つき）
+#---------------------------------------------
+def _xpath(element, path):
+    return element.xpath(path, namespaces=pptxpackage.ns)
+
+
+#---------------------------------------------
+# 段落のテキスト（python-pptx の _Paragraph.text と同じ。改行 a:br は "\v"）
+#---------------------------------------------
+def _paragraph_text(paragraph):
+    texts = []
+    for child in paragraph:
+        if child.tag == f"{{{_a}}}br":
+            texts.append("\v")
+        elif child.tag in (f"{{{_a}}}r", f"{{{_a}}}fld"):
+            t = child.find(f"{{{_a}}}t")
+            if t is not None and t.text:
+                texts.append(t.text)
+    return "".join(texts)
+
+
+#---------------------------------------------
+# txBody のテキスト（python-pptx の TextFrame.text と同じ。段落は "\n" で結合）
+#---------------------------------------------
+def _body_text(body):
+    if body is None:
+        return ""
+    return "\n".join(_paragraph_text(paragraph) for paragraph in body.iterfind(f"{{{_a}}}p"))
+
+
+#---------------------------------------------
+# shape のプレースホルダー要素 (p:ph)。プレースホルダーでなければ None
+#---------------------------------------------
+def _placeholder(shape):
+    found = _xpath(shape, "./*[1]/p:nvPr/p:ph")
+    return found[0] if found else None
+
+
+def _placeholder_type(ph):
+    return ph.get("type", "obj")
+
+
+def _placeholder_idx(ph):
+    return int(ph.get("idx", "0"))
+
+
+#---------------------------------------------
+# shape の xfrm の (left, top, width, height)（EMU）。省略されている値は None
+#---------------------------------------------
+def _shape_xfrm(shape):
+    if shape.tag == f"{{{_p}}}graphicFrame":
+        xfrm = shape.find(f"{{{_p}}}xfrm")
+    else:
+        xfrm = _xpath(shape, "./p:spPr/a:xfrm|./p:grpSpPr/a:xfrm")
+        xfrm = xfrm[0] if xfrm else None
+    if xfrm is None:
+        return (None, None, None, None)
+
+    off = xfrm.find(f"{{{_a}}}off")
+    ext = xfrm.find(f"{{{_a}}}ext")
+    return (
+        int(off.get("x")) if off is not None else None,
+        int(off.get("y")) if off is not None else None,
+        int(ext.get("cx")) if ext is not None else None,
+        int(ext.get("cy")) if ext is not None else None,
+    )
+
+
+#---------------------------------------------
+# レイアウトやマスターのプレースホルダーの一覧を [(種類, idx, xfrm), ...] で返す
+#---------------------------------------------
+def _read_placeholders(zf, partname):
+    placeholders = []
+    if partname is None or partname not in zf.NameToInfo:
+        return placeholders
+    root = etree.fromstring(zf.read(partname))
+    for shape in _xpath(root, "./p:cSld/p:spTree/*"):
+        ph = _placeholder(shape)
+        if ph is not None:
+            placeholders.append((_placeholder_type(ph), _placeholder_idx(ph), _shape_xfrm(shape)))
+    return placeholders
+
+
+#---------------------------------------------
+# リレーションから種類が reltype の最初のパーツ名を返す
+#---------------------------------------------
+def _related(rels, reltype):
+    for target, kind in rels.values():
+        if kind == reltype:
+            return target
+    return None
+
+
+#---------------------------------------------
+# pptx ファイルを開いて、スライドの解析に必要な情報を持つ
+# レイアウトとマスターのプレースホルダーは一度読んだら覚えておく
+#---------------------------------------------
+class _Package:
+    def __init__(self, filepath):
+        self.zf = zipfile.ZipFile(filepath)
+        root = etree.fromstring(self.zf.read(pptxpackage.presentation_partname))
+        size = _xpath(root, "./p:sldSz")[0]
+        self.slide_width = int(size.get("cx")) / _emu_per_pt
+        self.slide_height = int(size.get("cy")) / _emu_per_pt
+        self._layouts = {}
+
+    def close(self):
+        self.zf.close()
+
+    # レイアウトのパーツ名から (レイアウトのプレースホルダー, マスターのプレースホルダー) を返す
+    def layout_placeholders(self, layoutname):
+        if layoutname not in self._layouts:
+            mastername = _related(pptxpackage.read_rels(self.zf, layoutname), "slideMaster") if layoutname else None
+            self._layouts[layoutname] = (_read_placeholders(self.zf, layoutname), _read_placeholders(self.zf, mastername))
+        return self._layouts[layoutname]
+
+
+#---------------------------------------------
+# プレースホルダーの位置をレイアウト、マスターから引き継ぐ（値ごとに省略されていれば引き継ぐ）
+# python-pptx の _BaseSlidePlaceholder._effective_value と同じ
+#---------------------------------------------
+def _effective_xfrm(xfrm, ph, layout, master):
+    if ph is None or None not in xfrm:
+        return xfrm
+
+    idx = _placeholder_idx(ph)
+    layout_ph = next(((kind, value) for kind, i, value in layout if i == idx), None)
+    if layout_ph is None:
+        return xfrm
+    layout_type, layout_xfrm = layout_ph
+
+    master_type = _master_placeholder_types.get(layout_type, "body")
+    master_xfrm = next((value for kind, _, value in master if kind == master_type), (None, None, None, None))
+
+    return tuple(
+        value if value is not None else (inherited if inherited is not None else base)
+        for value, inherited, base in zip(xfrm, layout_xfrm, master_xfrm)
+    )
+
+
+#---------------------------------------------
+# 位置 (EMU) を pt と、スライドの大きさとの相対比率に変換する
+#---------------------------------------------
+def _positions(xfrm, slide_width, slide_height):
+    left, top, width, height = (value / _emu_per_pt if value is not None else 0.0 for value in xfrm)
+    position_pt = {"left": left, "top": top, "width": width, "height": height}
+    position_ratio = {
+        "left": round(left / slide_width, 4),
+        "top": round(top / slide_height, 4),
+        "width": round(width / slide_width, 4),
+        "height": round(height / slide_height, 4),
+    }
+    return position_pt, position_ratio
+
+
+#---------------------------------------------
+# spTree 直下の shape 1つを解析して、shape の辞書を返す（対象外の shape は None）
+#---------------------------------------------
+def _analyze_shape(shape, package, rels, layout, master):
+    tag = etree.QName(shape).localname
+    ph = _placeholder(shape)
+
+    def positions():
+        xfrm = _effective_xfrm(_shape_xfrm(shape), ph, layout, master)
+        return _positions(xfrm, package.slide_width, package.slide_height)
+
+    # テキスト
+    if tag == "sp":
+        text = _body_text(shape.find(f"{{{_p}}}txBody")).strip()
+        if not text:
+            return None
+        pos_pt, pos_ratio = positions()
+        return {
+            "type": "text",
+            "text": text,
+            "position_pt": pos_pt,
+            "position_ratio": pos_ratio
+        }
+
+    # 画像（プレースホルダー、動画、リンクだけの画像は除く）
+    if tag == "pic":
+        if ph is not None or _xpath(shape, "./p:nvPicPr/p:nvPr/a:videoFile"):
+            return None
+        rid = _xpath(shape, "./p:blipFill/a:blip/@r:embed")
+        if not rid or rid[0] not in rels:
+            return None
+        partname = rels[rid[0]][0]
+        info = package.zf.NameToInfo.get(partname)
+        pos_pt, pos_ratio = positions()
+        return {
+            "type": "image",
+            "image_format": pptxpackage.image_format(partname),
+            "filename": "image" + posixpath.splitext(partname)[1],  # python-pptx の Image.filename と同じ
+            "image_bytes": info.file_size if info is not None else 0,
+            "position_pt": pos_pt,
+            "position_ratio": pos_ratio
+        }
+
+    # 表
+    if tag == "graphicFrame":
+        table = _xpath(shape, f"./a:graphic/a:graphicData[@uri='{_table_uri}']/a:tbl")
+        if not table:
+            return None
+        rows = [[_body_text(cell.find(f"{{{_a}}}txBody")).strip() for cell in _xpath(row, "./a:tc")]
+                for row in _xpath(table[0], "./a:tr")]
+        pos_pt, pos_ratio = positions()
+        return {
+            "type": "table",
+            "rows": rows,
+            "position_pt": pos_pt,
+            "position_ratio": pos_ratio
+        }
+
+    return None
+
+
+#---------------------------------------------
+# ノートのテキスト（ノートの本文プレースホルダーのテキスト）
+#---------------------------------------------
+def _notes_text(zf, notesname):
+    if notesname is None or notesname not in zf.NameToInfo:
+        return ""
+    root = etree.fromstring(zf.read(notesname))
+    for shape in _xpath(root, "./p:cSld/p:spTree/*"):
+        ph = _placeholder(shape)
+        if ph is not None and _placeholder_type(ph) == "body":
+            return _body_text(shape.find(f"{{{_p}}}txBody")).strip()
+    return ""
+
+
+#---------------------------------------------
+# スライドのパーツを1つ解析して、スライドの辞書を返す
+# with_runs が True なら、表紙タイトルの判定用に (フォントサイズ, テキスト) の一覧も返す
+#---------------------------------------------
+def analyze_slide_part(package, partname, with_runs=False):
+    rels = pptxpackage.read_rels(package.zf, partname)
+    layout, master = package.layout_placeholders(_related(rels, "slideLayout"))
+
+    slide_title = None
+    shapes = []
+    runs = []
+    with package.zf.open(partname) as f:
+        for _, shape in etree.iterparse(f, events=("end",), tag=_shape_tags):
+            parent = shape.getparent()
+            if parent is None or parent.tag != _sptree_tag:
+                continue
+
+            ph = _placeholder(shape)
+            if slide_title is None and ph is not None and _placeholder_type(ph) == "title":
+                slide_title = _body_text(shape.find(f"{{{_p}}}txBody")).strip()
+
+            if with_runs and shape.tag == f"{{{_p}}}sp" and _body_text(shape.find(f"{{{_p}}}txBody")).strip():
+                for run in _xpath(shape, "./p:txBody/a:p/a:r"):
+                    size = _xpath(run, "./a:rPr/@sz")
+                    t = run.find(f"{{{_a}}}t")
+                    runs.append((int(size[0]) / 100 if size else 0, t.text if t is not None and t.text else ""))
+
+            record = _analyze_shape(shape, package, rels, layout, master)
+            if record is not None:
+                shapes.append(record)
+
+            # 読み終えた shape は捨てる
+            shape.clear()
+            while shape.getprevious() is not None:
+                del parent[0]
+
+    slide = {
+        "slidetitle": slide_title or "",
+        "shapes": shapes,
+        "notes": _notes_text(package.zf, _related(rels, "notesSlide"))
+    }
+    if with_runs:
+        return slide, runs
+    return slide
+
+
+#---------------------------------------------
+# 表紙（slide 0）のタイトルとして、最も大きいフォントのテキストを返す
+#---------------------------------------------
+def _document_title(runs):
+    title = ""
+    max_font_size = 0
+    for font_size, text in runs:
+        if font_size > max_font_size:
+            max_font_size = font_size
+            title = text.strip()
+    return title
+
+
+# ワーカープロセス内で開いている pptx ファイル
+_worker_package = None
+
+
+def _init_worker(filepath):
+    global _worker_package
+    _worker_package = _Package(filepath)
+
+
+def _analyze_in_worker(partname):
+    return analyze_slide_part(_worker_package, partname)
+
+
+#---------------------------------------------
+# pptx ファイルを1スライドずつ解析する
+# (表紙タイトル, スライドの辞書を1つずつ返すジェネレーター) を返す
+# workers が 2 以上で、スライドが min_parallel_slides 枚以上なら、2枚目以降をプロセスプールで並列に解析する
+#---------------------------------------------
+def stream_pptx(filepath, workers=default_workers):
+    package = _Package(filepath)
+    partnames = pptxpackage.slide_partnames(package.zf)
+    if not partnames:
+        package.close()
+        return "", iter(())
+
+    first, runs = analyze_slide_part(package, partnames[0], with_runs=True)
+
+    def slides():
+        try:
+            yield first
+            rest = partnames[1:]
+            if workers <= 1 or len(partnames) < min_parallel_slides:
+                for partname in rest:
+                    yield analyze_slide_part(package, partname)
+                return
+
+            chunksize = max(1, len(rest) // (workers * 4))
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(filepath,)) as executor:
+                yield from executor.map(_analyze_in_worker, rest, chunksize=chunksize)
+        finally:
+            package.close()
+
+    return _document_title(runs), slides()
+
+
+#---------------------------------------------
+# pptx ファイルを解析して、スライドの情報を取得する
+# 解析結果を辞書形式で返す（pptxanalyzer.analyze_pptx() と同じ形式）
+#---------------------------------------------
+def analyze_pptx(filepath, workers=default_workers):
+    title, slides = stream_pptx(filepath, workers)
+    return {
+        "DocumentTitle": title,
+        "slides": list(slides)
+    }
+
+
+#---------------------------------------------
+# analyze_pptx() の shape の位置を EMU の (left, top, width, height) で返す
+#---------------------------------------------
+def position_emu(shape):
+    position = shape["position_pt"]
+    return tuple(round(position[key] * _emu_per_pt) for key in ("left", "top", "width", "height"))
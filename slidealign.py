@@ -0,0 +1,181 @@
+import numpy as np
+
+#--------------------------------------------
+# スライドの並びの対応付け（差分ツールのような順序を考慮したアライメント）
+#
+# 新しい版のスライドは、元の版の順序をほぼ保ったまま途中に追加・削除されることが多い。
+# そこで全ペアを比較せず、対角線の周りの帯（band）の中のペアだけを比較して、
+# Needleman-Wunsch（重み付き最長共通部分列）で順序を保った対応を求める。
+# 帯の中で対応が付かなかったスライドだけを全探索して、移動したスライドを探す
+#
+# 結果の分類
+#   unchanged: 順序どおりに対応し、ほぼ一致
+#   modified : 順序どおりに対応したが、変更あり
+#   moved    : 順序どおりではないが、似たスライドがある（移動）
+#   added    : 対応するスライドがない（新しい版で追加）
+#   removed  : 元の版のスライドで、対応するスライドがない（削除）
+#--------------------------------------------
+
+# 帯の幅のデフォルト（対角線から前後何枚までを比較するか）
+default_band = 10
+
+statuses = ("unchanged", "modified", "moved", "added", "removed")
+
+
+# 各 derived スライド i について、比較する base スライドの範囲 lo[i]～hi[i] を返す
+# 帯の中心は、スライド数の比で引いた対角線
+def band_limits(n, m, band=default_band):
+    if n == 0 or m == 0:
+        return np.zeros(n, dtype=np.int64), np.full(n, -1, dtype=np.int64)
+    center = np.arange(n) * ((m - 1) / (n - 1)) if n > 1 else np.zeros(1)
+    lo = np.maximum(0, np.floor(center).astype(np.int64) - band)
+    hi = np.minimum(m - 1, np.ceil(center).astype(np.int64) + band)
+    return lo, hi
+
+
+# 帯の中のペアを (rows, cols) の配列で返す
+def band_pairs(n, m, band=default_band):
+    lo, hi = band_limits(n, m, band)
+    widths = np.maximum(hi - lo + 1, 0)
+    rows = np.repeat(np.arange(n), widths)
+    cols = lo[rows] + (np.arange(len(rows)) - np.repeat(np.cumsum(widths) - widths, widths))
+    return rows, cols
+
+
+# 帯の中のペアの重み（正の値だけが対応付けの対象）から、順序を保った対応 [(i, j), ...] を返す
+# 重みの合計が最大になる対応を求める（ギャップのコストは 0）
+# D(i, j) は derived[:i+1] と base[:j+1] の最大の重み。帯の外の値は帯の端の値と同じになるので、
+# 帯の中だけを保持する
+def align(n, m, rows, cols, weights, band=default_band):
+    lo, hi = band_limits(n, m, band)
+    if n == 0 or m == 0:
+        return []
+    width = int((hi - lo).max()) + 1
+
+    weight = np.full((n, width), -np.inf)
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float64)
+    positive = weights > 0
+    weight[rows[positive], cols[positive] - lo[rows[positive]]] = weights[positive]
+
+    table = np.zeros((n, width))
+    take = np.zeros((n, width), dtype=bool)
+    # column[j] は直前の行の D(i-1, j)（帯より左は確定した値）
+    column = np.zeros(m)
+    previous_hi = -1
+    for i in range(n):
+        l, h = int(lo[i]), int(hi[i])
+        w = h - l + 1
+        if previous_hi >= 0 and h > previous_hi:
+            column[previous_hi + 1:h + 1] = column[previous_hi]
+        up = column[l:h + 1]
+        diagonal = np.concatenate(([column[l - 1]] if l > 0 else [0.0], column[l:h]))
+        matched = diagonal + weight[i, :w]
+        left = column[l - 1] if l > 0 else 0.0
+        current = np.maximum.accumulate(np.concatenate(([left], np.maximum(up, matched))))[1:]
+        table[i, :w] = current
+        take[i, :w] = np.isfinite(weight[i, :w]) & (matched >= current)
+        column[l:h + 1] = current
+        previous_hi = h
+
+    # D(r, j) を返す
+    def value(r, j):
+        while r >= 0 and j >= 0:
+            if j > hi[r]:
+                j = hi[r]
+            elif j < lo[r]:
+                r -= 1
+            else:
+                return table[r, j - lo[r]]
+        return 0.0
+
+    pairs = []
+    i, j = n - 1, m - 1
+    while i >= 0 and j >= 0:
+        if j > hi[i]:
+            j = int(hi[i])
+            continue
+        if j < lo[i]:
+            i -= 1
+            continue
+        k = j - lo[i]
+        if take[i, k]:
+            pairs.append((i, j))
+            i -= 1
+            j -= 1
+        elif table[i, k] == value(i - 1, j):
+            i -= 1
+        else:
+            j -= 1
+    pairs.reverse()
+    return pairs
+
+
+# 重みの大きい順に、まだ使っていないスライド同士を対応させる [(i, j), ...]
+def greedy_pairs(rows, cols, weights):
+    order = np.argsort(-np.asarray(weights, dtype=np.float64), kind="stable")
+    used_rows = set()
+    used_cols = set()
+    pairs = []
+    for k in order:
+        i, j = int(rows[k]), int(cols[k])
+        if weights[k] <= 0 or i in used_rows or j in used_cols:
+            continue
+        used_rows.add(i)
+        used_cols.add(j)
+        pairs.append((i, j))
+    return sorted(pairs)
+
+
+# derived n 枚と base m 枚のスライドを対応付ける
+# score(rows, cols) はペアの重みの配列を返す関数（正の値のペアだけが対応付けの対象）
+# 帯の中のペアと、帯の中で対応が付かなかったスライド同士のペアだけを score に渡す
+# 戻り値は {"aligned": [(i, j)], "moved": [(i, j)], "added": [i], "removed": [j], "scored": 比較したペア数}
+def align_slides(n, m, score, band=default_band):
+    rows, cols = band_pairs(n, m, band)
+    weights = score(rows, cols) if len(rows) else np.zeros(0)
+    aligned = align(n, m, rows, cols, weights, band)
+    scored = len(rows)
+
+    # 対応が付かなかったスライド同士を全探索する
+    # 帯の中のペアは比較済みの重みを使い、帯の外のペアだけを新たに比較する
+    aligned_rows = {i for i, _ in aligned}
+    aligned_cols = {j for _, j in aligned}
+    rest_rows = np.array([i for i in range(n) if i not in aligned_rows], dtype=np.int64)
+    rest_cols = np.array([j for j in range(m) if j not in aligned_cols], dtype=np.int64)
+    moved = []
+    if len(rest_rows) and len(rest_cols):
+        lo, hi = band_limits(n, m, band)
+        fallback_rows = np.repeat(rest_rows, len(rest_cols))
+        fallback_cols = np.tile(rest_cols, len(rest_rows))
+        fallback_weights = np.zeros(len(fallback_rows))
+        inside = (fallback_cols >= lo[fallback_rows]) & (fallback_cols <= hi[fallback_rows])
+        if inside.any():
+            band_weights = {(int(i), int(j)): w for i, j, w in zip(rows, cols, weights)}
+            fallback_weights[inside] = [band_weights[(int(i), int(j))] for i, j in zip(fallback_rows[inside], fallback_cols[inside])]
+        if (~inside).any():
+            fallback_weights[~inside] = score(fallback_rows[~inside], fallback_cols[~inside])
+            scored += int((~inside).sum())
+        moved = greedy_pairs(fallback_rows, fallback_cols, fallback_weights)
+
+    moved_rows = {i for i, _ in moved}
+    moved_cols = {j for _, j in moved}
+    return {
+        "aligned": aligned,
+        "moved": moved,
+        "added": [i for i in range(n) if i not in aligned_rows and i not in moved_rows],
+        "removed": [j for j in range(m) if j not in aligned_cols and j not in moved_cols],
+        "scored": scored,
+    }
+
+
+# align_slides() の結果から、derived スライドごとの (分類, 対応する base スライド番号 or None) のリストを返す
+# unchanged(i, j) は順序どおりに対応したペアが変更なしなら True を返す関数
+def classify(n, alignment, unchanged):
+    result = [("added", None)] * n
+    for i, j in alignment["aligned"]:
+        result[i] = ("unchanged" if unchanged(i, j) else "modified", j)
+    for i, j in alignment["moved"]:
+        result[i] = ("moved", j)
+    return result
@@ -0,0 +1,202 @@
+import numpy as np
+
+#--------------------------------------------
+# derived × base のスライド類似度を行列で一括計算する比較エンジン
+#--------------------------------------------
+
+# 類似度の等級（判定の優先順）
+grades = ("match", "high", "low")
+
+# 等級に該当しない場合
+grade_different = "different"
+
+# スライド構成の類似度（calcslidesimilarity.slide_similarity()）だけで判定できる等級
+# 構成の類似度はシェイプの配置が同じなら高くなるので、それだけでは match にしない
+# 閾値は1つなので、high に上げるだけにする（low は np.select で high が先に選ばれて使われないため）
+structure_grades = ("high",)
+
+# 1バイト(0～255)ごとの立っているビット数の表（np.bitwise_count がない numpy 用）
+_popcount_table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+# ImageHash (8x8 = 64bit) を uint64 の整数にパックする
+def pack_imagehash(imagehash):
+    bits = np.asarray(imagehash.hash, dtype=bool).flatten()
+    if bits.size != 64:
+        raise ValueError(f"64bit のハッシュのみ対応しています: {bits.size}bit")
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+# pack_imagehash() でパックした整数を ImageHash に戻す
+def unpack_imagehash(value):
+    import imagehash
+    packed = np.frombuffer(int(value).to_bytes(8, "big"), dtype=np.uint8)
+    return imagehash.ImageHash(np.unpackbits(packed).astype(bool).reshape(8, 8))
+
+
+# ImageHash のリストを uint64 の配列にパックする
+def pack_imagehashes(imagehashes):
+    return np.array([pack_imagehash(h) for h in imagehashes], dtype=np.uint64)
+
+
+# uint64 配列の各要素の立っているビット数を返す
+def popcount(values):
+    values = np.asarray(values, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values).astype(np.int64)
+    bytes_view = values.reshape(values.shape + (1,)).view(np.uint8)
+    return _popcount_table[bytes_view].sum(axis=-1, dtype=np.int64)
+
+
+# パック済みハッシュ同士のハミング距離行列 (len(a), len(b)) を返す
+# 値は ImageHash 同士の引き算 (abs(h1 - h2)) と同じ
+def hamming_matrix(hashes_a, hashes_b):
+    hashes_a = np.asarray(hashes_a, dtype=np.uint64)
+    hashes_b = np.asarray(hashes_b, dtype=np.uint64)
+    return popcount(hashes_a[:, None] ^ hashes_b[None, :])
+
+
+# 行ベクトルを長さ1に正規化する（長さ0の行は0のまま）
+# dtype は計算する型（テキストベクトルは float32）
+def normalize_rows(vectors, dtype=np.float32):
+    vectors = np.asarray(vectors, dtype=dtype)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    return vectors / norms
+
+
+# テキストベクトル同士のコサイン類似度行列 (len(a), len(b)) を返す
+# 正規化した行列同士の積1回で計算する
+def cosine_matrix(vectors_a, vectors_b):
+    return normalize_rows(vectors_a) @ normalize_rows(vectors_b).T
+
+
+# ハミング距離とコサイン類似度から等級の番号を決める
+# 戻り値の各要素は grades の添字、どの等級にも該当しない場合は -1
+# hash_thresholds は (match, high, low) のハミング距離の閾値
+# text_thresholds は (match, high, low) の 0～1.0 のコサイン類似度の閾値
+# hash_diff が None の場合は類似度だけで判定する
+# structure（スライド構成の類似度）を指定した場合は、テキストの閾値とは別に structure_threshold と比べ、
+# 以上なら high に上げる（structure_grades）。構成の類似度は low の判定には使わない
+def grade_matrix(hash_diff, similarity, hash_thresholds, text_thresholds, structure=None, structure_threshold=None):
+    conditions = []
+    for grade, hash_threshold, text_threshold in zip(grades, hash_thresholds, text_thresholds):
+        condition = similarity >= text_threshold
+        if hash_diff is not None:
+            condition = (hash_diff <= hash_threshold) | condition
+        if structure is not None and grade in structure_grades:
+            condition = condition | (structure >= structure_threshold)
+        conditions.append(condition)
+    return np.select(conditions, list(range(len(grades))), default=-1)
+
+
+# 一度に比較する行列の要素数の上限（derived スライドをこの大きさのブロックに分けて比較する）
+block_elements = 4 * 1024 * 1024
+
+
+# derived と base の全スライドペアを比較して、いずれかの等級に該当するペアのリストを返す
+# 要素は (di, bi, grade, hash_diff, vector_similarity, structure_similarity) で、di, bi の昇順に並ぶ
+# ハッシュを使わない場合は derived_hashes, base_hashes に None を渡す（hash_diff は None になる）
+# structure はスライド構成の類似度行列 (0～1.0)。指定した場合は structure_threshold 以上のペアも
+# high の等級にする（grade_matrix() を参照。指定しない場合 structure_similarity は None になる）
+def compare_slides(derived_hashes, derived_vectors, base_hashes, base_vectors, hash_thresholds, text_thresholds, structure=None, structure_threshold=None):
+    use_hash = derived_hashes is not None and base_hashes is not None
+    derived_normalized = normalize_rows(derived_vectors)
+    base_normalized = normalize_rows(base_vectors)
+    block_rows = max(1, block_elements // max(1, len(base_normalized)))
+
+    pairs = []
+    for start in range(0, len(derived_normalized), block_rows):
+        stop = min(start + block_rows, len(derived_normalized))
+        hash_diff = None
+        if use_hash:
+            hash_diff = hamming_matrix(derived_hashes[start:stop], base_hashes)
+        similarity = derived_normalized[start:stop] @ base_normalized.T
+        block_structure = None if structure is None else np.asarray(structure)[start:stop]
+        graded = grade_matrix(hash_diff, similarity, hash_thresholds, text_thresholds, block_structure, structure_threshold)
+
+        for di, bi in zip(*np.nonzero(graded >= 0)):
+            pairs.append((
+                int(start + di),
+                int(bi),
+                grades[graded[di, bi]],
+                None if hash_diff is None else int(hash_diff[di, bi]),
+                similarity[di, bi],
+                None if block_structure is None else float(block_structure[di, bi]),
+            ))
+    return pairs
+
+
+# compare_slides() の結果から、derived スライドごとに類似度の高い順に top_k 件を選ぶ
+# 等級が高い順、同じ等級ならハミング距離が小さい順、テキストの類似度が高い順
+def select_top_pairs(pairs, top_k):
+    by_derived = {}
+    for pair in pairs:
+        by_derived.setdefault(pair[0], []).append(pair)
+
+    selected = []
+    for di in sorted(by_derived):
+        ranked = sorted(by_derived[di], key=lambda pair: (grades.index(pair[2]), pair[3] if pair[3] is not None else 0, -float(pair[4])))
+        selected.extend(ranked[:top_k])
+    return selected
+
+
+# 候補の base スライドだけを比較して、compare_slides() と同じ形式のリストを返す
+# candidates は derived スライドごとの base スライド番号の配列（昇順）のリスト
+def compare_candidates(derived_hashes, derived_vectors, base_hashes, base_vectors, candidates, hash_thresholds, text_thresholds):
+    use_hash = derived_hashes is not None and base_hashes is not None
+    derived_normalized = normalize_rows(derived_vectors)
+    base_normalized = normalize_rows(base_vectors)
+
+    pairs = []
+    for di, ids in enumerate(candidates):
+        ids = np.asarray(ids, dtype=np.int64)
+        if ids.size == 0:
+            continue
+        hash_diff = None
+        if use_hash:
+            hash_diff = popcount(np.uint64(derived_hashes[di]) ^ np.asarray(base_hashes, dtype=np.uint64)[ids])
+        similarity = base_normalized[ids] @ derived_normalized[di]
+        graded = grade_matrix(hash_diff, similarity, hash_thresholds, text_thresholds)
+        for k in np.nonzero(graded >= 0)[0]:
+            pairs.append((
+                di,
+                int(ids[k]),
+                grades[graded[k]],
+                None if hash_diff is None else int(hash_diff[k]),
+                similarity[k],
+                None,
+            ))
+    return pairs
+
+
+# 指定したペア (rows[k], cols[k]) だけを比較して、compare_slides() と同じ形式のリストを返す
+# structure は各ペアのスライド構成の類似度の配列 (0～1.0)。判定は compare_slides() と同じ
+def compare_pairs(derived_hashes, derived_vectors, base_hashes, base_vectors, rows, cols, hash_thresholds, text_thresholds, structure=None, structure_threshold=None):
+    use_hash = derived_hashes is not None and base_hashes is not None
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    if rows.size == 0:
+        return []
+    derived_normalized = normalize_rows(derived_vectors)
+    base_normalized = normalize_rows(base_vectors)
+
+    hash_diff = None
+    if use_hash:
+        hash_diff = popcount(np.asarray(derived_hashes, dtype=np.uint64)[rows] ^ np.asarray(base_hashes, dtype=np.uint64)[cols])
+    similarity = np.einsum("ij,ij->i", derived_normalized[rows], base_normalized[cols])
+    if structure is not None:
+        structure = np.asarray(structure, dtype=np.float32)
+    graded = grade_matrix(hash_diff, similarity, hash_thresholds, text_thresholds, structure, structure_threshold)
+
+    pairs = []
+    for k in np.nonzero(graded >= 0)[0]:
+        pairs.append((
+            int(rows[k]),
+            int(cols[k]),
+            grades[graded[k]],
+            None if hash_diff is None else int(hash_diff[k]),
+            similarity[k],
+            None if structure is None else float(structure[k]),
+        ))
+    return pairs
@@ -0,0 +1,108 @@
+import os
+
+import numpy as np
+
+import embeddingstore
+import instrument
+
+#--------------------------------------------
+# テキストのベクトル化（文埋め込み）の共通処理
+#--------------------------------------------
+
+# 使用する SentenceTransformer のモデル名
+model_name = 'all-MiniLM-L6-v2'
+
+# all-MiniLM-L6-v2 の出力次元数
+embedding_dim = 384
+
+# 1回の encode 呼び出しでまとめて処理するテキスト数
+default_batch_size = 64
+
+# ロード済みのモデル（get_model() で初期化）
+_model = None
+
+# ベクトル化の前に調べる永続ストア（embeddingstore.EmbeddingStore）
+# use_store() で指定する。指定しない場合は環境変数 store_env のパスを使う
+store_env = "COMPARE_PPTX_EMBED_STORE"
+_store = None
+_store_checked = False
+
+# ストアにない（ベクトル化が必要な）テキストを、この件数ずつベクトル化してストアに書く
+store_batch_size = 1024
+
+
+# モデルを返す。未ロードならロードする
+def get_model():
+    global _model
+    if _model is None:
+        with instrument.span("model.load", model=model_name):
+            from sentence_transformers import SentenceTransformer
+            _model = SentenceTransformer(model_name)
+    return _model
+
+
+# モデルの代わりに encode() を持つオブジェクトを使う（ベンチマークなど、モデルを読み込まずに動かす場合）
+# name はストアやキャッシュのキーに使うモデル名（本物のモデルのベクトルと混ざらないように別の名前にする）
+def use_model(model, name):
+    global _model, model_name
+    _model = model
+    model_name = name
+
+
+# 永続ストアを使う（path が None なら使わない）
+def use_store(path, max_entries=embeddingstore.default_max_entries):
+    global _store, _store_checked
+    if _store is not None:
+        _store.close()
+    _store = embeddingstore.EmbeddingStore(path, max_entries) if path else None
+    _store_checked = True
+    return _store
+
+
+# 永続ストアを返す。use_store() を呼んでいなければ環境変数 store_env のパスを開く（なければ None）
+def get_store():
+    global _store_checked
+    if not _store_checked:
+        _store_checked = True
+        path = os.environ.get(store_env)
+        if path:
+            use_store(path)
+    return _store
+
+
+# モデルでテキストのリストをベクトル化する
+def _encode(texts, batch_size):
+    model = get_model()
+    with instrument.span("encode", texts=len(texts)):
+        vectors = model.encode(texts, batch_size=max(1, int(batch_size)), convert_to_numpy=True)
+    return np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+
+
+# テキストのリストをまとめてベクトル化し、(テキスト数, embedding_dim) の float32 行列を返す
+# 行の並びは texts の並びと一致する
+# 永続ストアがあれば先に調べ、ないテキストだけをベクトル化してストアに書く
+def encode_texts(texts, batch_size=default_batch_size):
+    texts = list(texts)
+    if not texts:
+        return np.zeros((0, embedding_dim), dtype=np.float32)
+
+    store = get_store()
+    if store is None:
+        return _encode(texts, batch_size)
+
+    keys = [embeddingstore.text_key(text) for text in texts]
+    found = store.get_many(model_name, keys)
+
+    # ストアにないテキスト（同じキーは1回だけ）をまとめてベクトル化する
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in missing:
+            missing[key] = text
+    missing_keys = list(missing)
+    for start in range(0, len(missing_keys), store_batch_size):
+        chunk = missing_keys[start:start + store_batch_size]
+        vectors = _encode([missing[key] for key in chunk], batch_size)
+        store.put_many(model_name, chunk, vectors)
+        found.update(zip(chunk, vectors))
+
+    return np.stack([found[key] for key in keys]).astype(np.float32, copy=False)
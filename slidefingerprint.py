@@ -0,0 +1,251 @@
+import hashlib
+import sys
+from datetime import date
+import xml.etree.ElementTree as ET
+import zipfile
+
+from lxml import etree
+
+import pptxpackage
+
+#--------------------------------------------
+# スライドを描画せずに、描画結果が同じになるスライドを見つけるための指紋
+#
+# スライドの XML パーツと、そこから参照されているレイアウト・マスター・テーマ・画像などの
+# パーツの内容から sha256 を計算する。指紋が同じスライドは描画結果も同じなので、
+# PowerPoint で描画しなくても一致 (match) とみなせる
+#
+# デッキ間のコピーや保存で変わるが描画には影響しない値は除いてから計算する（正規化）
+#   - リレーション ID (r:id, r:embed など) は参照先パーツの指紋に置き換える
+#   - シェイプの ID (p:cNvPr の id 属性)
+#   - 作成・更新の ID (p14:creationId, p14:modId など)
+#   - XML の書式（名前空間の宣言の位置、属性の順序、要素間の空白）は C14N で正規化する
+#
+# ノートとコメントは描画されないので含めない
+#
+# すべてのスライドの描画に影響するデッキ全体の設定も、すべてのスライドの指紋に含める
+#   - presentation.xml のスライドサイズ、既定のテキストスタイル (p:defaultTextStyle)、埋め込みフォントなど
+#     （スライドなどの一覧 (p:sldIdLst など) と、セクションなどの拡張 (p:extLst) は除く）
+#   - 埋め込みフォントと表のスタイル (tableStyles.xml) の内容
+# これらが異なるデッキの間では、どのスライドも同じ指紋にならない
+#
+# スライド番号や日付のフィールド (a:fld type="slidenum", "datetime*") を描画するスライドは、
+# XML が同じでもデッキの中の位置や描画した日で画像が変わるので、スライド番号（と今日の日付）も含める。
+# レイアウト・マスターから継承するものも含むが、レイアウト・マスターのプレースホルダーの中のフィールドは、
+# スライドに同じ種類のプレースホルダー (p:ph type="sldNum", "dt") がある場合にだけ描画されるので、そちらで判定する
+#
+#   python slidefingerprint.py <pptxファイル1> <pptxファイル2>
+#--------------------------------------------
+
+_r = f"{{{pptxpackage.ns['r']}}}"
+_cNvPr = f"{{{pptxpackage.ns['p']}}}cNvPr"
+_fld = f"{{{pptxpackage.ns['a']}}}fld"
+_sp = f"{{{pptxpackage.ns['p']}}}sp"
+_ph = f"{{{pptxpackage.ns['p']}}}ph"
+
+# 描画する位置や日で値が変わるフィールドの種類
+field_slidenum = "slidenum"
+field_datetime = "datetime"
+
+# スライドのプレースホルダーの種類と、そこに描画されるフィールドの種類
+_placeholder_fields = {"sldNum": field_slidenum, "dt": field_datetime}
+
+# 除く要素のローカル名
+_volatile_elements = {"creationId", "modId"}
+
+# 描画に影響しないリレーションの種類（"slide" は他のスライドへのハイパーリンク）
+_ignored_reltypes = {"notesSlide", "comments", "slide"}
+
+# presentation.xml から除く要素のローカル名（パーツの一覧や、描画に影響しない設定）
+_presentation_lists = {
+    "sldMasterIdLst", "notesMasterIdLst", "handoutMasterIdLst", "sldIdLst", "notesSz",
+    "custShowLst", "photoAlbum", "custDataLst", "modifyVerifier", "extLst",
+}
+
+# presentation.xml から参照されていなくても、すべてのスライドの描画に影響するパーツのリレーションの種類
+_presentation_reltypes = {"tableStyles"}
+
+# 画像などを読むときの大きさ
+_chunk_size = 1024 * 1024
+
+
+class _Fingerprinter:
+    def __init__(self, zf):
+        self.zf = zf
+        self._digests = {}
+        self._fields = {}
+
+    # パーツ（と継承するレイアウト・マスター）が描画するフィールドの種類の集合を返す。digest() の後に呼ぶ
+    def fields(self, partname):
+        return self._fields.get(partname, frozenset())
+
+    # パーツの指紋（sha256 の16進文字列）を返す。参照先のパーツも含めて計算する
+    # stack は参照をたどっている途中のパーツ（循環参照はパーツ名で代用する）
+    def digest(self, partname, stack=()):
+        if partname in self._digests:
+            return self._digests[partname]
+        if partname in stack:
+            return hashlib.sha256(partname.encode("utf-8")).hexdigest()
+
+        if partname.endswith(".xml"):
+            value = self._xml_digest(partname, stack + (partname,))
+        else:
+            value = hashlib.sha256()
+            with self.zf.open(partname) as f:
+                for chunk in iter(lambda: f.read(_chunk_size), b""):
+                    value.update(chunk)
+            value = value.hexdigest()
+        self._digests[partname] = value
+        return value
+
+    # presentation.xml のうち、すべてのスライドの描画に影響する部分の指紋を返す
+    def presentation_digest(self):
+        partname = pptxpackage.presentation_partname
+        rels = pptxpackage.read_rels(self.zf, partname)
+        root = etree.fromstring(self.zf.read(partname))
+        # スライド番号の最初の値は、スライド番号を描画するスライドの指紋にだけ含める
+        root.attrib.pop("firstSlideNum", None)
+        for child in list(root):
+            if isinstance(child.tag, str) and child.tag.rsplit("}", 1)[-1] in _presentation_lists:
+                root.remove(child)
+        self._normalize(root, rels, False, (partname,))
+
+        value = hashlib.sha256()
+        value.update(etree.tostring(root, method="c14n"))
+        for target, reltype in sorted(rels.values()):
+            if reltype in _presentation_reltypes and target in self.zf.NameToInfo:
+                value.update(f"\n{reltype}={self.digest(target, (partname,))}".encode("utf-8"))
+        return value.hexdigest()
+
+    @staticmethod
+    def _ignored(is_master, reltype):
+        return reltype in _ignored_reltypes or (is_master and reltype == "slideLayout")
+
+    def _xml_digest(self, partname, stack):
+        rels = pptxpackage.read_rels(self.zf, partname)
+        # マスターはすべてのレイアウトを参照しているが、スライドの描画に使うのはそのうちの1つだけ
+        is_master = partname.startswith("ppt/slideMasters/")
+
+        root = etree.fromstring(self.zf.read(partname))
+        fields = set(_part_fields(root, partname.startswith("ppt/slides/")))
+        for target in self._normalize(root, rels, is_master, stack):
+            fields |= self.fields(target)
+
+        # XML から参照されていないリレーション（スライドのレイアウトなど）も含める
+        referenced = []
+        for target, reltype in sorted(rels.values()):
+            if self._ignored(is_master, reltype) or target not in self.zf.NameToInfo:
+                continue
+            referenced.append(f"{reltype}={self.digest(target, stack)}")
+            fields |= self.fields(target)
+        self._fields[partname] = frozenset(fields)
+
+        value = hashlib.sha256()
+        value.update(etree.tostring(root, method="c14n"))
+        for line in referenced:
+            value.update(b"\n" + line.encode("utf-8"))
+        return value.hexdigest()
+
+    # XML の要素 root から描画に影響しない値を除き、リレーション ID を参照先の指紋に置き換える
+    # 指紋に含めた参照先のパーツ名のリストを返す
+    def _normalize(self, root, rels, is_master, stack):
+        targets = []
+        for parent in list(root.iter()):
+            # 要素間の空白（インデント）は除く。a:t などのテキストの空白は残す
+            if parent.text is not None and len(parent) and not parent.text.strip():
+                parent.text = None
+            if parent.tail is not None and not parent.tail.strip():
+                parent.tail = None
+            for child in list(parent):
+                if isinstance(child.tag, str) and child.tag.rsplit("}", 1)[-1] in _volatile_elements:
+                    parent.remove(child)
+            if parent.tag == _cNvPr:
+                parent.attrib.pop("id", None)
+            for name, value in list(parent.attrib.items()):
+                if not name.startswith(_r) or value not in rels:
+                    continue
+                target, reltype = rels[value]
+                if self._ignored(is_master, reltype) or target not in self.zf.NameToInfo:
+                    # 参照先を含めない場合も、リレーション ID は種類に置き換える
+                    parent.set(name, reltype)
+                    continue
+                parent.set(name, self.digest(target, stack))
+                targets.append(target)
+        return targets
+
+
+# フィールドの種類を返す。位置や日で値が変わらないものは None
+def _field_kind(field_type):
+    if field_type == "slidenum":
+        return field_slidenum
+    if field_type and field_type.startswith("datetime"):
+        return field_datetime
+    return None
+
+
+# パーツの XML の要素 root が描画するフィールドの種類を列挙する
+# スライド以外では、プレースホルダーの中のフィールドは除く（スライドのプレースホルダーで判定する）
+def _part_fields(root, is_slide):
+    for field in root.iter(_fld):
+        kind = _field_kind(field.get("type"))
+        if kind is None:
+            continue
+        if not is_slide and any(sp.find("p:nvSpPr/p:nvPr/p:ph", pptxpackage.ns) is not None for sp in field.iterancestors(_sp)):
+            continue
+        yield kind
+    if is_slide:
+        for placeholder in root.iter(_ph):
+            kind = _placeholder_fields.get(placeholder.get("type"))
+            if kind is not None:
+                yield kind
+
+
+# スライド番号の最初の値（presentation.xml の firstSlideNum）を返す
+def _first_slide_number(zf):
+    root = ET.fromstring(zf.read(pptxpackage.presentation_partname))
+    return int(root.get("firstSlideNum", "1"))
+
+
+# pptx ファイルのスライドの指紋のリストを、スライドの順に返す
+def deck_fingerprints(pptxpath):
+    with zipfile.ZipFile(pptxpath) as zf:
+        fingerprinter = _Fingerprinter(zf)
+        presentation = fingerprinter.presentation_digest().encode("utf-8")
+        first_number = _first_slide_number(zf)
+        fingerprints = []
+        for i, partname in enumerate(pptxpackage.slide_partnames(zf)):
+            value = hashlib.sha256(presentation)
+            value.update(b"\n" + fingerprinter.digest(partname).encode("utf-8"))
+            fields = fingerprinter.fields(partname)
+            if field_slidenum in fields:
+                value.update(f"\nslidenum={first_number + i}".encode("utf-8"))
+            if field_datetime in fields:
+                value.update(f"\ndatetime={date.today().isoformat()}".encode("utf-8"))
+            fingerprints.append(value.hexdigest())
+        return fingerprints
+
+
+# 指紋が同じスライドの組を {derived スライド番号: base スライド番号} で返す
+# 同じ指紋の base スライドが複数ある場合は、最初のものと組にする
+def identical_pairs(derived_fingerprints, base_fingerprints):
+    first = {}
+    for bi, fingerprint in enumerate(base_fingerprints):
+        first.setdefault(fingerprint, bi)
+    return {di: first[fingerprint] for di, fingerprint in enumerate(derived_fingerprints) if fingerprint in first}
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(f"usage: python {sys.argv[0]} <pptxfile1> <pptxfile2>")
+        sys.exit(1)
+
+    fingerprints1 = deck_fingerprints(sys.argv[1])
+    fingerprints2 = deck_fingerprints(sys.argv[2])
+    pairs = identical_pairs(fingerprints1, fingerprints2)
+    for di, bi in sorted(pairs.items()):
+        print(f"{sys.argv[1]} #{di + 1} = {sys.argv[2]} #{bi + 1}")
+    print(f"同一のスライド: {len(pairs)} 枚 / {len(fingerprints1)} 枚")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import numpy as np
+
+import slidecompare
+
+#--------------------------------------------
+# 類似スライドを総当たりせずに探すための索引
+#
+#   IVFIndex  : テキストベクトルのコサイン類似度が閾値以上のものを近似的に探す
+#               （k-means でクラスタに分け、近いクラスタだけを調べる）
+#   SlideIndex: 64bit phash のハミング距離が半径以内のものと IVFIndex をまとめたもの。base スライドの候補を返す
+#
+# phash の半径検索は、パック済みハッシュのハミング距離をブロックごとに numpy で一括計算して求める（厳密）。
+# 64bit の popcount はテキストベクトル (384次元) の内積よりずっと軽い。半径 10 程度では BK木でも
+# ほとんどのノードを調べることになり、Python のループの分だけ遅くなる（5万枚 × 3000枚で 218秒、一括計算では 1秒未満）
+#--------------------------------------------
+
+# IVF で調べるクラスタ数のデフォルト
+default_nprobe = 8
+
+# この件数未満なら IVF はクラスタに分けない（全件を調べるので厳密になる）
+ivf_min_train = 256
+
+# IVF の k-means はクラスタあたりこの件数の標本で学習し、全件の割り当ては最後に1回だけ行う
+ivf_train_per_list = 32
+
+# SlideIndex でハミング距離を一度に計算する要素数の上限
+hash_block_elements = 4 * 1024 * 1024
+
+
+# 転置ファイル (IVF) による近似的なコサイン類似度検索
+class IVFIndex:
+    def __init__(self, vectors, nlist=None, iterations=10, seed=0):
+        self.vectors = slidecompare.normalize_rows(vectors)
+        count = len(self.vectors)
+        if nlist is None:
+            nlist = int(np.sqrt(count)) if count >= ivf_min_train else 1
+        self.nlist = max(1, min(nlist, count))
+
+        if self.nlist == 1:
+            self.centroids = np.zeros((1, self.vectors.shape[1]), dtype=np.float32)
+            self.assignments = np.zeros(count, dtype=np.int64)
+        else:
+            self.centroids, self.assignments = self._kmeans(iterations, seed)
+
+        # ベクトルをクラスタの順に並べ替えて持ち、各クラスタを連続した範囲 bounds[c]:bounds[c + 1] で調べる
+        self.order = np.argsort(self.assignments, kind="stable")
+        self.bounds = np.searchsorted(self.assignments[self.order], np.arange(self.nlist + 1))
+        self.sorted_vectors = self.vectors[self.order]
+
+    # 球面 k-means（正規化ベクトルの内積で割り当てる）
+    # 学習は ivf_train_per_list × nlist 件の標本で行う（全件で学習しても検索の精度はほとんど変わらない）
+    def _kmeans(self, iterations, seed):
+        rng = np.random.default_rng(seed)
+        count = len(self.vectors)
+        sample = self.vectors
+        if count > ivf_train_per_list * self.nlist:
+            sample = self.vectors[rng.choice(count, ivf_train_per_list * self.nlist, replace=False)]
+        centroids = sample[rng.choice(len(sample), self.nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            empty = np.bincount(assignments, minlength=self.nlist) == 0
+            # 空のクラスタはランダムなベクトルで作り直す
+            sums[empty] = sample[rng.integers(len(sample), size=int(empty.sum()))]
+            centroids = slidecompare.normalize_rows(sums)
+        assignments = np.argmax(self.vectors @ centroids.T, axis=1)
+        return centroids, assignments
+
+    # queries の各ベクトルについて、コサイン類似度が threshold 以上の id の配列のリストを返す
+    # 調べるのは各クエリに近い nprobe 個のクラスタだけ
+    def query(self, queries, threshold, nprobe=default_nprobe):
+        queries = slidecompare.normalize_rows(queries)
+        nprobe = max(1, min(nprobe, self.nlist))
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+
+        results = []
+        for query, probe in zip(queries, probes):
+            found = []
+            for c in probe:
+                start, stop = self.bounds[c], self.bounds[c + 1]
+                if start < stop:
+                    found.append(self.order[start:stop][self.sorted_vectors[start:stop] @ query >= threshold])
+            results.append(np.sort(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64))
+        return results
+
+
+# base スライドの索引
+# hashes は pack_imagehashes() の配列（画像を比較しない場合は None）
+class SlideIndex:
+    def __init__(self, hashes, vectors, nlist=None):
+        self.hashes = None if hashes is None else np.asarray(hashes, dtype=np.uint64)
+        self.ivf = IVFIndex(vectors, nlist=nlist)
+
+    # hashes の各ハッシュについて、ハミング距離が radius 以下の base スライドの番号の配列（昇順）のリストを返す
+    def hash_query(self, hashes, radius):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        block_rows = max(1, hash_block_elements // max(1, len(self.hashes)))
+        results = []
+        for start in range(0, len(hashes), block_rows):
+            within = slidecompare.hamming_matrix(hashes[start:start + block_rows], self.hashes) <= radius
+            results.extend(np.nonzero(row)[0] for row in within)
+        return results
+
+    # derived スライドごとに、ハミング距離が hash_radius 以下または
+    # コサイン類似度が text_threshold 以上の base スライドの番号の配列（昇順）を返す
+    def candidates(self, hashes, vectors, hash_radius, text_threshold, nprobe=default_nprobe):
+        text_candidates = self.ivf.query(vectors, text_threshold, nprobe)
+        if self.hashes is None or hashes is None:
+            return text_candidates
+        return [np.union1d(hash_ids, ids) for hash_ids, ids in zip(self.hash_query(hashes, hash_radius), text_candidates)]
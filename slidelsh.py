@@ -0,0 +1,100 @@
+import zlib
+
+import numpy as np
+
+#--------------------------------------------
+# MinHash と LSH (locality-sensitive hashing) による類似スライド候補の絞り込み
+#
+# 各スライドの shape のテキストを文字 n-gram（shingle）の集合にし、
+# MinHash の署名を bands 個の帯（1帯 rows 行）に分けて、どれかの帯が一致する
+# スライドのペアだけを候補にする。
+# Jaccard 係数 s のペアが候補になる確率は 1 - (1 - s^rows)^bands なので、
+# bands を増やす（rows を減らす）と取りこぼしが減り、候補が増えて遅くなる
+#--------------------------------------------
+
+# 帯の数と1帯の行数のデフォルト（署名の長さは bands × rows）
+default_bands = 32
+default_rows = 4
+
+# shingle の文字数
+default_shingle_size = 3
+
+# MinHash に使う素数（2^31 - 1）
+_prime = (1 << 31) - 1
+
+
+# スライドの shingle の集合を返す
+# テキストの文字 n-gram に加え、テキストのない shape（画像、表など）は
+# テキストの類似度が 1.0 になり種類だけで一致しうるので、種類をトークンとして含める
+def slide_shingles(slide, size=default_shingle_size):
+    shingles = set()
+    for shape in slide["shapes"]:
+        text = shape.get("text", "")
+        if not text:
+            shingles.add(f"#{shape['type']}")
+            continue
+        if len(text) <= size:
+            shingles.add(text)
+            continue
+        for i in range(len(text) - size + 1):
+            shingles.add(text[i:i + size])
+    return shingles
+
+
+# スライドのリストの MinHash 署名を (スライド数, num_perm) の行列で返す
+# shingle のないスライドの署名はすべて最大値になる
+def minhash_signatures(slides, num_perm=default_bands * default_rows, seed=0, size=default_shingle_size):
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _prime, num_perm, dtype=np.uint64)
+    b = rng.integers(0, _prime, num_perm, dtype=np.uint64)
+
+    signatures = np.full((len(slides), num_perm), _prime, dtype=np.uint64)
+    for i, slide in enumerate(slides):
+        shingles = slide_shingles(slide, size)
+        if not shingles:
+            continue
+        # crc32 はプロセスをまたいでも同じ値になる（hash() は実行ごとに変わる）
+        values = np.array([zlib.crc32(s.encode("utf-8")) for s in shingles], dtype=np.uint64) % np.uint64(_prime)
+        signatures[i] = ((a[:, None] * values[None, :] + b[:, None]) % np.uint64(_prime)).min(axis=1)
+    return signatures
+
+
+# 署名の帯が1つでも一致するスライドのペア (i, j)（i < j）を昇順のリストで返す
+def candidate_pairs(signatures, bands=default_bands, rows=default_rows):
+    candidates = set()
+    for band in range(bands):
+        buckets = {}
+        for i, key in enumerate(map(bytes, signatures[:, band * rows:(band + 1) * rows])):
+            buckets.setdefault(key, []).append(i)
+        for members in buckets.values():
+            for x in range(len(members)):
+                for y in range(x + 1, len(members)):
+                    candidates.add((members[x], members[y]))
+    return sorted(candidates)
+
+
+# テキストのない shape（画像、表など）は同じ種類の shape があればテキストの類似度が 1.0 になるので、
+# テキストが似ていなくても類似度が高くなりうる。そのようなペア (i, j)（i < j）を返す
+# slides[i] の shape のうち、テキストのない種類 T の shape の割合が slide_threshold 以上で、
+# slides[j] が T の shape を持つペアが対象（slide_similarity(slides[i], slides[j]) の向き）
+def textless_candidate_pairs(slides, slide_threshold):
+    dominant = {}
+    having = {}
+    for i, slide in enumerate(slides):
+        shapes = slide["shapes"]
+        counts = {}
+        for shape in shapes:
+            if not shape.get("text", ""):
+                counts[shape["type"]] = counts.get(shape["type"], 0) + 1
+        for shapetype, count in counts.items():
+            having.setdefault(shapetype, []).append(i)
+            if count >= slide_threshold * len(shapes):
+                dominant.setdefault(shapetype, []).append(i)
+
+    candidates = set()
+    for shapetype, members in dominant.items():
+        for i in members:
+            for j in having[shapetype]:
+                if i < j:
+                    candidates.add((i, j))
+    return candidates
@@ -0,0 +1,89 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import calcslidesimilarity
+
+#--------------------------------------------
+# スライドペアの類似度 (calcslidesimilarity.slide_similarity) をプロセスプールで並列に計算する
+#
+# slides1 の行（スライド番号）をチャンクに分けてワーカーに配る。
+# スライドのリストと類似度の設定はワーカーの起動時に1回だけ渡し、
+# タスクには行番号のリストだけを渡す
+# テキスト類似度のメモ (calcslidesimilarity.text_similarity) はワーカーごとに持つ
+#--------------------------------------------
+
+# 並列計算のワーカープロセス数のデフォルト
+default_jobs = os.cpu_count() or 1
+
+# ペア数がこれ未満なら並列にしない（プロセス起動のコストの方が大きい）
+min_parallel_pairs = 2000
+
+# ワーカー1つあたりのチャンク数の目安（負荷の偏りをならすため複数に分ける）
+chunks_per_job = 4
+
+
+# ワーカープロセス内の状態
+_slides1 = None
+_slides2 = None
+_cols = None
+_shape_threshold = None
+_min_similarity = None
+
+
+def _init_worker(slides1, slides2, cols, shape_threshold, min_similarity, settings):
+    global _slides1, _slides2, _cols, _shape_threshold, _min_similarity
+    _slides1 = slides1
+    _slides2 = slides2
+    _cols = cols
+    _shape_threshold = shape_threshold
+    _min_similarity = min_similarity
+    calcslidesimilarity.set_similarity_settings(**settings)
+
+
+# 行番号のリストについて、min_similarity 以上のペアを (i, j, 類似度) のリストと、
+# その間のテキスト類似度のメモのヒット数・ミス数を返す
+def _score_rows(rows):
+    before = calcslidesimilarity.text_cache_stats()
+    results = []
+    for i in rows:
+        slide1 = _slides1[i]
+        for j in _cols:
+            similarity = calcslidesimilarity.slide_similarity(slide1, _slides2[j], _shape_threshold)
+            if similarity >= _min_similarity:
+                results.append((i, j, similarity))
+    after = calcslidesimilarity.text_cache_stats()
+    return results, after["hits"] - before["hits"], after["misses"] - before["misses"]
+
+
+# チャンクの行数を決める
+def auto_chunk_size(row_count, jobs):
+    return max(1, math.ceil(row_count / (jobs * chunks_per_job)))
+
+
+# slides1[rows] × slides2[cols] のスライド類似度を計算し、
+# min_similarity 以上のペアを (i, j, 類似度) のリストで返す（i, j の昇順）
+# jobs が 1 以下か、ペア数が min_parallel_pairs 未満なら並列にしない
+def score_pairs(slides1, slides2, rows, cols, shape_threshold, min_similarity, jobs=default_jobs, chunk_size=None):
+    rows = list(rows)
+    cols = list(cols)
+    settings = calcslidesimilarity.get_similarity_settings()
+
+    jobs = max(1, int(jobs))
+    if jobs == 1 or len(rows) * len(cols) < min_parallel_pairs:
+        _init_worker(slides1, slides2, cols, shape_threshold, min_similarity, settings)
+        results, _, _ = _score_rows(rows)
+        return results
+
+    if chunk_size is None:
+        chunk_size = auto_chunk_size(len(rows), jobs)
+    chunks = [rows[k:k + chunk_size] for k in range(0, len(rows), chunk_size)]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=min(jobs, len(chunks)), initializer=_init_worker,
+                             initargs=(slides1, slides2, cols, shape_threshold, min_similarity, settings)) as executor:
+        for chunk_results, hits, misses in executor.map(_score_rows, chunks):
+            results.extend(chunk_results)
+            # ワーカーのメモの統計を親プロセスの統計に加える
+            calcslidesimilarity.add_text_cache_stats(hits, misses)
+    return results
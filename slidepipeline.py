@@ -0,0 +1,121 @@
+import os
+import queue
+import threading
+
+import imagehash
+import numpy as np
+from PIL import Image
+
+import instrument
+import slideembedding
+
+#--------------------------------------------
+# スライドの export と並行して phash の計算とテキストのベクトル化を行うパイプライン
+#
+#   export（呼び出し元のスレッド） → submit(index, imagepath, text)
+#       → phash キュー → phash ワーカースレッド（workers 本）
+#       → テキストキュー → ベクトル化スレッド（embed_batch 件ずつまとめて encode）
+#
+# キューは上限付きなので、ワーカーが追いつかない場合は export 側が待たされる
+# export が途中で失敗した場合は abort() を呼ぶ。残りの計算を捨ててワーカースレッドを終了させる
+#--------------------------------------------
+
+# phash ワーカーのデフォルト数
+default_workers = max(1, min(4, (os.cpu_count() or 1)))
+
+# キューの終端を表す値
+_sentinel = None
+
+
+class SlideAnalysisPipeline:
+    def __init__(self, workers=default_workers, embed_batch=slideembedding.default_batch_size):
+        self.workers = max(1, int(workers))
+        self.embed_batch = max(1, int(embed_batch))
+        self._hash_queue = queue.Queue(maxsize=self.workers * 2)
+        self._text_queue = queue.Queue(maxsize=self.embed_batch * 2)
+        self._hashes = {}
+        self._vector_batches = []
+        self._count = 0
+        self._errors = []
+        self._lock = threading.Lock()
+        self._aborted = False
+        self._closed = False
+
+        self._threads = [threading.Thread(target=self._hash_worker, daemon=True) for _ in range(self.workers)]
+        self._threads.append(threading.Thread(target=self._embed_worker, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    # export したスライドを1枚投入する。index は 0 から連番で投入すること
+    def submit(self, index, imagepath, text):
+        self._count += 1
+        self._hash_queue.put((index, imagepath))
+        self._text_queue.put(text)
+
+    # 投入の終了を通知して全ワーカーの終了を待ち、
+    # (phash のリスト, (スライド数, 384) の float32 行列) を index 順で返す
+    def finish(self):
+        self.close()
+
+        if self._errors:
+            raise self._errors[0]
+
+        hashes = [self._hashes[i] for i in range(self._count)]
+        if self._vector_batches:
+            vectors = np.concatenate(self._vector_batches, axis=0)
+        else:
+            vectors = slideembedding.encode_texts([])
+        return hashes, vectors
+
+    # 投入の終了を通知して全ワーカーの終了を待つ。2回目以降は何もしない
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for _ in range(self.workers):
+            self._hash_queue.put(_sentinel)
+        self._text_queue.put(_sentinel)
+        for thread in self._threads:
+            thread.join()
+
+    # 計算していないスライドを捨てて、全ワーカーの終了を待つ
+    def abort(self):
+        self._aborted = True
+        self.close()
+
+    def _record_error(self, error):
+        with self._lock:
+            self._errors.append(error)
+
+    # エラーが起きてもキューは最後まで取り出し続ける（export 側を止めないため）
+    def _hash_worker(self):
+        while True:
+            item = self._hash_queue.get()
+            if item is _sentinel:
+                return
+            if self._errors or self._aborted:
+                continue
+            index, imagepath = item
+            try:
+                with instrument.span("phash", slides=1), Image.open(imagepath) as img:
+                    hash = imagehash.phash(img)
+                with self._lock:
+                    self._hashes[index] = hash
+            except Exception as e:
+                self._record_error(e)
+
+    def _embed_worker(self):
+        batch = []
+        while True:
+            text = self._text_queue.get()
+            if text is not _sentinel:
+                batch.append(text)
+            if batch and (text is _sentinel or len(batch) >= self.embed_batch):
+                if not self._errors and not self._aborted:
+                    try:
+                        self._vector_batches.append(slideembedding.encode_texts(batch, batch_size=self.embed_batch))
+                    except Exception as e:
+                        self._record_error(e)
+                batch = []
+            if text is _sentinel:
+                return
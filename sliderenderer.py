@@ -0,0 +1,174 @@
+import os
+import re
+import shutil
+import tempfile
+
+#--------------------------------------------
+# スライドを画像に export するレンダラー
+#
+# レンダラーは with 文で使い、render() はスライドごとに
+# (スライド番号(0から), 画像のパス, スライドのテキスト) を返すジェネレーター
+# slide_indices を指定した場合は、そのスライド番号のスライドだけを描画する
+#
+#   powerpoint : PowerPoint (COM) で export する。アプリケーションは1回だけ起動して
+#                複数のデッキで使い回し、可能ならプレゼンテーション全体を一括で export する
+#   fake       : PowerPoint を使わず、python-pptx で読んだテキストを白紙の PNG に描く
+#                （PowerPoint のない環境での動作確認・性能測定用）
+#--------------------------------------------
+
+# PowerPoint の定数 ppSaveAsPNG
+_ppSaveAsPNG = 18
+
+# 一括 export で作られるファイル名（言語によって "Slide1.PNG", "スライド1.PNG" など）の番号部分
+_numbered_png = re.compile(r"(\d+)\.png$", re.IGNORECASE)
+
+
+# 画像のファイル名を返す
+def image_filename(exportfilename, index):
+    return f"{exportfilename}_{index}.png"
+
+
+class PowerPointRenderer:
+    name = "powerpoint"
+
+    def __init__(self, bulk_export=True):
+        self.bulk_export = bulk_export
+        self._app = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # PowerPoint を（まだ起動していなければ）起動して返す
+    def _application(self):
+        if self._app is None:
+            import comtypes.client
+            self._app = comtypes.client.CreateObject("PowerPoint.Application")
+            self._app.Visible = True
+        return self._app
+
+    # ユーザーが開いている PowerPoint を閉じないように Quit はしない
+    def close(self):
+        self._app = None
+
+    def render(self, pptxpath, exportdir, exportfilename, slide_indices=None):
+        # 描画するスライドがなければ PowerPoint を起動しない
+        if slide_indices is not None and not len(slide_indices):
+            return
+        presentation = self._application().Presentations.Open(pptxpath)
+        try:
+            slide_count = len(presentation.Slides)
+            indices = range(slide_count) if slide_indices is None else sorted(i for i in slide_indices if 0 <= i < slide_count)
+            texts = {i: self._slide_text(presentation.Slides[i + 1]) for i in indices}
+
+            # 一部のスライドだけを描画する場合は、スライドごとに export する
+            if self.bulk_export and len(indices) == slide_count and self._export_all(presentation, slide_count, exportdir, exportfilename):
+                for i in indices:
+                    yield i, os.path.join(exportdir, image_filename(exportfilename, i)), texts[i]
+                return
+
+            # 一括 export できなかった場合はスライドごとに export する
+            for i in indices:
+                imagepath = os.path.join(exportdir, image_filename(exportfilename, i))
+                presentation.Slides[i + 1].Export(imagepath, "PNG")  # スライドは1から始まる
+                yield i, imagepath, texts[i]
+        finally:
+            presentation.Close()
+
+    # スライド内のすべてのシェイプのテキストを結合して返す
+    @staticmethod
+    def _slide_text(slide):
+        slide_text = ""
+        for shape in slide.Shapes:
+            if shape.HasTextFrame:  # テキストフレームがある場合
+                text_frame = shape.TextFrame
+                if text_frame.HasText:  # テキストが存在する場合
+                    slide_text += text_frame.TextRange.Text + " "
+        return slide_text
+
+    # プレゼンテーション全体を一時ディレクトリに PNG で一括保存し、所定のファイル名で exportdir に移す
+    # 保存できなかった場合や枚数が合わない場合は False を返す
+    def _export_all(self, presentation, slide_count, exportdir, exportfilename):
+        tempdir = tempfile.mkdtemp(dir=exportdir)
+        try:
+            try:
+                presentation.SaveCopyAs(os.path.join(tempdir, "slides"), _ppSaveAsPNG)
+            except Exception as e:
+                print(f"一括 export できないため、スライドごとに export します: {e}")
+                return False
+
+            exported = {}
+            for dirpath, _, filenames in os.walk(tempdir):
+                for filename in filenames:
+                    matched = _numbered_png.search(filename)
+                    if matched:
+                        exported[int(matched.group(1))] = os.path.join(dirpath, filename)
+            if sorted(exported) != list(range(1, slide_count + 1)):
+                print("一括 export の結果がスライド数と一致しないため、スライドごとに export します")
+                return False
+
+            for number, path in exported.items():
+                shutil.move(path, os.path.join(exportdir, image_filename(exportfilename, number - 1)))
+            return True
+        finally:
+            shutil.rmtree(tempdir, ignore_errors=True)
+
+
+class FakeRenderer:
+    name = "fake"
+
+    def __init__(self, width=1280, background="white", foreground="black"):
+        self.width = width
+        self.background = background
+        self.foreground = foreground
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        pass
+
+    def render(self, pptxpath, exportdir, exportfilename, slide_indices=None):
+        from pptx import Presentation
+        from PIL import Image, ImageDraw
+
+        prs = Presentation(pptxpath)
+        height = max(1, round(self.width * prs.slide_height / prs.slide_width))
+        selected = None if slide_indices is None else set(slide_indices)
+
+        for i, slide in enumerate(prs.slides):
+            if selected is not None and i not in selected:
+                continue
+            img = Image.new("RGB", (self.width, height), self.background)
+            draw = ImageDraw.Draw(img)
+            slide_text = ""
+            for shape in slide.shapes:
+                if not shape.has_text_frame or not shape.text_frame.text:
+                    continue
+                slide_text += shape.text_frame.text + " "
+                # シェイプの位置にテキストを描く
+                left = (shape.left or 0) * self.width // prs.slide_width
+                top = (shape.top or 0) * height // prs.slide_height
+                draw.multiline_text((left, top), shape.text_frame.text, fill=self.foreground)
+
+            imagepath = os.path.join(exportdir, image_filename(exportfilename, i))
+            img.save(imagepath)
+            yield i, imagepath, slide_text
+
+
+renderers = {
+    PowerPointRenderer.name: PowerPointRenderer,
+    FakeRenderer.name: FakeRenderer,
+}
+
+
+# 名前からレンダラーを作る
+def create_renderer(name):
+    if name not in renderers:
+        raise ValueError(f"未知のレンダラーです: {name}")
+    return renderers[name]()
@@ -0,0 +1,96 @@
+import os
+import random
+import sys
+from difflib import SequenceMatcher
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import calcslidesimilarity
+
+
+# テキスト類似度のメモを小さくして、id の表を作り直させる
+def _small_cache(size):
+    calcslidesimilarity.clear_text_cache()
+    saved = calcslidesimilarity.text_cache_size
+    calcslidesimilarity.text_cache_size = size
+    return saved
+
+
+def test_text_similarity_after_id_table_reset():
+    saved = _small_cache(2)
+    try:
+        assert calcslidesimilarity.text_similarity("xyz", "xyz1") == SequenceMatcher(None, "xyz", "xyz1").ratio()
+        calcslidesimilarity.text_similarity("p", "q")
+        # 2つ目のテキストで id の表がいっぱいになる。1つ目の id が古いまま、別のテキストの id にならない
+        assert calcslidesimilarity.text_similarity("xyz", "new") == 0.0
+        assert calcslidesimilarity.text_similarity("new", "new") == 1.0
+    finally:
+        calcslidesimilarity.text_cache_size = saved
+        calcslidesimilarity.clear_text_cache()
+
+
+def test_text_similarity_matches_sequencematcher_with_small_cache():
+    saved = _small_cache(3)
+    try:
+        rng = random.Random(0)
+        texts = ["".join(rng.choice("abcd") for _ in range(rng.randint(0, 6))) for _ in range(12)]
+        for _ in range(500):
+            t1, t2 = rng.choice(texts), rng.choice(texts)
+            assert calcslidesimilarity.text_similarity(t1, t2) == SequenceMatcher(None, t1, t2).ratio()
+    finally:
+        calcslidesimilarity.text_cache_size = saved
+        calcslidesimilarity.clear_text_cache()
+
+
+# 枝刈り・行列化する前の slide_similarity()（すべての shape の組み合わせを比べる）
+def _reference_slide_similarity(slide1, slide2, shape_threshold):
+    shapes1 = slide1["shapes"]
+    shapes2 = slide2["shapes"]
+    if not shapes1 or not shapes2:
+        return 0.0
+    matched = 0
+    for s1 in shapes1:
+        best = max((calcslidesimilarity.shape_similarity(s1, s2, alpha=calcslidesimilarity.layout_weight, beta=calcslidesimilarity.text_weight) for s2 in shapes2), default=0.0)
+        if best >= shape_threshold:
+            matched += 1
+    return round(matched / max(len(shapes1), len(shapes2)), 2)
+
+
+# 同じ shape の重複や、テキストのない shape（"text" がない、空文字列）を含むスライドを作る
+def _random_slide(rng, words):
+    shapes = []
+    for _ in range(rng.randint(0, 6)):
+        shape = {"type": rng.choice(["text", "text", "picture"])}
+        for key in ("left", "top", "width", "height"):
+            shape[key] = rng.choice([0.0, 0.1, 0.25, 0.5]) + rng.choice([0.0, 0.0, 0.01])
+        choice = rng.random()
+        if choice < 0.6:
+            shape["text"] = " ".join(rng.choice(words) for _ in range(rng.randint(1, 4)))
+        elif choice < 0.8:
+            shape["text"] = ""
+        shapes.append(shape)
+        if shapes and rng.random() < 0.3:
+            shapes.append(dict(rng.choice(shapes)))
+    return {"slidetitle": "", "shapes": shapes}
+
+
+def test_slide_similarity_matches_reference_loop():
+    saved = calcslidesimilarity.get_similarity_settings()
+    rng = random.Random(1)
+    words = ["売上", "計画", "2024", "sales", "plan", "sale"]
+    slides = [_random_slide(rng, words) for _ in range(30)]
+    try:
+        for layout, text, shape, strict, dedup in [
+            (0.2, 0.8, 0.75, False, False),
+            (0.2, 0.8, 0.75, False, True),
+            (0.2, 0.8, 0.75, True, False),
+            (0.5, 0.5, 0.6, False, True),
+            (0.7, 0.3, 0.9, False, False),
+            (0.2, 0.8, 0.0, False, False),
+        ]:
+            calcslidesimilarity.set_similarity_settings(layout=layout, text=text, shape=shape, text_strict=strict, dedup=dedup)
+            for slide1 in slides:
+                for slide2 in slides:
+                    assert calcslidesimilarity.slide_similarity(slide1, slide2, shape) == _reference_slide_similarity(slide1, slide2, shape)
+    finally:
+        calcslidesimilarity.set_similarity_settings(**saved)
@@ -0,0 +1,33 @@
+import os
+import sys
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import diffimage
+
+
+# 黒い差分画像に、(矩形, 色) のリストを描く
+def _diff(size, boxes):
+    diff = Image.new("RGB", size)
+    draw = ImageDraw.Draw(diff)
+    for box, color in boxes:
+        draw.rectangle(box, fill=color)
+    return diff
+
+
+def test_regions_bound_changed_pixels_not_the_grouping_gap():
+    diff = _diff((400, 300), [
+        ([100, 100, 119, 109], (200, 0, 0)),
+        ([130, 100, 133, 103], (0, 200, 0)),  # 近いので上の変化と1つの領域になる
+        ([300, 250, 301, 251], (0, 0, 200)),
+        ([10, 10, 20, 20], (10, 10, 10)),  # threshold 以下
+    ])
+    assert diffimage.changed_regions(diff, region_scale=1) == [[100, 100, 134, 110], [300, 250, 302, 252]]
+    assert diffimage.changed_regions(diff, region_scale=4) == [[100, 100, 136, 112], [300, 248, 304, 252]]
+
+
+def test_regions_with_scale_larger_than_image():
+    diff = _diff((40, 30), [([5, 5, 8, 8], (200, 0, 0))])
+    assert diffimage.changed_regions(diff, region_scale=1000) == [[0, 0, 30, 30]]
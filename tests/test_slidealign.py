@@ -0,0 +1,115 @@
+import os
+import random
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import slidealign
+
+
+# 全ペアの表で求める、順序を保った対応の重みの合計の最大値（正の重みだけを使う）
+def _full_dp(weights):
+    n, m = weights.shape
+    table = np.zeros((n + 1, m + 1))
+    for i in range(n):
+        for j in range(m):
+            matched = table[i, j] + weights[i, j] if weights[i, j] > 0 else -np.inf
+            table[i + 1, j + 1] = max(table[i, j + 1], table[i + 1, j], matched)
+    return table[n, m]
+
+
+# 対応が順序を保ち、正の重みのペアだけからなることを確かめて、重みの合計を返す
+def _total(pairs, weights):
+    for (i1, j1), (i2, j2) in zip(pairs, pairs[1:]):
+        assert i1 < i2 and j1 < j2
+    assert all(weights[i, j] > 0 for i, j in pairs)
+    return sum(weights[i, j] for i, j in pairs)
+
+
+def _random_weights(rng, n, m):
+    return np.array([rng.choice([0.0, 0.0, 0.0, 0.5, 1.0, 2.0]) for _ in range(n * m)]).reshape(n, m)
+
+
+def test_align_matches_full_dp_when_band_covers_everything():
+    rng = random.Random(0)
+    for _ in range(200):
+        n, m = rng.randint(0, 8), rng.randint(0, 8)
+        weights = _random_weights(rng, n, m)
+        band = max(n, m)
+        rows, cols = slidealign.band_pairs(n, m, band)
+        pairs = slidealign.align(n, m, rows, cols, weights[rows, cols], band)
+        assert np.isclose(_total(pairs, weights), _full_dp(weights))
+
+
+def test_align_is_optimal_within_narrow_band():
+    rng = random.Random(1)
+    for _ in range(200):
+        n, m = rng.randint(1, 12), rng.randint(1, 12)
+        band = rng.randint(0, 3)
+        weights = _random_weights(rng, n, m)
+        rows, cols = slidealign.band_pairs(n, m, band)
+        # 帯の外のペアは比べないので、重み 0 として全ペアの表で求めた値と比べる
+        inside = np.zeros_like(weights)
+        inside[rows, cols] = weights[rows, cols]
+        pairs = slidealign.align(n, m, rows, cols, weights[rows, cols], band)
+        assert np.isclose(_total(pairs, inside), _full_dp(inside))
+
+
+# derived・base のスライドをラベルで表し、同じラベルなら重み 1 で対応付けて分類する
+# ラベルの末尾が "'" のものは変更あり（同じラベルとは対応するが unchanged にならない）
+def _classify(derived, base, band=1):
+    def key(label):
+        return label.rstrip("'")
+
+    def score(rows, cols):
+        return np.array([1.0 if key(derived[i]) == key(base[j]) else 0.0 for i, j in zip(rows, cols)])
+
+    alignment = slidealign.align_slides(len(derived), len(base), score, band)
+    return slidealign.classify(len(derived), alignment, lambda i, j: derived[i] == base[j]), alignment
+
+
+def test_classify_unchanged():
+    result, alignment = _classify(["a", "b", "c"], ["a", "b", "c"])
+    assert result == [("unchanged", 0), ("unchanged", 1), ("unchanged", 2)]
+    assert alignment["removed"] == []
+
+
+def test_classify_modified():
+    result, _ = _classify(["a", "b'", "c"], ["a", "b", "c"])
+    assert result == [("unchanged", 0), ("modified", 1), ("unchanged", 2)]
+
+
+def test_classify_moved():
+    # 帯の外に移動したスライドは、帯の外の全探索で見つかる
+    derived = ["h", "a", "b", "c", "d", "e", "f", "g"]
+    base = ["a", "b", "c", "d", "e", "f", "g", "h"]
+    result, alignment = _classify(derived, base)
+    assert result[0] == ("moved", 7)
+    assert result[1:] == [("unchanged", j) for j in range(7)]
+    assert alignment["added"] == [] and alignment["removed"] == []
+
+
+def test_classify_added():
+    result, alignment = _classify(["a", "x", "b"], ["a", "b"])
+    assert result == [("unchanged", 0), ("added", None), ("unchanged", 1)]
+    assert alignment["added"] == [1]
+
+
+def test_classify_removed():
+    result, alignment = _classify(["a", "c"], ["a", "b", "c"])
+    assert result == [("unchanged", 0), ("unchanged", 2)]
+    assert alignment["removed"] == [1]
+
+
+def test_align_slides_assigns_each_slide_once():
+    rng = random.Random(2)
+    for _ in range(100):
+        n, m = rng.randint(0, 15), rng.randint(0, 15)
+        weights = _random_weights(rng, n, m)
+        alignment = slidealign.align_slides(n, m, lambda rows, cols: weights[rows, cols], band=rng.randint(0, 3))
+        pairs = alignment["aligned"] + alignment["moved"]
+        assert sorted([i for i, _ in pairs] + alignment["added"]) == list(range(n))
+        assert sorted([j for _, j in pairs] + alignment["removed"]) == list(range(m))
+        assert all(weights[i, j] > 0 for i, j in pairs)
@@ -0,0 +1,49 @@
+import importlib.util
+import os
+import sys
+import threading
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import slidepipeline
+
+_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+# ファイル名にハイフンがあるので、compare-pptx.py はパスから読み込む
+def _load_compare_pptx():
+    spec = importlib.util.spec_from_file_location("compare_pptx", os.path.join(_root, "compare-pptx.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# 2枚描画した後に失敗するレンダラー
+class FailingRenderer:
+    def render(self, pptxpath, exportdir, exportfilename, slide_indices=None):
+        for i in range(2):
+            imagepath = os.path.join(exportdir, f"{exportfilename}_{i}.png")
+            Image.new("RGB", (64, 48), "white").save(imagepath)
+            yield i, imagepath, f"slide {i}"
+        raise RuntimeError("render failed")
+
+
+def test_export_stops_pipeline_threads_when_renderer_fails(tmp_path):
+    compare_pptx = _load_compare_pptx()
+    before = threading.active_count()
+    for _ in range(3):
+        with pytest.raises(RuntimeError, match="render failed"):
+            compare_pptx.export_pptx_images(str(tmp_path / "deck.pptx"), str(tmp_path), "slide", FailingRenderer(), workers=4)
+    assert threading.active_count() == before
+
+
+def test_abort_discards_submitted_slides():
+    pipeline = slidepipeline.SlideAnalysisPipeline(workers=2, embed_batch=4)
+    for i in range(3):
+        pipeline.submit(i, "missing.png", f"slide {i}")
+    pipeline.abort()
+    pipeline.abort()
+    assert not any(thread.is_alive() for thread in pipeline._threads)
@@ -0,0 +1,63 @@
+import importlib.util
+import os
+import random
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+# ファイル名にハイフンがあるので、tvdiff-pptx2.py はパスから読み込む
+def _load_tvdiff_pptx2():
+    spec = importlib.util.spec_from_file_location("tvdiff_pptx2", os.path.join(_root, "tvdiff-pptx2.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# 行列化する前の slide_similarity()（shape ごとに最も近い shape を探し、使用済みでなければマッチとする）
+def _reference_slide_similarity(vecs1, vecs2, threshold=0.85):
+    if not len(vecs1) or not len(vecs2):
+        return 0.0
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    sim_matrix = cosine_similarity(vecs1, vecs2)
+    matched = 0
+    used_b_indices = set()
+    for i in range(len(vecs1)):
+        best_j = np.argmax(sim_matrix[i])
+        if sim_matrix[i][best_j] > threshold and best_j not in used_b_indices:
+            matched += 1
+            used_b_indices.add(best_j)
+    return matched / min(len(vecs1), len(vecs2))
+
+
+# shape のベクトルの行列と offsets を作る。同じ shape の重複と、shape のないスライドを含む
+def _random_deck(rng, pool, slides):
+    rows = []
+    offsets = [0]
+    for _ in range(slides):
+        count = rng.choice([0, 1, 2, 3, 5])
+        for _ in range(count):
+            rows.append(pool[rng.randrange(len(pool))])
+        offsets.append(len(rows))
+    return np.array(rows, dtype=np.float64).reshape(-1, pool.shape[1]), np.array(offsets, dtype=np.int64)
+
+
+def test_slide_similarity_matrix_matches_greedy_loop():
+    tvdiff = _load_tvdiff_pptx2()
+    rng = random.Random(0)
+    base = np.random.default_rng(0).normal(size=(6, 8))
+    # 近いベクトル（閾値を超える）と遠いベクトルを混ぜる
+    pool = np.concatenate([base, base + np.random.default_rng(1).normal(scale=0.2, size=base.shape)])
+    for _ in range(20):
+        matrix_a, offsets_a = _random_deck(rng, pool, 6)
+        matrix_b, offsets_b = _random_deck(rng, pool, 5)
+        scores = tvdiff.slide_similarity_matrix(matrix_a, offsets_a, matrix_b, offsets_b)
+        for i in range(len(offsets_a) - 1):
+            for j in range(len(offsets_b) - 1):
+                expected = _reference_slide_similarity(matrix_a[offsets_a[i]:offsets_a[i + 1]], matrix_b[offsets_b[j]:offsets_b[j + 1]])
+                assert scores[i, j] == expected
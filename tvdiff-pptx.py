@@ -1,42 +1,43 @@
-from pptx import Presentation
-from sentence_transformers import SentenceTransformer
+import argparse
+import os
+
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-import sys
 
-# モデルの準備
-model = SentenceTransformer('all-MiniLM-L6-v2')
+import pptxxmlanalyzer
+import slideembedding
+import instrument
+
+# モデル (sentence-transformers) は最初の encode の時に読み込まれる（slideembedding.encode_texts()）
+# 環境変数 COMPARE_PPTX_EMBED_STORE でテキストベクトルの永続ストアを指定できる
 
 # スライドサイズ（ポイント単位、デフォルト16:9 = 914400 x 514350）
 SLIDE_WIDTH = 914400
 SLIDE_HEIGHT = 514350
 
 def slide_to_vector(pptx_path):
-    prs = Presentation(pptx_path)
     slide_vectors = []
 
-    for slide in prs.slides:
+    # pptxxmlanalyzer でスライドの XML を直接読む
+    with instrument.span("extract", file=os.path.basename(pptx_path)) as span:
+        slides = pptxxmlanalyzer.analyze_pptx(pptx_path)["slides"]
+        span.set(slides=len(slides))
+    instrument.count("slides", len(slides))
+    for slide in slides:
         shape_vectors = []
-        for shape in slide.shapes:
-            if not shape.has_text_frame:
-                continue
-            text = shape.text.strip()
-            if not text:
-                continue
+        shapes = [shape for shape in slide["shapes"] if shape["type"] == "text"]
 
-            # テキストの意味ベクトル
-            text_vec = model.encode(text)
+        # テキストの意味ベクトル（スライドの shape をまとめてベクトル化、永続ストアがあれば先に調べる）
+        text_vecs = slideembedding.encode_texts([shape["text"] for shape in shapes])
 
+        for shape, text_vec in zip(shapes, text_vecs):
             # 位置ベクトル（正規化）
-            if hasattr(shape, 'left') and hasattr(shape, 'top'):
-                pos_vec = np.array([
-                    shape.left / SLIDE_WIDTH,
-                    shape.top / SLIDE_HEIGHT,
-                    shape.width / SLIDE_WIDTH,
-                    shape.height / SLIDE_HEIGHT
-                ])
-            else:
-                pos_vec = np.zeros(4)
+            left, top, width, height = pptxxmlanalyzer.position_emu(shape)
+            pos_vec = np.array([
+                left / SLIDE_WIDTH,
+                top / SLIDE_HEIGHT,
+                width / SLIDE_WIDTH,
+                height / SLIDE_HEIGHT
+            ])
 
             # 結合：意味 + 位置
             shape_vec = np.concatenate([text_vec, pos_vec])
@@ -50,10 +51,30 @@ def slide_to_vector(pptx_path):
     return slide_vectors  # 複数スライドある場合もあるためリストで返す
 
 # 使用例
-vecs_a = slide_to_vector(sys.argv[1])
-vecs_b = slide_to_vector(sys.argv[2])
+def main():
+    parser = argparse.ArgumentParser(description="2つの pptx ファイルの最初のスライドの類似度（テキスト＋位置）")
+    parser.add_argument("pptxfile1", help="pptx ファイル")
+    parser.add_argument("pptxfile2", help="pptx ファイル")
+    parser.add_argument("--profile", type=str, nargs="?", const="trace.json", default=None, metavar="TRACEFILE", help="段階ごとの時間を計り、Chrome のトレース (JSON) と集計表を出力する（デフォルト: trace.json）")
+    parser.add_argument("--profile-stage", type=str, default=None, help="--profile で、この名前の段階を cProfile でも計測する（extract, encode）")
+    args = parser.parse_args()
+    if args.profile is not None:
+        instrument.enable(args.profile_stage)
+
+    # scikit-learn は読み込みに時間がかかるので、使う時に読み込む
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    vecs_a = slide_to_vector(args.pptxfile1)
+    vecs_b = slide_to_vector(args.pptxfile2)
+
+    # 最初のスライド同士を比較（例）
+    sim = cosine_similarity([vecs_a[0]], [vecs_b[0]])
+    print(f"類似度: {sim[0][0]:.3f}")
+
+    if args.profile is not None:
+        instrument.finish(args.profile)
+
 
-# 最初のスライド同士を比較（例）
-sim = cosine_similarity([vecs_a[0]], [vecs_b[0]])
-print(f"類似度: {sim[0][0]:.3f}")
+if __name__ == "__main__":
+    main()
 
@@ -1,88 +1,211 @@
+import argparse
 import os
-from pptx import Presentation
-from sentence_transformers import SentenceTransformer
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 
-# モデル準備
-model = SentenceTransformer('all-MiniLM-L6-v2')
+import pptxxmlanalyzer
+import slideembedding
+import slidealign
+import slidecompare
+import instrument
+
+# モデル (sentence-transformers) は最初の encode の時に読み込まれる（slideembedding.encode_texts()）
+# 環境変数 COMPARE_PPTX_EMBED_STORE でテキストベクトルの永続ストアを指定できる
 
 # スライドサイズ（PowerPointデフォルト、ポイント単位）
 SLIDE_WIDTH = 914400
 SLIDE_HEIGHT = 514350
 
-# PowerPointファイルからテキスト＋位置情報を抽出
-def extract_slide_shapes(pptx_path):
-    prs = Presentation(pptx_path)
-    slide_vectors = []
+# スライド類似度行列を計算するときの、shape×shape の類似度行列のブロックの上限（バイト）
+# これを超える場合は、a 側のスライドを分けて計算する
+max_block_bytes = 256 * 1024 * 1024
 
-    for slide in prs.slides:
-        shape_vectors = []
-        for shape in slide.shapes:
-            if not shape.has_text_frame:
-                continue
-            text = shape.text.strip()
-            if not text:
-                continue
+# --align で対応付けの対象とするスライド類似度の下限
+align_threshold = 0.5
+
+# PowerPointファイルから各スライドのテキストと位置情報を抽出する
+# (テキストのリスト, 位置ベクトルの行列 (shape数, 4), スライドごとの先頭 shape の位置 (スライド数+1,)) を返す
+# スライド i の shape は offsets[i]:offsets[i+1] の行
+def extract_deck_shapes(pptx_path):
+    texts = []
+    positions = []
+    offsets = [0]
 
-            # テキストベクトル
-            text_vec = model.encode(text)
+    for slide in pptxxmlanalyzer.analyze_pptx(pptx_path)["slides"]:
+        for shape in slide["shapes"]:
+            if shape["type"] != "text":
+                continue
+            texts.append(shape["text"])
 
             # 位置ベクトル（正規化）
-            if hasattr(shape, 'left'):
-                pos_vec = np.array([
-                    shape.left / SLIDE_WIDTH,
-                    shape.top / SLIDE_HEIGHT,
-                    shape.width / SLIDE_WIDTH,
-                    shape.height / SLIDE_HEIGHT
-                ])
-            else:
-                pos_vec = np.zeros(4)
+            left, top, width, height = pptxxmlanalyzer.position_emu(shape)
+            positions.append([
+                left / SLIDE_WIDTH,
+                top / SLIDE_HEIGHT,
+                width / SLIDE_WIDTH,
+                height / SLIDE_HEIGHT
+            ])
+        offsets.append(len(texts))
+
+    return texts, np.array(positions, dtype=np.float64).reshape(-1, 4), np.array(offsets, dtype=np.int64)
+
+# テキストベクトルと位置ベクトルを結合した行列 (shape数, 384+4) を返す
+def combine_vectors(text_vecs, positions):
+    return np.concatenate([np.asarray(text_vecs, dtype=np.float64).reshape(len(positions), -1), positions], axis=1)
+
+# 複数のファイルの shape のテキストを1回でまとめてベクトル化し、
+# ファイルごとに (結合ベクトルの行列, offsets) を返す
+def encode_decks(pptx_paths):
+    decks = []
+    for path in pptx_paths:
+        with instrument.span("extract", file=os.path.basename(path)) as span:
+            decks.append(extract_deck_shapes(path))
+            span.set(slides=len(decks[-1][2]) - 1)
+        instrument.count("slides", len(decks[-1][2]) - 1)
+    text_vecs = slideembedding.encode_texts([text for texts, _, _ in decks for text in texts])
 
-            # 結合ベクトル（テキスト + 位置）
-            combined = np.concatenate([text_vec, pos_vec])
-            shape_vectors.append(combined)
+    results = []
+    start = 0
+    for texts, positions, offsets in decks:
+        results.append((combine_vectors(text_vecs[start:start + len(texts)], positions), offsets))
+        start += len(texts)
+    return results
 
-        slide_vectors.append(shape_vectors)
-    return slide_vectors  # List[List[np.ndarray]] 各スライドのshapeベクトル群
+# PowerPointファイルからテキスト＋位置情報を抽出
+# （pptxxmlanalyzer でスライドの XML を直接読む）
+def extract_slide_shapes(pptx_path):
+    (matrix, offsets), = encode_decks([pptx_path])
+    return [list(matrix[offsets[i]:offsets[i + 1]]) for i in range(len(offsets) - 1)]  # List[List[np.ndarray]] 各スライドのshapeベクトル群
 
 # shape同士の類似度を比較してマッチ数を数える
 def slide_similarity(vecs1, vecs2, threshold=0.85):
-    if not vecs1 or not vecs2:
+    if not len(vecs1) or not len(vecs2):
         return 0.0
-
-    sim_matrix = cosine_similarity(vecs1, vecs2)
-
-    matched = 0
-    used_b_indices = set()
-
-    for i in range(len(vecs1)):
-        # 各 shape A[i] について最も近い shape B[j] を探す
-        best_j = np.argmax(sim_matrix[i])
-        if sim_matrix[i][best_j] > threshold and best_j not in used_b_indices:
-            matched += 1
-            used_b_indices.add(best_j)
-
-    total_possible = min(len(vecs1), len(vecs2))
-    return matched / total_possible if total_possible else 0.0
+    vecs1 = np.asarray(vecs1, dtype=np.float64)
+    vecs2 = np.asarray(vecs2, dtype=np.float64)
+    scores = slide_similarity_matrix(vecs1, np.array([0, len(vecs1)]), vecs2, np.array([0, len(vecs2)]), threshold)
+    return float(scores[0, 0])
+
+# 全スライドの組み合わせの類似度行列 (a のスライド数, b のスライド数) を返す
+# matrix_*, offsets_* は encode_decks() の戻り値
+#
+# 各 shape A[r] について、スライド j の shape の中で最も近い shape（最初の最大値）を探し、
+# 類似度が threshold を超える A[r] の最も近い shape の種類数をマッチ数とする
+# （shape ごとに最も近い shape が使用済みでなければマッチとする、と同じ結果）
+# shape×shape の類似度行列は1回の行列積で計算し、スライドごとの集計は reduceat で行う
+def slide_similarity_matrix(matrix_a, offsets_a, matrix_b, offsets_b, threshold=0.85):
+    counts_a = np.diff(offsets_a)
+    counts_b = np.diff(offsets_b)
+    scores = np.zeros((len(counts_a), len(counts_b)), dtype=np.float64)
+
+    # shape のないスライドは類似度 0 なので除く
+    slides_b = np.flatnonzero(counts_b)
+    if not len(slides_b) or not len(matrix_a):
+        return scores
+    starts_b = offsets_b[slides_b]
+    columns = np.arange(matrix_b.shape[0])
+
+    # 入力の型のまま正規化する（slide_similarity() は float64 で渡す）
+    normalized_a = slidecompare.normalize_rows(matrix_a, matrix_a.dtype)
+    normalized_b = slidecompare.normalize_rows(matrix_b, matrix_b.dtype)
+
+    # メモリの上限に収まるように a 側のスライドを分ける
+    rows_per_block = max(1, max_block_bytes // (8 * 3 * max(1, matrix_b.shape[0])))
+    slide = 0
+    while slide < len(counts_a):
+        end = slide + 1
+        while end < len(counts_a) and offsets_a[end + 1] - offsets_a[slide] <= rows_per_block:
+            end += 1
+        first, last = offsets_a[slide], offsets_a[end]
+        if last > first:
+            similarity = normalized_a[first:last] @ normalized_b.T
+
+            # スライド j ごとの最大値と、最初に最大値となる列
+            best = np.maximum.reduceat(similarity, starts_b, axis=1)
+            is_best = similarity == np.repeat(best, counts_b[slides_b], axis=1)
+            best_column = np.minimum.reduceat(np.where(is_best, columns, matrix_b.shape[0]), starts_b, axis=1)
+
+            # a のスライドごとに、閾値を超えた最も近い shape に印をつけて種類数を数える
+            row_slide = np.repeat(np.arange(end - slide), counts_a[slide:end])
+            valid_rows, valid_slides = np.nonzero(best > threshold)
+            marked = np.zeros((end - slide, matrix_b.shape[0]), dtype=np.int64)
+            marked[row_slide[valid_rows], best_column[valid_rows, valid_slides]] = 1
+            matched = np.add.reduceat(marked, starts_b, axis=1)
+
+            total_possible = np.minimum(counts_a[slide:end, None], counts_b[None, slides_b])
+            scores[slide:end, slides_b] = np.where(total_possible > 0, matched / np.maximum(total_possible, 1), 0.0)
+        slide = end
+
+    return scores
 
 # ファイル間の全スライド類似度を計算
 def compare_presentations(file_a, file_b):
-    slides_a = extract_slide_shapes(file_a)
-    slides_b = extract_slide_shapes(file_b)
+    (matrix_a, offsets_a), (matrix_b, offsets_b) = encode_decks([file_a, file_b])
+    pairs = (len(offsets_a) - 1) * (len(offsets_b) - 1)
+    with instrument.span("similarity", pairs=pairs):
+        scores = slide_similarity_matrix(matrix_a, offsets_a, matrix_b, offsets_b)
+    instrument.count("pairs", pairs)
 
     results = []
-    for i, vecs_a in enumerate(slides_a):
-        for j, vecs_b in enumerate(slides_b):
-            score = slide_similarity(vecs_a, vecs_b)
-            results.append((i+1, j+1, score))
+    for i in range(scores.shape[0]):
+        for j in range(scores.shape[1]):
+            results.append((i+1, j+1, float(scores[i, j])))
     return results
 
+# スライドの順序を考慮して対応付ける（slidealign.py）
+# 全スライドの組み合わせではなく、対角線の周りの帯の中のペアと、帯の中で対応が付かなかったスライド同士のペアだけを比較する
+# b（新しい方）のスライドごとに (番号, 分類, 対応する a のスライド番号 or None, 類似度) のリストと、削除された a のスライド番号のリストを返す（番号は 1 から）
+def align_presentations(file_a, file_b, band=slidealign.default_band, threshold=align_threshold):
+    (matrix_a, offsets_a), (matrix_b, offsets_b) = encode_decks([file_a, file_b])
+    scores = {}
+
+    def score(rows, cols):
+        weights = np.zeros(len(rows))
+        for k, (j, i) in enumerate(zip(rows, cols)):
+            similarity = slide_similarity(matrix_b[offsets_b[j]:offsets_b[j + 1]], matrix_a[offsets_a[i]:offsets_a[i + 1]])
+            scores[(int(j), int(i))] = similarity
+            weights[k] = similarity if similarity >= threshold else 0.0
+        return weights
+
+    with instrument.span("align") as span:
+        alignment = slidealign.align_slides(len(offsets_b) - 1, len(offsets_a) - 1, score, band)
+        span.set(pairs=alignment["scored"])
+    instrument.count("pairs", alignment["scored"])
+    statuses = slidealign.classify(len(offsets_b) - 1, alignment, lambda j, i: scores[(j, i)] >= 1.0)
+    results = []
+    for j, (status, i) in enumerate(statuses):
+        results.append((j + 1, status, None if i is None else i + 1, None if i is None else scores[(j, i)]))
+    return results, [i + 1 for i in alignment["removed"]]
+
 # 使用例
-if __name__ == "__main__":
-    pptx_a = "example/tvdiffsample1.pptx"
-    pptx_b = "example/tvdiffsample2.pptx"
+def main():
+    parser = argparse.ArgumentParser(description="2つの pptx ファイルのスライド類似度（テキスト＋位置）")
+    parser.add_argument("pptx_a", nargs="?", default="example/tvdiffsample1.pptx", help="比較元の pptx ファイル")
+    parser.add_argument("pptx_b", nargs="?", default="example/tvdiffsample2.pptx", help="比較対象の pptx ファイル（新しい方）")
+    parser.add_argument("--align", action="store_true", help="スライドの順序を考慮して対応付け、B のスライドを unchanged/modified/moved/added に分類する")
+    parser.add_argument("--band", type=int, default=slidealign.default_band, help=f"--align で比較する帯の幅、対角線から前後何枚まで（デフォルト: {slidealign.default_band}）")
+    parser.add_argument("--profile", type=str, nargs="?", const="trace.json", default=None, metavar="TRACEFILE", help="段階ごとの時間を計り、Chrome のトレース (JSON) と集計表を出力する（デフォルト: trace.json）")
+    parser.add_argument("--profile-stage", type=str, default=None, help="--profile で、この名前の段階を cProfile でも計測する（extract, encode, similarity, align）")
+    args = parser.parse_args()
+    if args.profile is not None:
+        instrument.enable(args.profile_stage)
+
+    if args.align:
+        results, removed = align_presentations(args.pptx_a, args.pptx_b, args.band)
+        for j, status, i, s in results:
+            if i is None:
+                print(f"Slide B#{j} → {status}")
+            else:
+                print(f"Slide B#{j} → {status} (Slide A#{i}, 類似度: {s:.2f})")
+        for i in removed:
+            print(f"Slide A#{i} → removed")
+    else:
+        scores = compare_presentations(args.pptx_a, args.pptx_b)
+        for i, j, s in scores:
+            print(f"Slide A#{i} vs Slide B#{j} → 類似度: {s:.2f}")
+
+    if args.profile is not None:
+        instrument.finish(args.profile)
 
-    scores = compare_presentations(pptx_a, pptx_b)
-    for i, j, s in scores:
-        print(f"Slide A#{i} vs Slide B#{j} → 類似度: {s:.2f}")
+
+if __name__ == "__main__":
+    main()